@@ -0,0 +1,338 @@
+"""
+端到端基准: 在进程内通过 ASGI 调用真实的 ``main.app``, 统计吞吐量和 p50/p99 延迟
+
+数据库使用临时 SQLite 文件(含 2000 门课程), Redis 使用 fakeredis(未安装时连接
+``REDIS_HOST`` 上的真实 Redis). 应用按正常流程执行 lifespan 启动与关闭, 基准期间
+标准输出重定向到 /dev/null, 避免日志输出影响结果.
+
+场景:
+
+- ``error:*``: 三个异常处理器(404、HTTPException、未处理异常)
+- ``settings``: ``GET /settings``(响应缓存命中)
+- ``jwt:*``: 令牌签发与校验, 以及携带令牌的请求
+- ``bcrypt:*``: 密码哈希与校验(线程池)
+- ``page:*``: 课程游标分页查询
+
+运行::
+
+    python -m benchmarks.bench_api                          # 运行并打印结果
+    python -m benchmarks.bench_api --save                   # 保存为基线 benchmarks/baselines/api.json
+    python -m benchmarks.bench_api --compare                # 与基线对比, 有退化时退出码为 1
+    python -m benchmarks.bench_api --only jwt --requests 5000
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.bench_startup import prepare_database
+
+BASELINE = Path(__file__).resolve().parent / "baselines" / "api.json"
+
+# 场景函数: (客户端, 序号) -> None, 出错时抛出异常
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[None]]
+
+# bcrypt 很慢, 单独限制请求数
+REQUEST_LIMITS = {"bcrypt:encode": 50, "bcrypt:matches": 50}
+
+
+async def _expect(response: Awaitable[httpx.Response], status: int) -> None:
+    response = await response
+    if response.status_code != status:
+        raise AssertionError(f"{response.request.url.path}: {response.status_code} != {status}")
+
+
+def _install_fake_redis() -> bool:
+    """让 common.redis 的连接池改用 fakeredis 的连接, 所有共享连接池的客户端随之生效"""
+    try:
+        import fakeredis
+        from fakeredis.aioredis import FakeConnection
+    except ImportError:
+        return False
+    from common.redis import async_redis_pool, redis_client
+
+    server = fakeredis.FakeServer()
+    async_redis_pool.connection_class = FakeConnection
+    async_redis_pool.connection_kwargs["server"] = server
+    # 内存中的连接不需要也不支持健康检查的 PING
+    async_redis_pool.connection_kwargs["health_check_interval"] = 0
+    redis_client.connection_pool.connection_class = fakeredis.FakeConnection
+    redis_client.connection_pool.connection_kwargs["server"] = server
+    return True
+
+
+def _add_bench_routes(app) -> None:
+    """基准专用路由: 只在本进程内注册"""
+    from fastapi import Depends, HTTPException
+    from sqlmodel import select
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from common.jwt import get_current_claims
+    from common.models import CursorPage, ResponsePayloads
+    from db.models import Course
+    from db.pagination import paginate_keyset
+    from db.session import get_session
+
+    async def forbidden():
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    async def crash():
+        raise RuntimeError("bench")
+
+    async def me(claims: dict = Depends(get_current_claims)):
+        return ResponsePayloads(data={"sub": claims["sub"]})
+
+    async def courses(cursor: Optional[str] = None, session: AsyncSession = Depends(get_session)):
+        page = await paginate_keyset(
+            session, select(Course), [Course.created_at, Course.id], cursor=cursor, limit=20
+        )
+        return ResponsePayloads(data=page)
+
+    app.add_api_route("/__bench/forbidden", forbidden)
+    app.add_api_route("/__bench/crash", crash)
+    app.add_api_route("/__bench/me", me)
+    app.add_api_route("/__bench/courses", courses, response_model=ResponsePayloads[CursorPage[Course]])
+
+
+async def _cursors(client: httpx.AsyncClient, pages: int = 50) -> List[Optional[str]]:
+    """预先翻页取得各页游标, 分页场景轮流请求这些页"""
+    cursors: List[Optional[str]] = [None]
+    while len(cursors) < pages:
+        body = (await client.get("/__bench/courses", params={"cursor": cursors[-1]} if cursors[-1] else None)).json()
+        if not body["data"]["next_cursor"]:
+            break
+        cursors.append(body["data"]["next_cursor"])
+    return cursors
+
+
+async def _scenarios(client: httpx.AsyncClient) -> Dict[str, Scenario]:
+    from common.bcrypt import default_password_encoder
+    from common.jwt import create_jwt_token, verify_jwt_token
+
+    token = create_jwt_token({"sub": "1"})
+    encoded = default_password_encoder.encode("bench-password")
+    cursors = await _cursors(client)
+
+    async def error_404(c, i):
+        await _expect(c.get(f"/missing/{i}"), 404)
+
+    async def error_http(c, i):
+        await _expect(c.get("/__bench/forbidden"), 403)
+
+    async def error_500(c, i):
+        await _expect(c.get("/__bench/crash"), 500)
+
+    async def site_settings(c, i):
+        await _expect(c.get("/settings"), 200)
+
+    async def jwt_create_verify(c, i):
+        verify_jwt_token(create_jwt_token({"sub": str(i)}))
+
+    async def jwt_request(c, i):
+        await _expect(c.get("/__bench/me", headers={"Authorization": f"Bearer {token}"}), 200)
+
+    async def bcrypt_encode(c, i):
+        await default_password_encoder.encode_async("bench-password")
+
+    async def bcrypt_matches(c, i):
+        if not await default_password_encoder.matches_async("bench-password", encoded):
+            raise AssertionError("password mismatch")
+
+    async def page_first(c, i):
+        await _expect(c.get("/__bench/courses"), 200)
+
+    async def page_cursor(c, i):
+        cursor = cursors[i % len(cursors)]
+        await _expect(c.get("/__bench/courses", params={"cursor": cursor} if cursor else None), 200)
+
+    return {
+        "error:404": error_404,
+        "error:http": error_http,
+        "error:500": error_500,
+        "settings": site_settings,
+        "jwt:create+verify": jwt_create_verify,
+        "jwt:request": jwt_request,
+        "bcrypt:encode": bcrypt_encode,
+        "bcrypt:matches": bcrypt_matches,
+        "page:first": page_first,
+        "page:cursor": page_cursor,
+    }
+
+
+async def run_scenario(
+    scenario: Scenario, client: httpx.AsyncClient, requests: int, concurrency: int
+) -> Dict[str, float]:
+    """
+    以固定并发执行场景
+
+    Args:
+        scenario: 场景函数
+        client: 客户端
+        requests: 总请求数
+        concurrency: 并发数
+
+    Returns:
+        请求数、错误数、吞吐量(每秒请求数)与 p50/p99 延迟(毫秒)
+    """
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                await scenario(client, i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    # 预热几次, 不计入结果
+    for i in range(min(10, requests)):
+        await scenario(client, i)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+@contextlib.contextmanager
+def _quiet() -> Iterator[None]:
+    """把文件描述符 1 重定向到 /dev/null(日志处理器直接写标准输出)"""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+async def run(requests: int, concurrency: int, only: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    """
+    启动应用并执行全部(或 ``only`` 前缀匹配的)场景
+
+    Returns:
+        场景名 -> 结果
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Path(tmp) / "bench.db"
+        prepare_database(database)
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{database}"
+        os.environ.setdefault("WARMUP_PATHS", json.dumps(["/catalog/tags"]))
+
+        import main
+
+        if not _install_fake_redis():
+            print("未安装 fakeredis, 使用真实 Redis", file=sys.stderr)
+        _add_bench_routes(main.app)
+
+        results = {}
+        with _quiet():
+            async with main.app.router.lifespan_context(main.app):
+                transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    for name, scenario in (await _scenarios(client)).items():
+                        if only and not any(name.startswith(prefix) for prefix in only):
+                            continue
+                        n = min(requests, REQUEST_LIMITS.get(name, requests))
+                        results[name] = await run_scenario(scenario, client, n, concurrency)
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float
+) -> List[Tuple[str, str, float, float]]:
+    """
+    与基线对比
+
+    吞吐量低于基线的 ``1 - threshold`` 倍, 或 p50/p99 高于基线的 ``1 + threshold`` 倍视为退化.
+
+    Returns:
+        退化项列表: (场景, 指标, 基线值, 当前值)
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append((name, "rps", base["rps"], result["rps"]))
+        for metric in ("p50_ms", "p99_ms"):
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def _print(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]] = None) -> None:
+    print(f"{'场景':<22}{'请求':>8}{'错误':>6}{'吞吐(/s)':>12}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['requests']:>8}{r['errors']:>6}{r['rps']:>12.0f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+        base = (baseline or {}).get(name)
+        if base:
+            change = {k: (r[k] / base[k] - 1) * 100 if base[k] else 0.0 for k in ("rps", "p50_ms", "p99_ms")}
+            print(
+                f"{'  对比基线':<36}{change['rps']:>+11.0f}%{change['p50_ms']:>+9.0f}%{change['p99_ms']:>+9.0f}%"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="端到端 API 基准")
+    parser.add_argument("--requests", type=int, default=2000, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发数")
+    parser.add_argument("--only", nargs="*", help="只运行名称以这些前缀开头的场景")
+    parser.add_argument("--save", nargs="?", const=BASELINE, type=Path, help="保存为基线")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, type=Path, help="与基线对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定退化的相对变化")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.requests, args.concurrency, args.only))
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+    _print(results, baseline)
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        }
+        args.save.write_text(json.dumps({"meta": meta, "results": results}, indent=2, ensure_ascii=False) + "\n")
+        print(f"基线已保存: {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f"退化: {name} {metric} {before:.2f} -> {after:.2f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+导入耗时基准: 用 ``python -X importtime`` 统计各入口模块的导入耗时
+
+每个模块在新的子进程中导入若干次取中位数, 同时列出导入了哪些重量级依赖.
+``BUDGETS`` 是各入口的耗时上限; 耗时受机器影响, ``db/__test__.py`` 只检查导入后
+``sys.modules`` 中有哪些模块, 上限由 ``--check`` 在固定的机器上(例如 CI)检查.
+
+运行:
+    python -m benchmarks.bench_import            # 打印各入口的导入耗时
+    python -m benchmarks.bench_import --check    # 中位数超过上限时退出码为 1
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 入口模块 -> 导入耗时上限(毫秒). 约为当前耗时的 1.5~10 倍, 留出机器差异的余量,
+# 但低于改为按需导入之前的耗时(common 约 820, common.configs 约 900, db.models 约 1400)
+BUDGETS: Dict[str, float] = {
+    "common": 50.0,
+    "common.configs": 600.0,
+    "db.models": 1200.0,
+}
+
+# 只需要配置或模型时不应导入的运行时依赖
+HEAVY_MODULES = ("redis", "loguru", "bcrypt", "jwt", "fastapi", "asyncpg")
+
+# 入口模块 -> 导入后允许出现的本项目模块
+PROJECT_MODULES: Dict[str, FrozenSet[str]] = {
+    "common": frozenset({"common"}),
+    "common.configs": frozenset({"common", "common.configs", "common.models"}),
+    "db.models": frozenset({"db", "db.models"}),
+}
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)")
+
+
+def import_profile(module: str) -> Tuple[float, List[str]]:
+    """
+    在新进程中导入模块
+
+    Args:
+        module: 模块名
+
+    Returns:
+        (总耗时毫秒, 导入的全部模块名)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    modules = []
+    for match in _LINE.finditer(result.stderr):
+        modules.append(match.group(4))
+        # 顶层(无缩进)条目的累计耗时之和即总耗时; site 等解释器启动的导入不计入
+        if match.group(3) == " " and match.group(4) != "site":
+            total += int(match.group(2))
+    return total / 1000, modules
+
+
+def imported_modules(module: str) -> Set[str]:
+    """
+    在新进程中导入模块, 返回导入后 ``sys.modules`` 中的全部模块名
+
+    Args:
+        module: 模块名
+
+    Returns:
+        模块名集合
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print('\\n'.join(sys.modules))"],
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stdout.split())
+
+
+def measure(module: str, repeat: int = 3) -> Tuple[float, List[str]]:
+    """多次导入取中位数"""
+    runs = [import_profile(module) for _ in range(repeat)]
+    return statistics.median(t for t, _ in runs), runs[0][1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="导入耗时基准")
+    parser.add_argument("--check", action="store_true", help="有入口的中位数超过上限时以退出码 1 结束")
+    parser.add_argument("--repeat", type=int, default=3, help="每个模块导入的次数")
+    args = parser.parse_args()
+
+    over = []
+    print(f"{'模块':<20}{'耗时(ms)':>10}{'上限(ms)':>10}  重量级依赖")
+    for module in (*BUDGETS, "db", "common.redis", "main"):
+        elapsed, modules = measure(module, args.repeat)
+        heavy = sorted({m.split(".")[0] for m in modules} & set(HEAVY_MODULES))
+        budget = BUDGETS.get(module)
+        if budget is not None and elapsed > budget:
+            over.append(module)
+        print(f"{module:<20}{elapsed:>10.1f}{budget or float('nan'):>10.0f}  {', '.join(heavy) or '-'}")
+
+    if args.check and over:
+        print(f"超出导入耗时上限: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+日志基准: 每个处理器一个队列(原配置)与单一 LogRouter 对比
+
+以聊天日志为主的混合负载写入临时目录, 标准输出重定向到 /dev/null.
+分别统计调用方耗时(记录入队)和全部写完的总耗时.
+
+运行: python -m benchmarks.bench_logging
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Tuple
+
+from loguru import logger
+
+from common.log import LogRouter, shutdown_logger
+
+NUMBER = 20000
+FILE_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
+
+
+def _legacy(log_path: Path) -> None:
+    """原 configure_logger 的六个 enqueue 处理器"""
+    logger.add(sys.stdout, format=FILE_FORMAT, level="DEBUG", enqueue=True)
+    file_options = dict(
+        format=FILE_FORMAT, rotation="1 day", retention="30 days", compression="zip", enqueue=True
+    )
+    logger.add(log_path / "info.log", level="DEBUG", **file_options)
+    logger.add(log_path / "error.log", level="ERROR", **file_options)
+    for name in ("agents", "chat", "payment"):
+        logger.add(
+            log_path / f"{name}.log",
+            filter=lambda record, name=name: record.get("extra", {}).get("name") == name,
+            level="DEBUG",
+            **file_options,
+        )
+
+
+def _routed(log_path: Path) -> LogRouter:
+    router = LogRouter(log_path, level_no=logger.level("DEBUG").no)
+    logger.add(router, format="{message}", level="DEBUG", enqueue=True)
+    return router
+
+
+def _workload(number: int) -> None:
+    chat = logger.bind(name="chat")
+    payment = logger.bind(name="payment")
+    agents = logger.bind(name="agents")
+    for i in range(number):
+        if i % 10 < 8:
+            chat.info(f"chat message {i} from conversation")
+        elif i % 10 == 8:
+            agents.debug(f"agent step {i}")
+        elif i % 100 == 99:
+            payment.error(f"payment failed {i}")
+        else:
+            logger.info(f"request {i}")
+
+
+def _bench(setup) -> Tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        logger.remove()
+        router = setup(Path(tmp))
+        start = time.perf_counter()
+        _workload(NUMBER)
+        enqueued = time.perf_counter() - start
+        logger.complete()
+        logger.remove()
+        if router is not None:
+            router.stop()
+        total = time.perf_counter() - start
+    return enqueued, total
+
+
+def main() -> None:
+    shutdown_logger()
+    cases = (("六个处理器(原配置)", _legacy), ("LogRouter", _routed))
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            results = [(label, *_bench(setup)) for label, setup in cases]
+        finally:
+            sys.stdout = stdout
+
+    print(f"{NUMBER} 条日志, 80% 聊天通道:")
+    for label, enqueued, total in results:
+        print(f"  {label:<20} 入队 {enqueued / NUMBER * 1e6:7.2f} us/条  吞吐 {NUMBER / total:8.0f} 条/秒")
+    print(f"  提升 {results[0][2] / results[1][2]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
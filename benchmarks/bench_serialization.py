@@ -0,0 +1,78 @@
+"""
+响应序列化基准: JSONResponse(model_dump()) 与 PayloadResponse 对比
+
+运行: python -m benchmarks.bench_serialization
+"""
+import timeit
+from datetime import datetime
+from typing import List
+
+from starlette.responses import JSONResponse
+
+from common.models import DataPage, Error, ResponsePayloads
+from common.responses import PayloadResponse, error_response
+from db.models import DifyApp, DifyAppMode
+
+NUMBER = 20000
+
+
+def _apps(n: int) -> List[DifyApp]:
+    now = datetime.now()
+    return [
+        DifyApp(
+            id=f"app-{i}",
+            name=f"应用{i}",
+            description="这是一个用于基准测试的应用描述" * 3,
+            mode=DifyAppMode.CHAT,
+            tags=["写作", "办公", f"tag{i % 7}"],
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(n)
+    ]
+
+
+def _bench(label: str, fn, number: int) -> float:
+    seconds = min(timeit.repeat(fn, number=number, repeat=3))
+    per_call = seconds / number * 1e6
+    print(f"  {label:<36} {per_call:8.2f} us/op")
+    return per_call
+
+
+def main() -> None:
+    error = ResponsePayloads(error=Error(type="NotFound", message="Not Found", code=404))
+    page = ResponsePayloads[DataPage[DifyApp]](
+        data=DataPage[DifyApp](items=_apps(50), total=50, has_more=False)
+    )
+
+    cases = [
+        ("404 错误", error, NUMBER),
+        ("50 条应用分页", page, NUMBER // 20),
+    ]
+    for title, payload, number in cases:
+        print(f"{title}:")
+        base = _bench(
+            "JSONResponse(model_dump())",
+            lambda: JSONResponse(content=payload.model_dump(mode="json")),
+            number,
+        )
+        fast = _bench("PayloadResponse(model)", lambda: PayloadResponse(content=payload), number)
+        print(f"  提升 {base / fast:.1f}x")
+
+    print("404 错误(预编码):")
+    base = _bench(
+        "JSONResponse(model_dump())",
+        lambda: JSONResponse(
+            status_code=404,
+            content=ResponsePayloads(
+                error=Error(type="NotFound", message="Not Found", code=404)
+            ).model_dump(),
+        ),
+        NUMBER,
+    )
+    fast = _bench("error_response()", lambda: error_response(404, "NotFound", "Not Found"), NUMBER)
+    print(f"  提升 {base / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
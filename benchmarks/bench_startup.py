@@ -0,0 +1,104 @@
+"""
+启动基准: worker 启动后前几个请求的耗时, 关闭预热与开启预热对比
+
+每轮在新的子进程中导入应用、执行 lifespan 启动, 然后在进程内依次请求几个路径两次,
+第一次的耗时即 "首个请求" 的代价, 第二次作为稳态参考. 数据库使用临时 SQLite 文件
+(含 2000 门课程), 这里没有 Redis, 因此只请求不依赖 Redis 的路径.
+
+运行: python -m benchmarks.bench_startup
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PATHS = ["/catalog/search?q=python", "/catalog/tags", "/openapi.json"]
+ROUNDS = 5
+
+
+async def _child() -> None:
+    started = time.perf_counter()
+    import main
+    from common.lifecycle import asgi_get
+
+    imported = time.perf_counter()
+    timings = {"import": imported - started}
+    async with main.app.router.lifespan_context(main.app):
+        timings["startup"] = time.perf_counter() - imported
+        for path in PATHS:
+            for attempt in ("first", "second"):
+                start = time.perf_counter()
+                status, _ = await asgi_get(main.app, path)
+                assert status == 200, (path, status)
+                timings[f"{attempt} {path}"] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def prepare_database(database: Path) -> None:
+    """创建表结构并写入 2000 门课程"""
+    import sqlite3
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.dialects.postgresql import JSONB
+    from sqlalchemy.ext.compiler import compiles
+    from sqlmodel import SQLModel
+
+    import db.models  # noqa: F401
+
+    @compiles(JSONB, "sqlite")
+    def _jsonb(element, compiler, **kw):
+        return "JSON"
+
+    SQLModel.metadata.create_all(create_engine(f"sqlite:///{database}"))
+    with sqlite3.connect(database) as conn:
+        conn.executemany(
+            "INSERT INTO qu_courses (id, title, description, price, tags, created_at, updated_at)"
+            " VALUES (?, ?, ?, 0, ?, datetime('now'), datetime('now'))",
+            [
+                (i, f"Python 课程 {i}", f"第 {i} 期数据分析实战", json.dumps([f"tag{i % 20}", "python"]))
+                for i in range(1, 2001)
+            ],
+        )
+
+
+def _run(database: Path, warm: bool) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite+aiosqlite:///{database}",
+        WARMUP_ENABLED=str(warm).lower(),
+        WARMUP_PATHS=json.dumps(["/catalog/tags"]),
+        WARMUP_TIMEOUT="2",
+    )
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Path(tmp) / "bench.db"
+        prepare_database(database)
+        results = {warm: [_run(database, warm) for _ in range(ROUNDS)] for warm in (False, True)}
+
+    names = list(results[False][0])
+    print(f"{'':<34}{'不预热(ms)':>12}{'预热(ms)':>12}")
+    for name in names:
+        cold, warm = (statistics.median(r[name] for r in results[w]) * 1000 for w in (False, True))
+        print(f"{name:<34}{cold:>12.1f}{warm:>12.1f}")
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        asyncio.run(_child())
+    else:
+        main()
@@ -0,0 +1,19 @@
+from .base import IncrementalIndex, refresh_indexes
+from .routes import router
+from .search import SearchHit, SearchIndex, app_search_index, course_search_index, keyword_filter
+from .tags import TagIndex, app_tag_index, course_tag_index, tag_filter
+
+__all__ = [
+    "router",
+    "IncrementalIndex",
+    "refresh_indexes",
+    "SearchHit",
+    "SearchIndex",
+    "app_search_index",
+    "course_search_index",
+    "keyword_filter",
+    "TagIndex",
+    "app_tag_index",
+    "course_tag_index",
+    "tag_filter",
+]
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import JSON, Column, DateTime, Integer, String, insert, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.session import create_engine
+from .search import SearchIndex
+from .tags import TagIndex
+
+
+class _Base(DeclarativeBase):
+    pass
+
+
+class Item(_Base):
+    """测试用模型, 使用独立的 metadata"""
+
+    __tablename__ = "catalog_test_items"
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
+    tags = Column(JSON)
+    updated_at = Column(DateTime)
+
+
+def test_tag_index_publishes_rebuilt_state_at_once():
+    """重建生成新的状态对象一次替换, 查询中持有的旧状态不受影响; 增量更新与重建结果一致"""
+    index = TagIndex(Item)
+    index.rebuild([(1, ["python", "ai"]), (2, ["python"]), (3, [])])
+    old = index._state
+    assert index.filter(all_of=["python"]) == [1, 2]
+    assert index.facets() == {"python": 2, "ai": 1}
+
+    index.rebuild([(1, ["go"])])
+    assert index._state is not old
+    assert list(old.tags) == [1, 2, 3]
+    assert index.filter(any_of=["python", "go"]) == [1]
+
+    index.upsert(2, ["go", "ai"])
+    index.remove(1)
+    index.upsert(4, ["ai"])
+    assert index.filter(all_of=["ai"]) == [2, 4]
+    assert index.facets([2]) == {"ai": 1, "go": 1}
+    assert len(index) == 2
+
+
+def test_search_index_incremental_matches_rebuild():
+    """增量写入、更新和删除后的搜索结果与全量重建相同"""
+    rows = [(1, "Python 数据分析", "pandas 入门"), (2, "Python 爬虫", ""), (3, "机器学习", "python 实战")]
+    rebuilt = SearchIndex(Item)
+    rebuilt.rebuild(rows)
+
+    incremental = SearchIndex(Item)
+    incremental.rebuild([(3, "旧标题", ""), (9, "已删除", "")])
+    for row in rows:
+        incremental.upsert(*row)
+    incremental.remove(9)
+
+    for index in (rebuilt, incremental):
+        assert [hit.id for hit in index.search("python")] == ["2", "1", "3"]
+        assert [hit.id for hit in index.search("数据")] == ["1"]
+        assert index.suggest("py") == ["Python 数据分析", "Python 爬虫"]
+        assert index.search("已删除") == []
+
+
+def test_incremental_refresh_picks_up_late_commits(tmp_path):
+    """updated_at 早于水位、提交晚于上次刷新的修改, 在回看窗口内仍会被加载"""
+
+    async def run():
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'catalog.db'}")
+        factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        index = TagIndex(Item, overlap=60)
+        now = datetime.now()
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(_Base.metadata.create_all)
+                await conn.execute(
+                    insert(Item.__table__),
+                    [dict(id=1, tags=["a"], updated_at=now), dict(id=2, tags=["b"], updated_at=now)],
+                )
+            async with factory() as session:
+                await index.ensure_fresh(session, force=True)
+            assert index.filter(all_of=["a"]) == [1]
+
+            # 另一个事务在刷新前 flush、刷新后才提交: 最大更新时间和行数都没有变化
+            async with engine.begin() as conn:
+                await conn.execute(
+                    update(Item.__table__)
+                    .where(Item.id == 2)
+                    .values(tags=["a"], updated_at=now - timedelta(seconds=5))
+                )
+            async with factory() as session:
+                await index.ensure_fresh(session, force=True)
+            assert index.filter(all_of=["a"]) == [1, 2]
+
+            # 新增的行同样在回看窗口内
+            async with engine.begin() as conn:
+                await conn.execute(insert(Item.__table__).values(id=3, tags=["a"], updated_at=now - timedelta(seconds=1)))
+            async with factory() as session:
+                await index.ensure_fresh(session, force=True)
+            assert index.filter(all_of=["a"]) == [1, 2, 3]
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,153 @@
+"""
+进程内索引的增量刷新
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+_REGISTRY: Dict[type, List["IncrementalIndex"]] = {}
+
+
+class IncrementalIndex:
+    """按 ``updated_at`` 水位增量刷新的进程内索引基类
+
+    ``ensure_fresh`` 最多每 ``refresh_interval`` 秒比较一次数据库的最大更新时间和行数,
+    有变化时只加载水位之后变化的行, 发现删除(行数对不上)时才全量重建.
+    本 worker 通过 ORM 提交的修改会立即应用.
+
+    ``updated_at`` 在 flush 时写入, 提交可能晚于其他更晚的行, 只看最大值会漏掉这些行.
+    因此增量加载从水位往前回看 ``overlap`` 秒; 最大更新时间距今不足 ``overlap`` 秒时,
+    即使最大值和行数都没变也继续回看, 直到最近的写事务都已提交.
+
+    子类实现 ``upsert(key, *values)``、``remove(key)``、``rebuild(rows)`` 和 ``__len__``,
+    其中 values 依次对应 ``columns``.
+
+    Args:
+        model: 带 ``id`` 和 ``updated_at`` 列的模型
+        columns: 需要加载的列名
+        refresh_interval: 检查数据库变化的最小间隔(秒)
+        overlap: 增量刷新时水位回看的时间(秒), 应覆盖最长的写事务
+    """
+
+    def __init__(self, model, columns: Sequence[str], refresh_interval: float = 5.0, overlap: float = 30.0):
+        self.model = model
+        self.columns = tuple(columns)
+        self.refresh_interval = refresh_interval
+        self.overlap = timedelta(seconds=overlap)
+        self._watermark: Optional[datetime] = None
+        self._count: Optional[int] = None
+        self._checked_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        _REGISTRY.setdefault(model, []).append(self)
+
+    def upsert(self, key: Hashable, *values) -> None:
+        raise NotImplementedError
+
+    def remove(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+    def rebuild(self, rows: Iterable[tuple]) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    async def ensure_fresh(self, session: AsyncSession, force: bool = False) -> None:
+        """
+        按需与数据库同步
+
+        Args:
+            session: 数据库会话
+            force: 忽略检查间隔
+        """
+        if not force and not self._due():
+            return
+        async with self._lock:
+            if not force and not self._due():
+                return
+            await self._refresh(session)
+            self._checked_at = time.monotonic()
+
+    def _due(self) -> bool:
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def _select(self):
+        return select(self.model.id, *(getattr(self.model, c) for c in self.columns))
+
+    async def _refresh(self, session: AsyncSession) -> None:
+        model = self.model
+        watermark, count = (
+            await session.exec(select(func.max(model.updated_at), func.count()).select_from(model))
+        ).one()
+        unchanged = self._count is not None and (watermark, count) == (self._watermark, self._count)
+        if unchanged and not self._settling():
+            return
+
+        if self._watermark is None or count < len(self):
+            await self._rebuild_from(session)
+        else:
+            # 重复应用同一行是幂等的
+            since = self._watermark - self.overlap
+            for key, *values in await session.exec(self._select().where(model.updated_at >= since)):
+                self.upsert(key, *values)
+            if len(self) != count:
+                await self._rebuild_from(session)
+        self._watermark, self._count = watermark, count
+
+    def _settling(self) -> bool:
+        """最近的写入是否可能还有未提交的事务"""
+        return self._watermark is not None and self._watermark > datetime.now() - self.overlap
+
+    async def _rebuild_from(self, session: AsyncSession) -> None:
+        rows = (await session.exec(self._select().order_by(self.model.id))).all()
+        # 大表重建耗时较长, 放到线程中执行, 避免长时间占用事件循环
+        await asyncio.to_thread(self.rebuild, rows)
+
+
+async def refresh_indexes(session: AsyncSession) -> int:
+    """
+    立即同步所有进程内索引, 用于启动预热
+
+    Args:
+        session: 数据库会话
+
+    Returns:
+        索引数
+    """
+    indexes = [index for indexes in _REGISTRY.values() for index in indexes]
+    for index in indexes:
+        await index.ensure_fresh(session, force=True)
+    return len(indexes)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_index_changes(session: Session, flush_context) -> None:
+    # flush 之后新对象已有主键; 在这里取值, 提交后不必再访问(可能已过期的)属性
+    changes = None
+    for objects, deleted in ((session.new, False), (session.dirty, False), (session.deleted, True)):
+        for obj in objects:
+            for index in _REGISTRY.get(type(obj), ()):
+                if changes is None:
+                    changes = session.info.setdefault("index_changes", {})
+                values = None if deleted else tuple(getattr(obj, c) for c in index.columns)
+                changes[(id(index), obj.id)] = (index, values)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_index_changes(session: Session) -> None:
+    for (_, key), (index, values) in session.info.pop("index_changes", {}).items():
+        if values is None:
+            index.remove(key)
+        else:
+            index.upsert(key, *values)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_index_changes(session: Session) -> None:
+    session.info.pop("index_changes", None)
@@ -0,0 +1,72 @@
+from typing import Dict, List
+
+from fastapi import APIRouter, Depends, Query
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.models import ResponsePayloads
+from db.models import AssetType
+from db.routing import get_read_session
+from .search import SearchHit, app_search_index, course_search_index
+from .tags import app_tag_index, course_tag_index
+
+router = APIRouter(prefix="/catalog", tags=["目录"])
+
+_SEARCH_INDEXES = {AssetType.COURSE: course_search_index, AssetType.APP: app_search_index}
+_TAG_INDEXES = {AssetType.COURSE: course_tag_index, AssetType.APP: app_tag_index}
+
+
+@router.get(
+    "/search",
+    summary="搜索课程或应用",
+    response_model=ResponsePayloads[List[SearchHit]],
+)
+async def search(
+    q: str = Query(..., min_length=1, max_length=64, description="关键词"),
+    kind: AssetType = Query(AssetType.COURSE, description="搜索对象"),
+    tags: List[str] = Query([], description="必须包含的标签"),
+    limit: int = Query(20, ge=1, le=100, description="最大结果数"),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """按标题和描述搜索, 可以同时按标签过滤"""
+    index = _SEARCH_INDEXES[kind]
+    await index.ensure_fresh(session)
+    keys = None
+    if tags:
+        tag_index = _TAG_INDEXES[kind]
+        await tag_index.ensure_fresh(session)
+        keys = set(tag_index.filter(all_of=tags))
+    return ResponsePayloads(data=index.search(q, limit=limit, keys=keys))
+
+
+@router.get(
+    "/suggest",
+    summary="标题联想",
+    response_model=ResponsePayloads[List[str]],
+)
+async def suggest(
+    q: str = Query(..., min_length=1, max_length=64, description="前缀"),
+    kind: AssetType = Query(AssetType.COURSE, description="搜索对象"),
+    limit: int = Query(10, ge=1, le=50, description="最大结果数"),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """返回以指定前缀开头的标题"""
+    index = _SEARCH_INDEXES[kind]
+    await index.ensure_fresh(session)
+    return ResponsePayloads(data=index.suggest(q, limit=limit))
+
+
+@router.get(
+    "/tags",
+    summary="标签分面统计",
+    response_model=ResponsePayloads[Dict[str, int]],
+)
+async def tag_facets(
+    kind: AssetType = Query(AssetType.COURSE, description="统计对象"),
+    tags: List[str] = Query([], description="已选标签, 统计同时包含这些标签的实体"),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """返回各标签下的实体数"""
+    index = _TAG_INDEXES[kind]
+    await index.ensure_fresh(session)
+    keys = index.filter(all_of=tags) if tags else None
+    return ResponsePayloads(data=index.facets(keys))
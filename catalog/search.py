@@ -0,0 +1,312 @@
+"""
+课程与应用的关键词搜索
+"""
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+from pydantic import BaseModel, Field
+from sqlalchemy import or_
+
+from common.configs import settings
+from db.models import Course, DifyApp
+from .base import IncrementalIndex
+
+_SEGMENT = re.compile(r"\w+")
+
+
+def normalize(text: Optional[str]) -> str:
+    """全角转半角并转为小写"""
+    return unicodedata.normalize("NFKC", text or "").casefold()
+
+
+def segments(text: str) -> List[str]:
+    """按非文字字符切分已规范化的文本"""
+    return _SEGMENT.findall(text)
+
+
+def bigrams(text: str) -> Set[str]:
+    """
+    已规范化文本的字符二元组, 不跨越标点和空白
+
+    Args:
+        text: 规范化后的文本
+
+    Returns:
+        二元组集合, 只有一个字符的片段不产生二元组
+    """
+    return {segment[i:i + 2] for segment in segments(text) for i in range(len(segment) - 1)}
+
+
+def keyword_filter(keyword: str, *columns):
+    """
+    数据库侧的关键词过滤(ILIKE '%关键词%'), 可以使用 pg_trgm GIN 索引
+
+    Args:
+        keyword: 关键词
+        columns: 要匹配的列
+
+    Returns:
+        SQL 条件
+    """
+    return or_(*(column.icontains(keyword, autoescape=True) for column in columns))
+
+
+class SearchHit(BaseModel):
+    """搜索结果"""
+
+    id: str = Field(description="实体ID")
+    title: str = Field(description="标题")
+    score: float = Field(description="相关度")
+
+
+class _SearchState:
+    """搜索索引的全部数据, 重建时构建新对象后一次赋值替换
+
+    Args:
+        postings: 二元组 -> 有序文档号数组
+        docs: 实体ID -> 文档号
+        texts: 文档号 -> (实体ID, 原标题, 规范化标题, 规范化描述)
+        titles: 按字典序排列的 (规范化标题, 文档号)
+        next_doc: 下一个文档号
+    """
+
+    def __init__(
+        self,
+        postings: Optional[Dict[str, array]] = None,
+        docs: Optional[Dict[Hashable, int]] = None,
+        texts: Optional[Dict[int, Tuple[Hashable, str, str, str]]] = None,
+        titles: Optional[List[Tuple[str, int]]] = None,
+        next_doc: int = 0,
+    ):
+        self.postings = postings if postings is not None else {}
+        self.docs = docs if docs is not None else {}
+        self.texts = texts if texts is not None else {}
+        self.titles = titles if titles is not None else []
+        self.next_doc = next_doc
+
+
+class SearchIndex(IncrementalIndex):
+    """字符二元组倒排索引
+
+    标题和描述规范化后切分为字符二元组, 每个二元组对应一个有序的文档号数组(``array('i')``).
+    查询的所有二元组取交集得到候选, 再用子串校验保证与 ``LIKE '%关键词%'`` 语义一致,
+    按标题完全匹配、前缀匹配、标题包含、描述包含排序. 完全匹配不足时补充命中
+    至少一半二元组的部分匹配. 单字查询没有二元组, 退化为扫描.
+
+    标题另有一份有序列表, 用于前缀联想. 刷新方式见 ``IncrementalIndex``.
+    全部数据保存在一个 ``_SearchState`` 中, 全量重建完成后一次赋值发布.
+
+    Args:
+        model: 模型
+        title_column: 标题列名
+        description_column: 描述列名
+        refresh_interval: 检查数据库变化的最小间隔(秒)
+        overlap: 增量刷新时水位回看的时间(秒)
+    """
+
+    def __init__(
+        self,
+        model,
+        title_column: str = "title",
+        description_column: str = "description",
+        refresh_interval: float = 5.0,
+        overlap: float = 30.0,
+    ):
+        super().__init__(model, (title_column, description_column), refresh_interval, overlap)
+        self._state = _SearchState()
+
+    def __len__(self) -> int:
+        return len(self._state.docs)
+
+    def upsert(self, key: Hashable, title: Optional[str], description: Optional[str]) -> None:
+        """
+        写入或更新一个实体
+
+        Args:
+            key: 实体ID
+            title: 标题
+            description: 描述
+        """
+        state = self._state
+        title = title or ""
+        norm_title, norm_description = normalize(title), normalize(description)
+        doc = state.docs.get(key)
+        if doc is not None:
+            _, old_title, old_norm_title, old_norm_description = state.texts[doc]
+            if (old_title, old_norm_description) == (title, norm_description):
+                return
+            self._unindex(state, doc)
+        doc = state.docs[key] = state.next_doc
+        state.next_doc += 1
+        state.texts[doc] = (key, title, norm_title, norm_description)
+        for gram in bigrams(norm_title) | bigrams(norm_description):
+            # 新文档号总是最大的, 直接追加即保持有序
+            state.postings.setdefault(gram, array("i")).append(doc)
+        insort(state.titles, (norm_title, doc))
+
+    def remove(self, key: Hashable) -> None:
+        """移除一个实体"""
+        state = self._state
+        doc = state.docs.pop(key, None)
+        if doc is not None:
+            self._unindex(state, doc)
+
+    def rebuild(self, rows: Iterable[tuple]) -> None:
+        """
+        用 (实体ID, 标题, 描述) 全量重建
+
+        Args:
+            rows: 数据行
+        """
+        postings: Dict[str, List[int]] = {}
+        docs, texts, titles = {}, {}, []
+        for doc, (key, title, description) in enumerate(rows):
+            title = title or ""
+            norm_title, norm_description = normalize(title), normalize(description)
+            docs[key] = doc
+            texts[doc] = (key, title, norm_title, norm_description)
+            titles.append((norm_title, doc))
+            for gram in bigrams(norm_title) | bigrams(norm_description):
+                postings.setdefault(gram, []).append(doc)
+        self._state = _SearchState(
+            {gram: array("i", numbers) for gram, numbers in postings.items()},
+            docs,
+            texts,
+            sorted(titles),
+            len(texts),
+        )
+
+    def search(self, query: str, limit: int = 20, keys: Optional[Set[Hashable]] = None) -> List[SearchHit]:
+        """
+        关键词搜索
+
+        Args:
+            query: 关键词, 空白分隔的多个词需要同时出现
+            limit: 最大结果数
+            keys: 只在这些实体中搜索, 例如标签过滤的结果
+
+        Returns:
+            按相关度降序的结果
+        """
+        state = self._state
+        query = normalize(query)
+        terms = segments(query)
+        if not terms:
+            return []
+        grams = bigrams(query)
+
+        if grams:
+            candidates = self._intersect(state, grams)
+        else:
+            candidates = state.texts.keys()
+        scored: Dict[int, float] = {}
+        for doc in candidates:
+            score = self._score(state, doc, query, terms)
+            if score and (keys is None or state.texts[doc][0] in keys):
+                scored[doc] = score
+
+        if len(scored) < limit and len(grams) > 1:
+            # 部分匹配: 命中至少一半的二元组
+            hits = Counter()
+            for gram in grams:
+                hits.update(state.postings.get(gram, ()))
+            threshold = len(grams) / 2
+            for doc, count in hits.items():
+                if doc not in scored and count >= threshold and (keys is None or state.texts[doc][0] in keys):
+                    scored[doc] = count / len(grams)
+
+        best = sorted(scored.items(), key=lambda item: (-item[1], len(state.texts[item[0]][2]), item[0]))
+        return [
+            SearchHit(id=str(state.texts[doc][0]), title=state.texts[doc][1], score=round(score, 3))
+            for doc, score in best[:limit]
+        ]
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        标题前缀联想
+
+        Args:
+            prefix: 前缀
+            limit: 最大结果数
+
+        Returns:
+            以该前缀开头的标题, 按字典序
+        """
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return []
+        state = self._state
+        suggestions = []
+        seen = set()
+        titles = state.titles
+        i = bisect_left(titles, (prefix,))
+        while i < len(titles) and len(suggestions) < limit:
+            norm_title, doc = titles[i]
+            if not norm_title.startswith(prefix):
+                break
+            i += 1
+            title = state.texts[doc][1]
+            if title not in seen:
+                seen.add(title)
+                suggestions.append(title)
+        return suggestions
+
+    @staticmethod
+    def _intersect(state: _SearchState, grams: Iterable[str]) -> Sequence[int]:
+        postings = sorted((state.postings.get(gram) for gram in grams), key=lambda p: len(p or ()))
+        if not postings[0]:
+            return ()
+        result = set(postings[0])
+        for docs in postings[1:]:
+            result.intersection_update(docs)
+            if not result:
+                break
+        return result
+
+    @staticmethod
+    def _score(state: _SearchState, doc: int, query: str, terms: List[str]) -> float:
+        _, _, title, description = state.texts[doc]
+        if not all(term in title or term in description for term in terms):
+            return 0.0
+        if title == query:
+            return 100.0
+        score = 0.0
+        if title.startswith(terms[0]):
+            score += 50.0
+        score += 20.0 * sum(term in title for term in terms)
+        score += 5.0 * sum(term in description for term in terms)
+        return score
+
+    @staticmethod
+    def _unindex(state: _SearchState, doc: int) -> None:
+        _, _, norm_title, norm_description = state.texts.pop(doc)
+        for gram in bigrams(norm_title) | bigrams(norm_description):
+            docs = state.postings.get(gram)
+            if docs is None:
+                continue
+            i = bisect_left(docs, doc)
+            if i < len(docs) and docs[i] == doc:
+                del docs[i]
+            if not docs:
+                del state.postings[gram]
+        i = bisect_left(state.titles, (norm_title, doc))
+        if i < len(state.titles) and state.titles[i] == (norm_title, doc):
+            del state.titles[i]
+
+
+course_search_index = SearchIndex(
+    Course,
+    "title",
+    refresh_interval=settings.search_index_refresh_interval,
+    overlap=settings.index_watermark_overlap,
+)
+app_search_index = SearchIndex(
+    DifyApp,
+    "name",
+    refresh_interval=settings.search_index_refresh_interval,
+    overlap=settings.index_watermark_overlap,
+)
@@ -0,0 +1,224 @@
+"""
+标签过滤与分面统计
+"""
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Set
+
+from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import array as pg_array
+
+from common.configs import settings
+from db.models import Course, DifyApp
+from .base import IncrementalIndex
+
+
+def tag_filter(column, all_of: Sequence[str] = (), any_of: Sequence[str] = ()):
+    """
+    JSONB 标签列的过滤条件, 可以使用 GIN 索引
+
+    Args:
+        column: 标签列, 例如 ``Course.tags``
+        all_of: 必须全部包含的标签(``@>``)
+        any_of: 至少包含其中一个的标签(``?|``)
+
+    Returns:
+        SQL 条件, 没有任何标签时为 None
+    """
+    conditions = []
+    if all_of:
+        conditions.append(column.contains(list(all_of)))
+    if any_of:
+        # ?| 的右侧必须是 text[], 不能按 JSONB 绑定
+        conditions.append(column.has_any(pg_array(list(any_of))))
+    if not conditions:
+        return None
+    return and_(*conditions)
+
+
+def _intersect(a: array, b: array) -> array:
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) * 16 < len(b):
+        # 长度悬殊时在长数组上二分查找
+        result = array("q")
+        for doc in a:
+            i = bisect_left(b, doc)
+            if i < len(b) and b[i] == doc:
+                result.append(doc)
+        return result
+    return array("q", sorted(set(a).intersection(b)))
+
+
+class _TagState:
+    """标签索引的全部数据, 重建时构建新对象后一次赋值替换
+
+    Args:
+        postings: 标签 -> 有序文档号数组
+        tags: 实体ID -> 标签集合
+        doc_ids: 实体ID -> 文档号
+        keys: 文档号 -> 实体ID
+    """
+
+    def __init__(
+        self,
+        postings: Optional[Dict[str, array]] = None,
+        tags: Optional[Dict[Hashable, frozenset]] = None,
+        doc_ids: Optional[Dict[Hashable, int]] = None,
+        keys: Optional[Dict[int, Hashable]] = None,
+    ):
+        self.postings = postings if postings is not None else {}
+        self.tags = tags if tags is not None else {}
+        self.doc_ids = doc_ids if doc_ids is not None else {}
+        self.keys = keys if keys is not None else {}
+        self.next_doc = len(self.keys)
+
+
+class TagIndex(IncrementalIndex):
+    """进程内的标签倒排索引: 标签 -> 有序文档号数组
+
+    实体ID映射为递增的整数文档号, 倒排表是有序的 ``array('q')``, AND/OR 过滤是有序数组的
+    交集/并集, 分面统计是倒排表长度或候选集合上的计数. 刷新方式见 ``IncrementalIndex``.
+
+    全部数据保存在一个 ``_TagState`` 中: 全量重建在线程中构建新对象, 完成后一次赋值发布,
+    查询开始时取一次引用, 不会看到新旧数据混在一起的中间状态.
+
+    Args:
+        model: 带 ``id``、``tags``、``updated_at`` 列的模型
+        refresh_interval: 检查数据库变化的最小间隔(秒)
+        overlap: 增量刷新时水位回看的时间(秒)
+    """
+
+    def __init__(self, model, refresh_interval: float = 5.0, overlap: float = 30.0):
+        super().__init__(model, ("tags",), refresh_interval, overlap)
+        self._state = _TagState()
+
+    def __len__(self) -> int:
+        return len(self._state.tags)
+
+    def upsert(self, key: Hashable, tags: Iterable[str]) -> None:
+        """
+        写入或更新一个实体的标签
+
+        Args:
+            key: 实体ID
+            tags: 标签列表
+        """
+        state = self._state
+        tags = frozenset(tags or ())
+        old = state.tags.get(key)
+        if old == tags:
+            return
+        doc = state.doc_ids.get(key)
+        if doc is None:
+            doc = state.doc_ids[key] = state.next_doc
+            state.keys[doc] = key
+            state.next_doc += 1
+        old = old or frozenset()
+        for tag in old - tags:
+            self._discard(state, tag, doc)
+        for tag in tags - old:
+            insort(state.postings.setdefault(tag, array("q")), doc)
+        state.tags[key] = tags
+
+    def remove(self, key: Hashable) -> None:
+        """移除一个实体"""
+        state = self._state
+        doc = state.doc_ids.pop(key, None)
+        if doc is None:
+            return
+        del state.keys[doc]
+        for tag in state.tags.pop(key, ()):
+            self._discard(state, tag, doc)
+
+    def rebuild(self, rows: Iterable[tuple]) -> None:
+        """
+        用 (实体ID, 标签列表) 全量重建
+
+        Args:
+            rows: 按期望的输出顺序排列的行
+        """
+        postings: Dict[str, List[int]] = {}
+        tags_of, doc_ids, keys = {}, {}, {}
+        for doc, (key, tags) in enumerate(rows):
+            tags = frozenset(tags or ())
+            tags_of[key] = tags
+            doc_ids[key] = doc
+            keys[doc] = key
+            for tag in tags:
+                postings.setdefault(tag, []).append(doc)
+        self._state = _TagState({tag: array("q", docs) for tag, docs in postings.items()}, tags_of, doc_ids, keys)
+
+    def filter(self, all_of: Sequence[str] = (), any_of: Sequence[str] = ()) -> List[Hashable]:
+        """
+        按标签过滤
+
+        Args:
+            all_of: 必须全部包含的标签
+            any_of: 至少包含其中一个的标签
+
+        Returns:
+            实体ID列表, 顺序与建立索引时一致; 两个参数都为空时返回全部
+        """
+        state = self._state
+        docs = self._filter_docs(state, all_of, any_of)
+        if docs is None:
+            return list(state.tags)
+        return [state.keys[doc] for doc in docs]
+
+    def facets(self, keys: Optional[Iterable[Hashable]] = None) -> Dict[str, int]:
+        """
+        标签分面统计
+
+        Args:
+            keys: 候选实体ID, 为空时统计全部实体
+
+        Returns:
+            标签 -> 实体数, 按数量降序
+        """
+        state = self._state
+        if keys is None:
+            counts = {tag: len(docs) for tag, docs in state.postings.items()}
+        else:
+            counts: Dict[str, int] = {}
+            for key in keys:
+                for tag in state.tags.get(key, ()):
+                    counts[tag] = counts.get(tag, 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+
+    @staticmethod
+    def _filter_docs(state: _TagState, all_of: Sequence[str], any_of: Sequence[str]) -> Optional[array]:
+        result: Optional[array] = None
+        if all_of:
+            postings = sorted((state.postings.get(tag, array("q")) for tag in set(all_of)), key=len)
+            result = postings[0]
+            for docs in postings[1:]:
+                if not result:
+                    break
+                result = _intersect(result, docs)
+        if any_of:
+            union: Set[int] = set()
+            for tag in set(any_of):
+                union.update(state.postings.get(tag, ()))
+            matched = array("q", sorted(union))
+            result = matched if result is None else _intersect(result, matched)
+        return result
+
+    @staticmethod
+    def _discard(state: _TagState, tag: str, doc: int) -> None:
+        docs = state.postings.get(tag)
+        if docs is None:
+            return
+        i = bisect_left(docs, doc)
+        if i < len(docs) and docs[i] == doc:
+            del docs[i]
+        if not docs:
+            del state.postings[tag]
+
+
+course_tag_index = TagIndex(
+    Course, refresh_interval=settings.tag_index_refresh_interval, overlap=settings.index_watermark_overlap
+)
+app_tag_index = TagIndex(
+    DifyApp, refresh_interval=settings.tag_index_refresh_interval, overlap=settings.index_watermark_overlap
+)
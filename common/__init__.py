@@ -1,21 +1,99 @@
-from .bcrypt import default_password_encoder
-from .configs import settings
-from .jwt import create_jwt_token
-from .log import payment_logger, agents_logger, chat_logger
-from .models import *
-from .redis import redis_client
-from .routes import router
+"""
+公共组件
+
+导出的名称按需从子模块加载(PEP 562): ``from common.configs import settings`` 或
+``common.Settings`` 只会导入用到的子模块, 不会连带导入 Redis、JWT、BCrypt、loguru 等.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+# 名称 -> 所在子模块
+_EXPORTS = {
+    "Error": ".models",
+    "ResponsePayloads": ".models",
+    "DataPage": ".models",
+    "CursorPage": ".models",
+    "Settings": ".models",
+    "settings": ".configs",
+    "default_password_encoder": ".bcrypt",
+    "PasswordEncoderBusyError": ".bcrypt",
+    "cached": ".cache",
+    "response_cache": ".cache",
+    "conditional": ".etag",
+    "ETagMiddleware": ".etag",
+    "create_jwt_token": ".jwt",
+    "verify_jwt_token": ".jwt",
+    "revoke_jwt_tokens": ".jwt",
+    "get_current_claims": ".jwt",
+    "payment_logger": ".log",
+    "agents_logger": ".log",
+    "chat_logger": ".log",
+    "redis_client": ".redis",
+    "async_redis_client": ".redis",
+    "ping_redis": ".redis",
+    "redis_mget": ".redis",
+    "redis_mset": ".redis",
+    "router": ".routes",
+    "RateLimiter": ".ratelimit",
+    "rate_limit": ".ratelimit",
+    "sms_service": ".sms",
+}
 
 __all__ = [
     "Error",
     "ResponsePayloads",
     "default_password_encoder",
+    "PasswordEncoderBusyError",
     "create_jwt_token",
+    "verify_jwt_token",
+    "revoke_jwt_tokens",
+    "get_current_claims",
     "agents_logger",
     "settings",
     "payment_logger",
     "redis_client",
+    "async_redis_client",
+    "ping_redis",
+    "redis_mget",
+    "redis_mset",
     "chat_logger",
     "DataPage",
+    "CursorPage",
+    "Settings",
     "router",
+    "cached",
+    "response_cache",
+    "conditional",
+    "ETagMiddleware",
+    "RateLimiter",
+    "rate_limit",
+    "sms_service",
 ]
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    # 缓存到模块字典, 之后的访问不再经过 __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+if TYPE_CHECKING:
+    from .bcrypt import default_password_encoder, PasswordEncoderBusyError
+    from .cache import cached, response_cache
+    from .configs import settings
+    from .etag import conditional, ETagMiddleware
+    from .jwt import create_jwt_token, verify_jwt_token, revoke_jwt_tokens, get_current_claims
+    from .log import payment_logger, agents_logger, chat_logger
+    from .models import Error, ResponsePayloads, DataPage, CursorPage, Settings
+    from .redis import redis_client, async_redis_client, ping_redis, redis_mget, redis_mset
+    from .ratelimit import RateLimiter, rate_limit
+    from .routes import router
+    from .sms import sms_service
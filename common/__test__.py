@@ -1,12 +1,530 @@
-from .sms import sms_service
+import asyncio
+import json
+import os
+
+import pytest
+from redis.asyncio import Redis
+
+from .sms import FakeSmsTransport, SmsCooldownError, SmsMessage, SmsService
+
+
+def _service(client=None, **kwargs) -> SmsService:
+    # 不需要验证码存储时使用不连接的客户端
+    client = client or Redis()
+    return SmsService(FakeSmsTransport(latency=0), client, template_code="SMS_TEST", **kwargs)
 
 
 def test_send_sms_success():
     """测试发送短信成功的情况"""
-    # 准备测试数据
-    phone_number = "13271976859"
-    template_param = {"code": "1234"}
 
-    # 发送短信
-    result = sms_service.send_sms(phone_number, template_param)
-    assert result is True
\ No newline at end of file
+    async def run():
+        service = _service()
+        result = await service.deliver(SmsMessage(phone="13271976859", params={"code": "1234"}))
+        assert result is True
+        assert service.transport.count == 1
+
+    asyncio.run(run())
+
+
+def test_send_sms_retry_then_fail():
+    """测试可重试的失败在重试次数用完后放弃"""
+
+    async def run():
+        service = _service(max_retries=2, backoff=0)
+        service.transport.failure_rate = 1.0
+        message = SmsMessage(phone="13271976859")
+        assert await service.deliver(message) is False
+        assert message.attempts == 3
+
+    asyncio.run(run())
+
+
+def test_verify_code():
+    """测试验证码发送、冷却与校验"""
+
+    async def run():
+        fakeredis = pytest.importorskip("fakeredis")
+        service = _service(fakeredis.FakeAsyncRedis(), max_attempts=2)
+        code = await service.send_code("13271976859")
+        with pytest.raises(SmsCooldownError):
+            await service.send_code("13271976859")
+        assert await service.verify_code("13271976859", "x") is False
+        assert await service.verify_code("13271976859", code) is True
+        # 验证码只能使用一次
+        assert await service.verify_code("13271976859", code) is False
+        await service.stop()
+        assert service.transport.sent[-1].params == {"code": code}
+
+    asyncio.run(run())
+
+
+def test_password_encoder_busy_and_timeout():
+    """超时后任务仍占用排队名额, 直到在执行器中结束"""
+    import threading
+
+    from .bcrypt import BCryptPasswordEncoder, PasswordEncoderBusyError
+
+    async def run():
+        encoder = BCryptPasswordEncoder(strength=4, executor="thread", max_workers=1, max_pending=1, timeout=0.05)
+        release = threading.Event()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await encoder._submit(release.wait, 5)
+            assert encoder.pending == 1
+            with pytest.raises(PasswordEncoderBusyError):
+                await encoder.encode_async("secret")
+            release.set()
+            for _ in range(100):
+                if encoder.pending == 0:
+                    break
+                await asyncio.sleep(0.01)
+            encoder.timeout = 5
+            encoded = await encoder.encode_async("secret")
+            assert await encoder.matches_async("secret", encoded) is True
+            assert encoder.pending == 0
+        finally:
+            release.set()
+            encoder.shutdown()
+
+    asyncio.run(run())
+
+
+def test_password_encoder_recreates_broken_process_pool():
+    """子进程崩溃后重建进程池, 而不是永久回退到线程池"""
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    from .bcrypt import BCryptPasswordEncoder
+
+    async def run():
+        encoder = BCryptPasswordEncoder(strength=4, executor="process", max_workers=1, timeout=30)
+        try:
+            with pytest.raises(BrokenProcessPool):
+                await encoder._submit(os._exit, 1)
+            assert encoder.pending == 0
+            encoded = await encoder.encode_async("secret")
+            assert await encoder.matches_async("secret", encoded) is True
+            assert encoder.executor_type == "process"
+            assert isinstance(encoder._executor, ProcessPoolExecutor)
+        finally:
+            encoder.shutdown()
+
+    asyncio.run(run())
+
+
+def test_password_encoder_workers_split_cpu_quota(monkeypatch):
+    """默认工作者数按 CPU 配额在 worker 之间平分"""
+    from . import bcrypt as bcrypt_module
+
+    monkeypatch.setattr(bcrypt_module, "cpu_limit", lambda: 8.0)
+    monkeypatch.setattr(bcrypt_module.settings, "web_concurrency", 4)
+    assert bcrypt_module.default_max_workers() == 2
+    monkeypatch.setattr(bcrypt_module.settings, "web_concurrency", 16)
+    assert bcrypt_module.default_max_workers() == 1
+
+    encoder = bcrypt_module.BCryptPasswordEncoder(strength=4, executor="thread")
+    try:
+        assert encoder._get_executor()._max_workers == 1
+    finally:
+        encoder.shutdown()
+
+
+def test_revocation_list_syncs_across_workers():
+    """吊销在其他 worker 同步后生效, 已过期的记录不再下发"""
+    import time
+
+    fakeredis = pytest.importorskip("fakeredis")
+    from .jwt import TokenRevocationList
+
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a, worker_b = (
+            TokenRevocationList(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), sync_interval=60)
+            for _ in range(2)
+        )
+        await worker_b.maybe_sync()
+
+        await worker_a.revoke_many({"live": time.time() + 60, "dead": time.time() - 1})
+        assert worker_a.is_revoked("live")
+        # 同步间隔内只查本地镜像
+        await worker_b.maybe_sync()
+        assert not worker_b.is_revoked("live")
+        await worker_b.sync()
+        assert worker_b.is_revoked("live")
+        assert not worker_b.is_revoked("dead")
+        assert "dead" not in worker_b._revoked
+
+    asyncio.run(run())
+
+
+def test_revocation_list_syncs_incrementally():
+    """版本变化时只拉取变更日志中的新记录, 落后超出日志范围时才拉取完整列表"""
+    import time
+
+    fakeredis = pytest.importorskip("fakeredis")
+    from .jwt import TokenRevocationList
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        worker_a, worker_b = (TokenRevocationList(client, sync_interval=60, log_size=2) for _ in range(2))
+        exp = time.time() + 60
+        await worker_b.sync()
+
+        await worker_a.revoke("t1", exp)
+        # 从完整集合中删除后仍能通过变更日志同步到, 说明没有重新拉取完整列表
+        await client.zrem(worker_a.key, "t1")
+        await worker_b.sync()
+        assert worker_b.is_revoked("t1")
+
+        for jti in ("t2", "t3", "t4"):
+            await worker_a.revoke(jti, exp)
+        assert await client.zcard(worker_a.log_key) == 2
+        # 落后 3 个版本, 超出日志范围, 改为拉取完整列表
+        await worker_b.sync()
+        assert set(worker_b._revoked) == {"t2", "t3", "t4"}
+
+    asyncio.run(run())
+
+
+def test_verified_token_cache_is_capped_by_exp(monkeypatch):
+    """令牌缓存的存活时间不超过令牌自身的 exp, 过期后即使命中缓存也拒绝"""
+    import time
+
+    import jwt as pyjwt
+
+    from . import jwt as jwt_module
+    from .configs import settings
+
+    token = pyjwt.encode(
+        {"sub": "1", "exp": int(time.time()) + 2, "jti": "t1"},
+        settings.jwt_secret_key,
+        algorithm=settings.jwt_algorithm,
+    )
+    assert jwt_module.verify_jwt_token(token)["sub"] == "1"
+    _, deadline = jwt_module._verified_tokens._data[token]
+    assert deadline - time.monotonic() <= 2
+
+    later = time.time() + 5
+    monkeypatch.setattr(jwt_module, "time", type("FakeTime", (), {"time": staticmethod(lambda: later)}))
+    with pytest.raises(pyjwt.ExpiredSignatureError):
+        jwt_module.verify_jwt_token(token)
+    assert jwt_module._verified_tokens.get(token) is None
+
+
+def test_redis_batch_helpers():
+    """批量读写一次往返, 结果与键顺序一致, ttl 生效"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from .redis import ping_redis, redis_mget, redis_mset
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await redis_mset({"a": "1", "b": "2"}, ttl=60, client=client)
+        assert await redis_mget(["b", "missing", "a"], client=client) == ["2", None, "1"]
+        assert 0 < await client.pttl("a") <= 60000
+        assert await redis_mget([], client=client) == []
+        assert await ping_redis(client) is True
+        assert await ping_redis(Redis(port=1, socket_connect_timeout=0.1)) is False
+
+    asyncio.run(run())
+
+
+def test_redis_pool_queues_when_exhausted():
+    """连接用尽时排队等待并记录等待时间, 超时后报错"""
+    import redis as redis_lib
+
+    fakeredis = pytest.importorskip("fakeredis")
+    from .redis import InstrumentedConnectionPool
+
+    async def run():
+        pool = InstrumentedConnectionPool(
+            connection_class=fakeredis.FakeAsyncRedisConnection, max_connections=1, timeout=0.05
+        )
+        first = await pool.get_connection("GET")
+        assert pool.stats()["in_use"] == 1
+        with pytest.raises(redis_lib.ConnectionError):
+            await pool.get_connection("GET")
+
+        async def release_later():
+            await asyncio.sleep(0.02)
+            await pool.release(first)
+
+        pool.timeout = 1
+        release = asyncio.create_task(release_later())
+        second = await pool.get_connection("GET")
+        await release
+        assert second is first
+        assert pool.wait_stats.snapshot()["count"] == 3
+        await pool.disconnect()
+
+    asyncio.run(run())
+
+
+def test_response_cache_single_flight():
+    """同一个键的并发未命中只计算一次; 计算者被取消时由等待者接手, 不把取消传给等待者"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from .cache import ResponseCache
+
+    async def run():
+        cache = ResponseCache(fakeredis.FakeAsyncRedis(decode_responses=True))
+        calls = []
+        release = asyncio.Event()
+
+        async def compute() -> bytes:
+            calls.append(1)
+            await release.wait()
+            return b'{"n":1}'
+
+        tasks = [asyncio.create_task(cache.get_or_compute("k", compute, 60)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        release.set()
+        assert await asyncio.gather(*tasks) == [b'{"n":1}'] * 5
+        assert len(calls) == 1
+
+        release.clear()
+        leader = asyncio.create_task(cache.get_or_compute("other", compute, 60))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_compute("other", compute, 60))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        assert await waiter == b'{"n":1}'
+        assert leader.cancelled()
+        assert len(calls) == 3
+        await cache.close()
+
+    asyncio.run(run())
+
+
+def test_cached_key_includes_list_query_params():
+    """列表查询参数参与缓存键; 无法用于缓存键的参数在调用时报错, 除非提供 key_builder"""
+    from typing import List
+
+    from fastapi import FastAPI, Query
+    from starlette.requests import Request
+    from starlette.testclient import TestClient
+
+    fakeredis = pytest.importorskip("fakeredis")
+    from .cache import ResponseCache, cached
+
+    cache = ResponseCache(fakeredis.FakeAsyncRedis(decode_responses=True))
+    app = FastAPI()
+
+    @app.get("/items")
+    @cached(ttl=60, cache=cache)
+    async def items(request: Request, tags: List[str] = Query(default=[])):
+        return {"tags": tags}
+
+    @cached(ttl=60, cache=cache)
+    async def by_claims(claims: dict):
+        return claims
+
+    @cached(ttl=60, cache=cache, key_builder=lambda func, kwargs: f"claims:{kwargs['claims']['sub']}")
+    async def by_sub(claims: dict):
+        return claims
+
+    with TestClient(app) as client:
+        assert client.get("/items", params={"tags": ["a"]}).json() == {"tags": ["a"]}
+        assert client.get("/items", params={"tags": ["b"]}).json() == {"tags": ["b"]}
+        assert client.get("/items", params={"tags": ["a", "b"]}).json() == {"tags": ["a", "b"]}
+
+    async def run():
+        with pytest.raises(TypeError):
+            await by_claims(claims={"sub": "1"})
+        assert (await by_sub(claims={"sub": "1"})).body == b'{"sub":"1"}'
+        assert (await by_sub(claims={"sub": "2"})).body == b'{"sub":"2"}'
+        await cache.close()
+
+    asyncio.run(run())
+
+
+def test_metrics_compact_retires_dead_workers(tmp_path):
+    """已退出 worker 的计数器并入 retired.json, 文件被删除, 合并结果不变"""
+    from .metrics import MetricsRegistry
+
+    dead_pid = 2 ** 22 + 1
+    registry = MetricsRegistry(directory=tmp_path)
+    requests = registry.counter("requests_total", "请求数")
+    in_flight = registry.gauge("in_flight", "并发数")
+    requests[()] = 3
+    in_flight[()] = 1
+    registry.flush()
+    for pid in (dead_pid, dead_pid + 1):
+        (tmp_path / f"{pid}.json").write_text(
+            json.dumps({"pid": pid, "counters": {"requests_total": {"": 2}}, "gauges": {"in_flight": {"": 5}}})
+        )
+
+    before = registry.render_prometheus()
+    assert "requests_total 7" in before and "in_flight 1" in before
+    assert registry.compact() == 2
+    assert sorted(p.name for p in tmp_path.glob("*.json")) == sorted([f"{os.getpid()}.json", "retired.json"])
+    assert registry.render_prometheus() == before
+    # 再次合并时累加到已有的 retired.json
+    (tmp_path / f"{dead_pid}.json").write_text(json.dumps({"pid": dead_pid, "counters": {"requests_total": {"": 1}}}))
+    assert registry.compact() == 1
+    assert "requests_total 8" in registry.render_prometheus()
+
+    registry.reset()
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_log_rotation_shared_between_processes(tmp_path):
+    """多个进程写同一个日志文件: 只轮转一次, 晚到的记录不丢, 压缩推迟到下一次轮转"""
+    import time
+    import zipfile
+    from datetime import date, datetime, timedelta
+
+    from .log import BufferedFileWriter
+
+    def at(day: date) -> float:
+        return datetime.combine(day, datetime.min.time()).timestamp() + 60
+
+    today = date.today()
+    tomorrow, after = today + timedelta(days=1), today + timedelta(days=2)
+    path = tmp_path / "info.log"
+    worker_a, worker_b = BufferedFileWriter(path), BufferedFileWriter(path)
+
+    worker_a.write("a1\n", at(today))
+    worker_b.write("b1\n", at(today))
+    worker_a.write("a2\n", at(tomorrow))
+    # worker_b 还没跨天, 写入已被重命名的文件
+    worker_b.write("b1-late\n", at(today))
+    worker_b.write("b2\n", at(tomorrow))
+    worker_a.flush()
+    worker_b.flush()
+
+    rotated = tmp_path / f"info.{today.isoformat()}.log"
+    assert sorted(rotated.read_text().split()) == ["a1", "b1", "b1-late"]
+    assert sorted(path.read_text().split()) == ["a2", "b2"]
+    assert rotated.exists() and not list(tmp_path.glob("*.zip"))
+
+    worker_a.write("a3\n", at(after))
+    archive = tmp_path / f"info.{today.isoformat()}.log.zip"
+    for _ in range(100):
+        if archive.exists() and not rotated.exists():
+            break
+        time.sleep(0.01)
+    with zipfile.ZipFile(archive) as zf:
+        assert sorted(zf.read(rotated.name).decode().split()) == ["a1", "b1", "b1-late"]
+    assert (tmp_path / f"info.{tomorrow.isoformat()}.log").exists()
+    worker_a.close()
+    worker_b.close()
+
+
+def test_etag_middleware_skips_body_hash_for_head():
+    """GET 按 JSON 响应体计算 ETag; HEAD 的空响应体和非 JSON 响应不计算, 只透传处理器提供的版本 ETag"""
+    from starlette.applications import Starlette
+    from starlette.responses import Response
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from .etag import ETagMiddleware, compute_etag
+
+    body = b'{"data":[1,2,3]}'
+
+    async def items(request):
+        return Response(b"" if request.method == "HEAD" else body, media_type="application/json")
+
+    async def versioned(request):
+        return Response(b"", media_type="application/json", headers={"ETag": '"v-1"'})
+
+    async def metrics(request):
+        return Response(b"requests_total 1\n", media_type="text/plain")
+
+    app = Starlette(routes=[Route("/items", items), Route("/versioned", versioned), Route("/metrics", metrics)])
+    app.add_middleware(ETagMiddleware)
+    with TestClient(app) as client:
+        etag = client.get("/items").headers["etag"]
+        assert etag == compute_etag(body)
+        assert client.get("/items", headers={"If-None-Match": etag}).status_code == 304
+        assert "etag" not in client.head("/items").headers
+        assert client.head("/items", headers={"If-None-Match": etag}).status_code == 200
+        assert client.head("/versioned").headers["etag"] == '"v-1"'
+        assert client.head("/versioned", headers={"If-None-Match": '"v-1"'}).status_code == 304
+        # 非 JSON 响应不缓冲, 也不计算 ETag
+        assert "etag" not in client.get("/metrics").headers
+
+
+def test_rate_limiter_lease_stays_within_global_budget():
+    """预支的令牌在本地使用, 不访问 Redis; 多个 worker 合计放行数不超过桶容量"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from .ratelimit import RateLimiter
+
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a, worker_b = (
+            RateLimiter(
+                fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+                "test",
+                rate=0.001,
+                burst=10,
+                lease=4,
+                lease_ttl=60,
+            )
+            for _ in range(2)
+        )
+        key = "ratelimit:test:1.2.3.4"
+
+        # 桶中令牌多于一半: 本次 1 个, 另预支 3 个
+        assert await worker_a.hit("1.2.3.4") == 0
+        assert float(await worker_a.client.hget(key, "t")) == pytest.approx(6, abs=0.01)
+        for _ in range(3):
+            assert await worker_a.hit("1.2.3.4") == 0
+        assert float(await worker_a.client.hget(key, "t")) == pytest.approx(6, abs=0.01)
+
+        allowed = 4
+        for _ in range(20):
+            for worker in (worker_a, worker_b):
+                if await worker.hit("1.2.3.4") == 0:
+                    allowed += 1
+        assert allowed == 10
+
+        # 被拒绝后在等待时间内直接本地拒绝
+        await worker_b.client.delete(key)
+        assert await worker_b.hit("1.2.3.4") > 0
+
+    asyncio.run(run())
+
+
+def test_rate_limiter_falls_back_to_local_bucket():
+    """Redis 不可用时使用本 worker 内的令牌桶"""
+    from .ratelimit import RateLimiter
+
+    async def run():
+        limiter = RateLimiter(Redis(port=1, socket_connect_timeout=0.5), "test", rate=1, burst=2)
+        assert await limiter.hit("k") == 0
+        assert await limiter.hit("k") == 0
+        assert 0 < await limiter.hit("k") <= 1
+        assert await limiter.hit("other") == 0
+        await limiter.client.aclose()
+
+    asyncio.run(run())
+
+
+def test_sms_code_fails_fast_without_transport_sdk():
+    """通道不可用时验证码在入队前失败, 不占用冷却时间; 发送中的意外错误计为失败而不重试"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from .sms import AliyunSmsTransport, SmsUnavailableError
+
+    class BrokenTransport(FakeSmsTransport):
+        async def send(self, message):
+            raise RuntimeError("boom")
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        service = SmsService(AliyunSmsTransport("id", "secret", "sign"), client, template_code="SMS_TEST")
+        try:
+            import alibabacloud_dysmsapi20170525  # noqa: F401
+        except ImportError:
+            with pytest.raises(SmsUnavailableError):
+                await service.send_code("13271976859")
+            assert service.pending == 0
+            assert not await client.exists("sms:cooldown:13271976859")
+
+        service = SmsService(BrokenTransport(latency=0), client, max_retries=3, backoff=0)
+        message = SmsMessage(phone="13271976859")
+        assert await service.deliver(message) is False
+        assert (message.attempts, service.failed) == (1, 1)
+
+    asyncio.run(run())
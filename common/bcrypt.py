@@ -1,18 +1,81 @@
 """
 BCrypt 密码加密工具
 """
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
 import bcrypt
 
+from .configs import settings
+from .cpu import cpu_limit
+
+
+class PasswordEncoderBusyError(RuntimeError):
+    """加密器排队任务已满"""
+
+
+def _hashpw(password_bytes: bytes, salt: bytes) -> bytes:
+    """在执行器中计算哈希, 定义在模块级别以便进程池序列化"""
+    return bcrypt.hashpw(password_bytes, salt)
+
+
+def _checkpw(raw_bytes: bytes, encoded_bytes: bytes) -> bool:
+    """在执行器中校验密码, 定义在模块级别以便进程池序列化"""
+    try:
+        return bcrypt.checkpw(raw_bytes, encoded_bytes)
+    except (ValueError, TypeError):
+        return False
+
+
+def default_max_workers() -> int:
+    """
+    执行器默认的工作者数: 容器 CPU 配额按 uvicorn worker 数平分
+
+    每个 worker 进程各有一个执行器, 按整机核数分配会让进程/线程总数随 worker 数成倍增长.
+
+    Returns:
+        工作者数, 至少为 1
+    """
+    return max(1, int(cpu_limit()) // max(1, settings.web_concurrency))
+
 
 class BCryptPasswordEncoder:
-    """BCrypt 密码加密器"""
+    """BCrypt 密码加密器
+
+    同步方法 ``encode``/``matches`` 直接在当前线程计算, 适用于脚本;
+    异步方法 ``encode_async``/``matches_async`` 把计算交给有界的进程池(或线程池),
+    不会阻塞事件循环.
+    """
 
-    def __init__(self, strength: int = 10):
+    def __init__(
+        self,
+        strength: int = 10,
+        executor: str = "process",
+        max_workers: Optional[int] = None,
+        max_pending: int = 64,
+        timeout: Optional[float] = 5.0,
+    ):
         """
         初始化加密器
         :param strength: 加密强度（轮数），默认为10
+        :param executor: 异步方法使用的执行器, ``process`` 或 ``thread``
+        :param max_workers: 执行器最大工作者数, 默认为本 worker 分到的 CPU 数(见 ``default_max_workers``)
+        :param max_pending: 允许同时排队/执行的最大任务数, 超出时抛出 PasswordEncoderBusyError
+        :param timeout: 单次异步运算超时(秒), None 表示不限制
         """
         self.strength = strength
+        self.executor_type = executor
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor: Optional[Executor] = None
+        self._executor_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = 0
 
     def encode(self, raw_password: str) -> str:
         """
@@ -28,10 +91,26 @@ class BCryptPasswordEncoder:
         password_bytes = raw_password.encode('utf-8')
         # 生成盐值并加密
         salt = bcrypt.gensalt(rounds=self.strength)
-        hashed = bcrypt.hashpw(password_bytes, salt)
+        hashed = _hashpw(password_bytes, salt)
         # 返回字符串形式的哈希值
         return hashed.decode('utf-8')
 
+    async def encode_async(self, raw_password: str) -> str:
+        """
+        在执行器中加密密码, 不阻塞事件循环
+        :param raw_password: 原始密码
+        :return: 加密后的密码
+        :raises ValueError: 如果密码为空
+        :raises PasswordEncoderBusyError: 如果排队任务已满
+        :raises asyncio.TimeoutError: 如果运算超时
+        """
+        if not raw_password:
+            raise ValueError('Password cannot be null')
+
+        salt = bcrypt.gensalt(rounds=self.strength)
+        hashed = await self._submit(_hashpw, raw_password.encode('utf-8'), salt)
+        return hashed.decode('utf-8')
+
     def matches(self, raw_password: str, encoded_password: str) -> bool:
         """
         验证密码
@@ -46,15 +125,124 @@ class BCryptPasswordEncoder:
         if not raw_password or not encoded_password:
             return False
 
-        try:
-            # 将输入转换为 bytes
-            raw_bytes = raw_password.encode('utf-8')
-            encoded_bytes = encoded_password.encode('utf-8')
-            # 验证密码
-            return bcrypt.checkpw(raw_bytes, encoded_bytes)
-        except (ValueError, TypeError):
+        # 将输入转换为 bytes 并验证密码
+        return _checkpw(raw_password.encode('utf-8'), encoded_password.encode('utf-8'))
+
+    async def matches_async(self, raw_password: str, encoded_password: str) -> bool:
+        """
+        在执行器中验证密码, 不阻塞事件循环
+
+        Args:
+            raw_password: 原始密码
+            encoded_password: 加密后的密码
+
+        Returns:
+            是否匹配
+
+        Raises:
+            PasswordEncoderBusyError: 排队任务已满
+            asyncio.TimeoutError: 运算超时
+        """
+        if not raw_password or not encoded_password:
             return False
 
+        return await self._submit(
+            _checkpw, raw_password.encode('utf-8'), encoded_password.encode('utf-8')
+        )
+
+    @property
+    def pending(self) -> int:
+        """当前排队/执行中的异步任务数"""
+        return self._pending
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        关闭执行器, 未开始的任务会被取消
+        :param wait: 是否等待执行中的任务完成
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _get_executor(self) -> Executor:
+        """按需创建执行器"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = self._create_executor()
+        return self._executor
+
+    def _create_executor(self) -> Executor:
+        """创建执行器; 进程池的子进程在首次提交任务时才启动, 启动失败表现为 BrokenProcessPool"""
+        max_workers = self.max_workers or default_max_workers()
+        if self.executor_type == "process":
+            # forkserver 避免从带有事件循环和线程的 worker 进程直接 fork
+            method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            return ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context(method),
+            )
+        # bcrypt 计算期间会释放 GIL, 线程池同样可以利用多核
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, fn, *args):
+        """
+        在执行器中运行任务并等待结果
+
+        排队名额在执行器中的任务结束时释放, 而不是在等待超时时释放: 超时后任务仍在执行器中
+        排队或运行, 提前释放会让 ``max_pending`` 失去对执行器积压的约束.
+        """
+        self._acquire()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException as e:
+            self._release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard_executor(executor)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            # 超时后取消等待; 任务尚未开始时一并从执行器中撤下
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise
+
+    async def _submit(self, fn, *args):
+        """提交任务到执行器, 并施加排队上限和超时"""
+        try:
+            return await self._run(fn, *args)
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用, 重建进程池后重试一次
+            return await self._run(fn, *args)
+
+    def _acquire(self) -> None:
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                raise PasswordEncoderBusyError(
+                    f'Too many pending password operations ({self._pending})'
+                )
+            self._pending += 1
+
+    def _release(self, future=None) -> None:
+        # 进程池的回调在其管理线程中执行, 计数需要加锁
+        with self._pending_lock:
+            self._pending -= 1
+
+    def _discard_executor(self, executor: Executor) -> None:
+        """丢弃已损坏的执行器, 下次使用时重新创建; 并发任务只会丢弃同一个执行器一次"""
+        with self._executor_lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
     def upgrade_encoding(self, encoded_password: str) -> bool:
         """
         检查是否需要升级加密强度
@@ -91,4 +279,10 @@ class BCryptPasswordEncoder:
 
 
 # 创建一个默认的加密器实例
-default_password_encoder = BCryptPasswordEncoder()
\ No newline at end of file
+default_password_encoder = BCryptPasswordEncoder(
+    strength=settings.bcrypt_strength,
+    executor=settings.bcrypt_executor,
+    max_workers=settings.bcrypt_max_workers,
+    max_pending=settings.bcrypt_max_pending,
+    timeout=settings.bcrypt_timeout,
+)
@@ -0,0 +1,373 @@
+"""
+两级响应缓存: 进程内 LRU + Redis
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import time
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+import redis
+from starlette.background import BackgroundTasks
+from starlette.requests import HTTPConnection
+from starlette.responses import Response
+
+from .configs import settings
+from .log import logger
+from .lru import LRUCache
+from .redis import async_redis_client
+from .responses import render_json
+
+
+class _LeaderCancelled(Exception):
+    """负责计算的请求被取消, 等待者需要重新发起计算"""
+
+
+class ResponseCache:
+    """两级缓存
+
+    读取顺序为本 worker 的 LRU -> Redis -> 重新计算. 同一个键的并发未命中会合并为一次计算
+    (single-flight): 进程内通过共享 Future 合并, 跨 worker 通过 Redis 短锁合并,
+    没抢到锁的 worker 轮询等待结果.
+
+    缓存条目可以带标签, ``invalidate_tags`` 会删除 Redis 中的条目并通过发布/订阅
+    通知所有 worker 清理本地条目.
+
+    Args:
+        client: 异步 Redis 客户端
+        maxsize: 本地 LRU 最大条目数
+        local_ttl: 本地条目最长存活时间(秒), 限制其他 worker 失效通知丢失时的陈旧时间
+        prefix: Redis 键前缀
+        lock_ttl: 重新计算时持有的 Redis 锁的存活时间(秒)
+        wait_timeout: 未抢到锁时等待其他 worker 计算结果的最长时间(秒)
+    """
+
+    def __init__(
+        self,
+        client,
+        maxsize: int = 1024,
+        local_ttl: float = 5.0,
+        prefix: str = "cache",
+        lock_ttl: float = 10.0,
+        wait_timeout: float = 2.0,
+    ):
+        self.client = client
+        self.local_ttl = local_ttl
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.channel = f"{prefix}:invalidate"
+        self._local: LRUCache[Tuple[bytes, Tuple[str, ...]]] = LRUCache(maxsize=maxsize)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[bytes]],
+        ttl: float,
+        tags: Sequence[str] = (),
+    ) -> bytes:
+        """
+        读取缓存, 未命中时计算并写入两级缓存
+
+        Args:
+            key: 缓存键(不含前缀)
+            compute: 计算函数, 返回序列化后的字节
+            ttl: Redis 条目存活时间(秒)
+            tags: 标签, 用于批量失效
+
+        Returns:
+            缓存或新计算的字节
+        """
+        while True:
+            entry = self._local.get(key)
+            if entry is not None:
+                return entry[0]
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                # 负责计算的请求被取消(例如客户端断开), 由等待者之一接手重新计算
+                continue
+
+        self._ensure_listener()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(key, compute, ttl, tuple(tags))
+            self._local.set(key, (value, tuple(tags)), ttl=min(ttl, self.local_ttl))
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # 不把取消传给等待者, 否则一个客户端断开会让同一个键的所有并发请求失败
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def invalidate(self, *keys: str) -> None:
+        """删除指定键"""
+        for key in keys:
+            self._local.pop(key)
+        if keys:
+            await self.client.delete(*(self._redis_key(k) for k in keys))
+
+    async def invalidate_tags(self, *tags: str) -> None:
+        """
+        删除带有任一指定标签的条目, 并通知所有 worker 清理本地缓存
+
+        Args:
+            tags: 标签列表
+        """
+        if not tags:
+            return
+        self._drop_local_tags(tags)
+        tag_keys = [self._tag_key(t) for t in tags]
+        members = set()
+        for tag_members in await asyncio.gather(*(self.client.smembers(k) for k in tag_keys)):
+            members.update(tag_members)
+        async with self.client.pipeline(transaction=False) as pipe:
+            if members:
+                pipe.delete(*members)
+            pipe.delete(*tag_keys)
+            pipe.publish(self.channel, json.dumps(list(tags)))
+            await pipe.execute()
+
+    def clear_local(self) -> None:
+        """清空本 worker 的本地缓存"""
+        self._local.clear()
+
+    async def close(self) -> None:
+        """停止失效通知监听"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+    async def _load(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[bytes]],
+        ttl: float,
+        tags: Tuple[str, ...],
+    ) -> bytes:
+        redis_key = self._redis_key(key)
+        try:
+            cached = await self.client.get(redis_key)
+            if cached is not None:
+                return cached.encode("utf-8")
+            lock_key = f"{redis_key}:lock"
+            locked = await self.client.set(lock_key, "1", nx=True, px=int(self.lock_ttl * 1000))
+            if not locked:
+                cached = await self._wait_for(redis_key)
+                if cached is not None:
+                    return cached
+        except redis.RedisError as e:
+            # Redis 不可用时退化为仅本地缓存
+            logger.warning(f"读取缓存失败 {key}: {e}")
+            return await compute()
+
+        try:
+            value = await compute()
+            await self._store(redis_key, value, ttl, tags)
+            return value
+        finally:
+            if locked:
+                try:
+                    await self.client.delete(lock_key)
+                except redis.RedisError:
+                    pass
+
+    async def _wait_for(self, redis_key: str) -> Optional[bytes]:
+        """等待持有锁的 worker 写入结果"""
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.01
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            cached = await self.client.get(redis_key)
+            if cached is not None:
+                return cached.encode("utf-8")
+            delay = min(delay * 2, 0.2)
+        return None
+
+    async def _store(self, redis_key: str, value: bytes, ttl: float, tags: Tuple[str, ...]) -> None:
+        px = max(1, int(ttl * 1000))
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.set(redis_key, value.decode("utf-8"), px=px)
+                for tag in tags:
+                    tag_key = self._tag_key(tag)
+                    pipe.sadd(tag_key, redis_key)
+                    # 标签集合中残留已过期的键无害, 只需保证不早于条目过期
+                    pipe.pexpire(tag_key, max(px, 86400 * 1000))
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"写入缓存失败 {redis_key}: {e}")
+
+    def _drop_local_tags(self, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        for key in self._local.keys():
+            entry = self._local.get(key)
+            if entry is not None and tags.intersection(entry[1]):
+                self._local.pop(key)
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        """订阅失效通知, 断线后重连"""
+        while True:
+            try:
+                async with self.client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        self._drop_local_tags(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"缓存失效通知订阅中断: {e}")
+                # 断线期间可能漏掉通知, 清空本地缓存
+                self._local.clear()
+                await asyncio.sleep(1)
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}:tag:{tag}"
+
+
+response_cache = ResponseCache(
+    async_redis_client,
+    maxsize=settings.cache_local_maxsize,
+    local_ttl=settings.cache_local_ttl,
+)
+
+_KEY_TYPES = (str, int, float, bool, Enum, type(None))
+# 不参与缓存键的参数类型(请求、响应、后台任务); 数据库会话在 _is_context 中判断
+_CONTEXT_TYPES = (HTTPConnection, Response, BackgroundTasks)
+
+
+def _is_context(value: Any) -> bool:
+    """是否为请求上下文参数(请求、响应、会话等), 这类参数不参与缓存键"""
+    if isinstance(value, _CONTEXT_TYPES):
+        return True
+    # 按需导入, 不让缓存模块连带加载 SQLAlchemy
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import Session
+
+    return isinstance(value, (AsyncSession, Session))
+
+
+def _key_scalar(value: Any) -> Any:
+    return value.value if isinstance(value, Enum) else value
+
+
+def _key_value(func: Callable, name: str, value: Any) -> Optional[str]:
+    """
+    参数在缓存键中的表示
+
+    简单类型直接使用; 列表和元组按顺序、集合排序后使用, 元素须为简单类型;
+    请求上下文参数返回 None, 不参与缓存键.
+
+    Raises:
+        TypeError: 参数无法用于缓存键
+    """
+    if isinstance(value, _KEY_TYPES):
+        return str(_key_scalar(value))
+    if isinstance(value, (list, tuple, set, frozenset)) and all(isinstance(v, _KEY_TYPES) for v in value):
+        items = [_key_scalar(v) for v in value]
+        if isinstance(value, (set, frozenset)):
+            items.sort(key=lambda v: (type(v).__name__, str(v)))
+        return json.dumps(items, ensure_ascii=False, default=str)
+    if _is_context(value):
+        return None
+    raise TypeError(
+        f"Argument {name!r} of {func.__qualname__} ({type(value).__name__}) cannot be used "
+        f"in a cache key; pass key_builder to @cached"
+    )
+
+
+def default_key_builder(func: Callable, kwargs: Dict[str, Any]) -> str:
+    """
+    默认缓存键: 函数全名加上所有参数, 请求、响应、会话等上下文参数不参与
+
+    参数只能是简单类型或由简单类型组成的列表、元组、集合; 其他参数(请求体模型、令牌声明等)
+    无法可靠地区分缓存条目, 需要自定义 ``key_builder``.
+
+    Args:
+        func: 被缓存的函数
+        kwargs: 调用参数
+
+    Returns:
+        缓存键
+
+    Raises:
+        TypeError: 有参数无法用于缓存键
+    """
+    parts = []
+    for k, v in sorted(kwargs.items()):
+        value = _key_value(func, k, v)
+        if value is not None:
+            parts.append(f"{k}={value}")
+    args = "&".join(parts)
+    if len(args) > 128:
+        args = hashlib.sha1(args.encode("utf-8")).hexdigest()
+    return f"{func.__module__}.{func.__qualname__}:{args}"
+
+
+def cached(
+    ttl: float = 60,
+    tags: Sequence[str] = (),
+    key_builder: Optional[Callable[[Callable, Dict[str, Any]], str]] = None,
+    cache: Optional[ResponseCache] = None,
+):
+    """
+    路由缓存装饰器, 缓存序列化后的响应字节
+
+    放在 ``@router.get`` 下方使用. 被装饰的处理器返回值会直接序列化为 JSON 并以
+    ``Response`` 返回, 因此 ``response_model`` 只用于文档, 不再做过滤.
+    标签中可以引用参数, 例如 ``tags=["course:{course_id}"]``.
+
+    Args:
+        ttl: Redis 条目存活时间(秒)
+        tags: 标签列表, 用于批量失效
+        key_builder: 自定义缓存键函数, 参数为 (func, kwargs); 处理器有非简单类型的参数
+            (请求体模型、令牌声明等)时必须提供
+        cache: 缓存实例, 默认使用 response_cache
+
+    Returns:
+        装饰器
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            target = cache or response_cache
+            key = (key_builder or default_key_builder)(func, kwargs)
+            entry_tags = [tag.format(**kwargs) for tag in tags]
+
+            async def compute() -> bytes:
+                return render_json(await func(*args, **kwargs))
+
+            body = await target.get_or_compute(key, compute, ttl, entry_tags)
+            return Response(content=body, media_type="application/json")
+
+        return wrapper
+
+    return decorator
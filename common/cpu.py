@@ -0,0 +1,34 @@
+"""
+可用 CPU 数
+"""
+import os
+from pathlib import Path
+
+
+def cpu_limit() -> float:
+    """
+    可用的 CPU 数: cgroup 配额(v2 或 v1)与 CPU 亲和性中较小者
+
+    Returns:
+        CPU 数, 配额为小数时可能不是整数
+    """
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cpus = float(os.cpu_count() or 1)
+
+    quota = period = None
+    try:
+        # cgroup v2: "<配额> <周期>", 不限制时配额为 max
+        value, interval = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if value != "max":
+            quota, period = int(value), int(interval)
+    except (OSError, ValueError):
+        try:
+            quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+            period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        except (OSError, ValueError):
+            pass
+    if quota and period and quota > 0:
+        cpus = min(cpus, quota / period)
+    return cpus
@@ -0,0 +1,236 @@
+"""
+ETag 与条件 GET
+"""
+import functools
+import hashlib
+import inspect
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .responses import PayloadResponse
+
+_CONDITIONAL_METHODS = ("GET", "HEAD")
+
+# 默认只缓冲 JSON 响应; 流式响应(如 SSE)、指标文本和文件等原样透传
+_HASHED_TYPES = ("application/json",)
+
+
+def compute_etag(body: bytes) -> str:
+    """
+    根据响应体计算强 ETag
+
+    Args:
+        body: 响应体
+
+    Returns:
+        带引号的 ETag
+    """
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def version_etag(version: str) -> str:
+    """
+    根据处理器提供的版本号生成强 ETag
+
+    Args:
+        version: 版本号
+
+    Returns:
+        带引号的 ETag
+    """
+    return f'"v-{version}"'
+
+
+def _parse_if_none_match(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    tags = []
+    for tag in value.split(","):
+        tag = tag.strip()
+        # If-None-Match 使用弱比较
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag:
+            tags.append(tag)
+    return tags
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    判断 If-None-Match 是否命中
+
+    Args:
+        if_none_match: 请求头的值
+        etag: 当前 ETag
+
+    Returns:
+        是否命中
+    """
+    tags = _parse_if_none_match(if_none_match)
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str, headers: Optional[Headers] = None) -> Response:
+    """
+    构造 304 响应, 保留与缓存相关的响应头
+
+    Args:
+        etag: 当前 ETag
+        headers: 原响应头
+
+    Returns:
+        304 响应
+    """
+    response = Response(status_code=304, headers={"ETag": etag})
+    if headers is not None:
+        for name in ("cache-control", "vary", "expires", "content-location"):
+            if name in headers:
+                response.headers[name] = headers[name]
+    return response
+
+
+class ETagMiddleware:
+    """为 GET/HEAD 的 200 JSON 响应添加 ETag 并处理 If-None-Match 的 ASGI 中间件
+
+    响应已带 ETag(例如由 ``conditional`` 提供的版本号)时直接使用, 不论内容类型.
+    否则只有 ``content_types`` 中的响应会被缓冲并计算哈希, 其他类型(流式响应、指标文本、
+    文件等)以及超过 ``max_body_size`` 的响应原样透传. HEAD 响应没有响应体,
+    哈希与 GET 的 ETag 对不上, 因此只透传处理器自带的 ETag, 不计算.
+
+    Args:
+        app: ASGI 应用
+        max_body_size: 计算 ETag 的最大响应体(字节)
+        content_types: 计算 ETag 的内容类型(前缀匹配), 默认只有 ``application/json``
+    """
+
+    def __init__(
+        self,
+        app,
+        max_body_size: int = 1024 * 1024,
+        content_types: Sequence[str] = _HASHED_TYPES,
+    ):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.content_types = tuple(content_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in _CONDITIONAL_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start = None
+        chunks: List[bytes] = []
+        size = 0
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, size, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if message["status"] != 200:
+                    passthrough = True
+                    await send(message)
+                    return
+                etag = headers.get("etag")
+                if etag is not None:
+                    # 已有 ETag, 无需缓冲
+                    passthrough = True
+                    if etag_matches(if_none_match, etag):
+                        await not_modified(etag, headers)(scope, receive, send)
+                        passthrough = None
+                        return
+                    await send(message)
+                    return
+                content_type = headers.get("content-type", "")
+                if scope["method"] == "HEAD" or not content_type.startswith(self.content_types):
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough is None:
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            more_body = message.get("more_body", False)
+            if more_body and size > self.max_body_size:
+                passthrough = True
+                await send(start)
+                await send({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+                return
+            if more_body:
+                return
+
+            body = b"".join(chunks)
+            etag = compute_etag(body)
+            headers = MutableHeaders(raw=start["headers"])
+            if etag_matches(if_none_match, etag):
+                await not_modified(etag, headers)(scope, receive, send)
+                return
+            headers["etag"] = etag
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def conditional(version: Callable[..., Awaitable[str]]):
+    """
+    条件 GET 装饰器: 处理器提供的版本号未变化时直接返回 304, 不执行处理器
+
+    放在 ``@router.get`` 下方(如有 ``@cached``, 放在其上方). ``version`` 是一个异步函数,
+    其参数按名称从处理器参数中取, 例如 ``async def version(session): ...``.
+    返回的响应带有 ``ETag``; 处理器返回值不是 Response 时会直接序列化, 与 ``cached`` 相同,
+    ``response_model`` 只用于文档.
+
+    Args:
+        version: 计算当前版本号的异步函数, 应当比处理器本身廉价得多
+
+    Returns:
+        装饰器
+    """
+    version_params = list(inspect.signature(version).parameters)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        request_param = next(
+            (p.name for p in signature.parameters.values() if p.annotation is Request),
+            None,
+        )
+        injected = request_param is None
+        if injected:
+            request_param = "_conditional_request"
+            parameters = list(signature.parameters.values())
+            parameters.append(
+                inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+            )
+            signature = signature.replace(parameters=parameters)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs.pop(request_param) if injected else kwargs[request_param]
+            etag = version_etag(await version(**{name: kwargs[name] for name in version_params}))
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return not_modified(etag)
+
+            response = await func(*args, **kwargs)
+            if not isinstance(response, Response):
+                response = PayloadResponse(content=response)
+            response.headers["ETag"] = etag
+            return response
+
+        wrapper.__signature__ = signature
+        return wrapper
+
+    return decorator
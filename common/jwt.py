@@ -1,9 +1,22 @@
+import asyncio
+import time
+import uuid
 from datetime import timedelta, datetime
-from typing import Optional
+from typing import Dict, Iterable, Optional
 
 import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette import status
 
 from .configs import settings
+from .log import logger
+from .lru import LRUCache
+from .redis import async_redis_client
+
+
+class TokenRevokedError(jwt.InvalidTokenError):
+    """令牌已被吊销"""
 
 
 def create_jwt_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -20,5 +33,256 @@ def create_jwt_token(data: dict, expires_delta: Optional[timedelta] = None):
     # 添加发布时间
     to_encode.update({"iat": datetime.utcnow()})
 
+    # 添加令牌ID, 用于吊销
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+
     encoded_jwt = jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+
+# 写入吊销记录: 版本号加一, 记录写入完整集合(分值为 exp)和变更日志(分值为版本号),
+# 清理已过期的记录并把变更日志截断到最近 log_size 个版本. 返回新版本号
+# KEYS: 完整集合, 版本号, 变更日志
+# ARGV: 当前时间, log_size, jti1, exp1, jti2, exp2, ...
+_REVOKE_SCRIPT = """
+local version = redis.call('INCR', KEYS[2])
+for i = 3, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+    redis.call('ZADD', KEYS[3], version, ARGV[i + 1] .. ':' .. ARGV[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', version - tonumber(ARGV[2]))
+return version
+"""
+
+
+class TokenRevocationList:
+    """基于 Redis 的令牌吊销列表
+
+    吊销记录保存在 Redis 有序集合中(成员为 jti, 分值为令牌的 exp), 并维护一个版本号.
+    每次吊销使版本号加一, 同时把记录写入按版本号排序的变更日志.
+    每个 worker 在本地保存一份镜像, 校验时只查本地字典; 最多每 ``sync_interval`` 秒
+    读取一次版本号, 版本变化时只拉取本地版本之后的变更. 首次同步、落后超过 ``log_size``
+    个版本或版本号回退(例如 Redis 被清空)时才拉取完整列表.
+
+    Args:
+        client: 异步 Redis 客户端
+        sync_interval: 同步间隔(秒), 也是跨 worker 吊销生效的最大延迟
+        key: Redis 键前缀
+        log_size: 变更日志保留的版本数
+    """
+
+    def __init__(
+        self,
+        client,
+        sync_interval: float = 1.0,
+        key: str = "jwt:revoked",
+        log_size: int = 10000,
+    ):
+        self.client = client
+        self.sync_interval = sync_interval
+        self.key = key
+        self.version_key = f"{key}:version"
+        self.log_key = f"{key}:log"
+        self.log_size = log_size
+        self._script = client.register_script(_REVOKE_SCRIPT)
+        self._revoked: Dict[str, float] = {}
+        self._version: Optional[int] = None
+        self._synced_at: Optional[float] = None
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """
+        检查令牌是否已吊销(仅查本地镜像)
+
+        Args:
+            jti: 令牌ID
+
+        Returns:
+            是否已吊销
+        """
+        if not jti:
+            return False
+        exp = self._revoked.get(jti)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            # 令牌本身已过期, 无需再记录
+            del self._revoked[jti]
+            return False
+        return True
+
+    async def revoke(self, jti: str, exp: float) -> None:
+        """
+        吊销令牌
+
+        Args:
+            jti: 令牌ID
+            exp: 令牌过期时间戳, 过期后记录会被清理
+        """
+        await self.revoke_many({jti: exp})
+
+    async def revoke_many(self, tokens: Dict[str, float]) -> None:
+        """
+        批量吊销令牌, 在一次 Redis 往返中完成
+
+        Args:
+            tokens: jti -> exp 映射
+        """
+        if not tokens:
+            return
+        self._revoked.update(tokens)
+        await self._write(tokens)
+
+    async def sync(self) -> None:
+        """立即与 Redis 同步"""
+        version, revoked, full = await self._fetch(self._version)
+        if full:
+            self._revoked = revoked
+        else:
+            self._revoked.update(revoked)
+        self._version = version
+        self._synced_at = time.monotonic()
+
+    async def maybe_sync(self) -> None:
+        """
+        按需同步: 首次调用时等待同步完成, 之后到期时在后台同步, 不阻塞当前请求
+        """
+        if self._synced_at is None:
+            await self._background_sync()
+            return
+        if time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._background_sync())
+
+    async def _background_sync(self) -> None:
+        try:
+            await self.sync()
+        except Exception as e:
+            # Redis 不可用时沿用本地镜像, 下个周期重试
+            logger.warning(f"同步令牌吊销列表失败: {e}")
+            self._synced_at = time.monotonic()
+
+    async def _write(self, tokens: Dict[str, float]) -> None:
+        args = [time.time(), self.log_size]
+        for jti, exp in tokens.items():
+            args += [jti, repr(float(exp))]
+        await self._script(keys=[self.key, self.version_key, self.log_key], args=args)
+
+    async def _fetch(self, known_version: Optional[int]):
+        """
+        读取本地版本之后的吊销记录
+
+        Returns:
+            (版本号, jti -> exp, 是否为完整列表)
+        """
+        # 尚未有吊销记录时版本号为 0
+        version = int(await self.client.get(self.version_key) or 0)
+        now = time.time()
+        if known_version is not None and known_version <= version <= known_version + self.log_size:
+            if version == known_version:
+                return version, {}, False
+            entries = await self.client.zrangebyscore(self.log_key, f"({known_version}", version)
+            revoked = {}
+            for entry in entries:
+                exp, jti = entry.split(":", 1)
+                if float(exp) > now:
+                    revoked[jti] = float(exp)
+            return version, revoked, False
+        members = await self.client.zrangebyscore(self.key, now, "+inf", withscores=True)
+        return version, {jti: exp for jti, exp in members}, True
+
+
+revocation_list = TokenRevocationList(
+    async_redis_client, sync_interval=settings.jwt_revocation_sync_interval
+)
+
+# 已校验令牌的缓存, 条目存活时间不超过令牌自身的 exp
+_verified_tokens: LRUCache[dict] = LRUCache(
+    maxsize=settings.jwt_cache_size, ttl=settings.jwt_cache_ttl
+)
+
+
+def verify_jwt_token(token: str) -> dict:
+    """
+    校验令牌并返回声明
+
+    签名和声明校验的结果会缓存在本 worker 内; 吊销状态每次都会检查(本地字典查找).
+    返回的字典在缓存中共享, 调用方不应修改.
+
+    Args:
+        token: JWT 字符串
+
+    Returns:
+        令牌声明
+
+    Raises:
+        jwt.InvalidTokenError: 令牌无效、过期或已吊销
+    """
+    claims = _verified_tokens.get(token)
+    if claims is None:
+        claims = jwt.decode(
+            token,
+            settings.jwt_secret_key,
+            algorithms=[settings.jwt_algorithm],
+            options={"require": ["exp"]},
+        )
+        _verified_tokens.set(
+            token, claims, ttl=min(settings.jwt_cache_ttl, claims["exp"] - time.time())
+        )
+    elif claims["exp"] <= time.time():
+        _verified_tokens.pop(token)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+    if revocation_list.is_revoked(claims.get("jti")):
+        raise TokenRevokedError("Token has been revoked")
+    return claims
+
+
+async def revoke_jwt_tokens(tokens: Iterable[str]) -> None:
+    """
+    吊销令牌(例如退出登录), 所有 worker 在一个同步周期内生效
+
+    Args:
+        tokens: JWT 字符串列表, 无效或没有 jti 的令牌会被忽略
+    """
+    revoked = {}
+    for token in tokens:
+        _verified_tokens.pop(token)
+        try:
+            claims = jwt.decode(
+                token,
+                settings.jwt_secret_key,
+                algorithms=[settings.jwt_algorithm],
+                options={"verify_exp": False},
+            )
+        except jwt.InvalidTokenError:
+            continue
+        if claims.get("jti") and "exp" in claims:
+            revoked[claims["jti"]] = float(claims["exp"])
+    await revocation_list.revoke_many(revoked)
+
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+async def get_current_claims(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> dict:
+    """FastAPI 依赖: 校验 Bearer 令牌并返回声明"""
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    await revocation_list.maybe_sync()
+    try:
+        return verify_jwt_token(credentials.credentials)
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -0,0 +1,129 @@
+"""
+基于 Redis 的 leader 选举
+"""
+import asyncio
+import uuid
+from typing import Awaitable, Callable, Optional
+
+import redis
+
+from .log import logger
+
+# 只有持有者才能续期和释放, 避免锁过期被他人取得后误删
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLock:
+    """Redis leader 锁
+
+    多个 worker 以相同的 ``name`` 竞争, 同一时刻只有一个持有者. 锁以随机令牌
+    ``SET NX PX`` 取得, 持有期间每 ``ttl / 3`` 秒续期一次; 持有者崩溃后锁在 ``ttl``
+    秒内过期, 由其他 worker 接替.
+
+    Args:
+        client: 异步 Redis 客户端
+        name: 锁名称
+        ttl: 锁的存活时间(秒)
+        retry_interval: 未取得锁时重试的间隔(秒), 默认与续期间隔相同
+    """
+
+    def __init__(self, client, name: str, ttl: float = 30.0, retry_interval: Optional[float] = None):
+        self.client = client
+        self.key = f"leader:{name}"
+        self.ttl = ttl
+        self.renew_interval = ttl / 3
+        self.retry_interval = retry_interval if retry_interval is not None else self.renew_interval
+        self.token = uuid.uuid4().hex
+        self._renew = client.register_script(_RENEW_SCRIPT)
+        self._release = client.register_script(_RELEASE_SCRIPT)
+        self.is_leader = False
+
+    async def acquire(self) -> bool:
+        """尝试取得锁, 已持有时续期"""
+        if self.is_leader:
+            return await self.renew()
+        self.is_leader = bool(await self.client.set(self.key, self.token, nx=True, px=self._ttl_ms))
+        return self.is_leader
+
+    async def renew(self) -> bool:
+        """续期, 锁已不属于自己时返回 False"""
+        self.is_leader = bool(await self._renew(keys=[self.key], args=[self.token, self._ttl_ms]))
+        return self.is_leader
+
+    async def release(self) -> None:
+        """释放锁(只释放自己持有的)"""
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        try:
+            await self._release(keys=[self.key], args=[self.token])
+        except redis.RedisError as e:
+            logger.warning(f"释放 leader 锁 {self.key} 失败: {e}")
+
+    async def run(self, job: Callable[[], Awaitable[None]]) -> None:
+        """
+        持续竞争锁, 成为 leader 后执行 ``job``, 失去锁时取消它
+
+        ``job`` 应当是一直运行的协程, 返回或抛出异常后会释放锁并重新竞争.
+        本方法一直运行直到被取消, 取消时释放锁.
+
+        Args:
+            job: 返回协程的函数
+        """
+        try:
+            while True:
+                try:
+                    acquired = await self.acquire()
+                except redis.RedisError as e:
+                    logger.warning(f"竞争 leader 锁 {self.key} 失败: {e}")
+                    acquired = False
+                if acquired:
+                    logger.info(f"成为 {self.key} 的 leader")
+                    await self._lead(job)
+                    logger.info(f"不再是 {self.key} 的 leader")
+                await asyncio.sleep(self.retry_interval)
+        finally:
+            await self.release()
+
+    async def _lead(self, job: Callable[[], Awaitable[None]]) -> None:
+        task = asyncio.create_task(job())
+        try:
+            while not task.done():
+                done, _ = await asyncio.wait({task}, timeout=self.renew_interval)
+                if done:
+                    break
+                try:
+                    renewed = await self.renew()
+                except redis.RedisError as e:
+                    # 无法确认是否仍持有锁, 按失去处理; 锁在 ttl 内自然过期
+                    logger.warning(f"续期 leader 锁 {self.key} 失败: {e}")
+                    renewed = False
+                if not renewed:
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+            except Exception as e:
+                logger.exception(f"leader 任务 {self.key} 异常退出: {e}")
+            await self.release()
+
+    @property
+    def _ttl_ms(self) -> int:
+        return max(1, int(self.ttl * 1000))
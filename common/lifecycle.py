@@ -0,0 +1,150 @@
+"""
+worker 启动预热与关闭
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+from fastapi import FastAPI
+
+from .log import logger
+
+
+def prebuild_schema(app: FastAPI) -> int:
+    """
+    预先生成 OpenAPI 文档, FastAPI 会缓存结果
+
+    Returns:
+        路径数
+    """
+    return len(app.openapi().get("paths", {}))
+
+
+async def asgi_get(app, path: str, headers: Iterable[Tuple[bytes, bytes]] = ()) -> Tuple[int, bytes]:
+    """
+    在进程内向 ASGI 应用发送一个 GET 请求, 不经过网络
+
+    Args:
+        app: ASGI 应用
+        path: 路径, 可以带查询字符串
+        headers: 额外的请求头
+
+    Returns:
+        (状态码, 响应体)
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"host", b"localhost"), (b"user-agent", b"warm-up"), *headers],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+        "state": {},
+    }
+    status = 0
+    body = []
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # 再次读取是在监听断开, 响应发送完后再返回
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return status, b"".join(body)
+
+
+async def run_warm_up(
+    app: FastAPI,
+    steps: Optional[Mapping[str, Callable[[], Awaitable[Any]]]] = None,
+    paths: Iterable[str] = (),
+    timeout: float = 10.0,
+) -> Dict[str, Optional[float]]:
+    """
+    worker 接收请求前的预热
+
+    依次生成 OpenAPI 文档、执行 ``steps``(例如建立连接池、加载索引),
+    最后在进程内请求 ``paths``, 走一遍完整的中间件、依赖注入和序列化路径.
+    每一步单独计时和限时, 失败只记录警告, 不阻止 worker 启动.
+
+    Args:
+        app: 应用
+        steps: 名称 -> 异步预热函数
+        paths: 预热请求的路径
+        timeout: 每一步的超时(秒)
+
+    Returns:
+        名称 -> 耗时(秒), 失败的步骤为 None
+    """
+    timings: Dict[str, Optional[float]] = {}
+
+    async def run(name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), timeout)
+            timings[name] = time.perf_counter() - start
+        except Exception as e:
+            timings[name] = None
+            logger.warning(f"预热 {name} 失败: {type(e).__name__}: {e}")
+
+    async def sync_step(func, *args):
+        return func(*args)
+
+    await run("openapi", lambda: sync_step(prebuild_schema, app))
+    for name, step in (steps or {}).items():
+        await run(name, step)
+
+    async def request(path: str) -> None:
+        status, _ = await asgi_get(app, path)
+        if status >= 500:
+            raise RuntimeError(f"状态码 {status}")
+
+    for path in paths:
+        await run(f"GET {path}", lambda path=path: request(path))
+
+    logger.info(
+        "预热完成: "
+        + ", ".join(
+            f"{name} {'失败' if seconds is None else f'{seconds * 1000:.0f}ms'}"
+            for name, seconds in timings.items()
+        )
+    )
+    return timings
+
+
+async def run_shutdown(steps: Mapping[str, Callable[[], Any]], timeout: float = 10.0) -> None:
+    """
+    依次执行关闭步骤, 单个步骤失败或超时不影响后续步骤
+
+    Args:
+        steps: 名称 -> 关闭函数(同步或异步)
+        timeout: 每一步的超时(秒)
+    """
+    for name, step in steps.items():
+        try:
+            result = step()
+            if asyncio.iscoroutine(result):
+                await asyncio.wait_for(result, timeout)
+        except Exception as e:
+            logger.warning(f"关闭 {name} 失败: {type(e).__name__}: {e}")
@@ -1,95 +1,345 @@
+import atexit
+import fcntl
+import json
+import os
+import random
 import sys
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Dict, Iterator, Optional, TextIO
 
 from loguru import logger
 
 from .configs import settings
 
+TEXT_FORMAT = "{time:%Y-%m-%d %H:%M:%S} | {level: <8} | {name}:{function}:{line} - {message}"
 
-def configure_logger():
-    """配置日志"""
+ERROR_LEVEL_NO = logger.level("ERROR").no
+WARNING_LEVEL_NO = logger.level("WARNING").no
 
-    # 项目根目录
-    project_root = Path(__file__).parent.parent
 
-    # 日志文件路径
-    log_path = project_root / ".logs"
-    log_path.mkdir(exist_ok=True)
+class BufferedFileWriter:
+    """按天轮转的缓冲文件写入器
 
-    # 移除默认处理器
+    写入先进入文件缓冲区, 由 LogRouter 定期统一刷新. 跨天时把当前文件重命名为
+    ``<name>.<日期>.log``, 同时清理超过保留期的旧文件.
+
+    多个 worker 进程写同一个文件: 轮转在 ``<name>.log.lock`` 文件锁内进行, 只有第一个
+    跨天的进程重命名, 其他进程发现文件已被换掉后直接打开新文件. 其他进程在各自轮转前
+    仍可能向已重命名的文件追加记录, 因此压缩推迟到下一次轮转, 只压缩更早的文件.
+
+    Args:
+        path: 日志文件路径
+        buffer_size: 文件缓冲区大小(字节)
+        retention_days: 保留天数
+        compression: 轮转后是否压缩为 zip
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        buffer_size: int = 64 * 1024,
+        retention_days: int = 30,
+        compression: bool = True,
+    ):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.retention_days = retention_days
+        self.compression = compression
+        self._lock_path = path.with_name(path.name + ".lock")
+        self._file: Optional[TextIO] = None
+        self._date = None
+        self._rollover_at = 0.0
+
+    def write(self, text: str, timestamp: float) -> None:
+        if timestamp >= self._rollover_at or self._file is None:
+            self._rollover(timestamp)
+        self._file.write(text)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rollover(self, timestamp: float) -> None:
+        day = datetime.fromtimestamp(timestamp).date()
+        with self._locked():
+            if self._file is not None and not self._is_current():
+                # 其他进程已经轮转, 改为写入新文件
+                self.close()
+                self._date = None
+            if self._file is None and self.path.exists():
+                # 进程重启或文件被轮转时, 按文件的修改日期判断是否需要轮转
+                self._date = datetime.fromtimestamp(self.path.stat().st_mtime).date()
+            if self._date is not None and self._date != day and self.path.exists():
+                self.close()
+                rotated = self.path.with_name(f"{self.path.stem}.{self._date.isoformat()}{self.path.suffix}")
+                if not rotated.exists():
+                    self.path.rename(rotated)
+                    threading.Thread(target=self._archive, args=(rotated,), daemon=True).start()
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=self.buffer_size)
+        self._date = day
+        midnight = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        self._rollover_at = midnight.timestamp()
+
+    def _is_current(self) -> bool:
+        """打开的文件是否仍是 ``path`` 指向的文件"""
+        try:
+            return os.fstat(self._file.fileno()).st_ino == self.path.stat().st_ino
+        except OSError:
+            return False
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _archive(self, rotated: Path) -> None:
+        """压缩之前轮转出的文件(刚轮转的文件可能还有进程在写, 留到下一次)并清理过期文件"""
+        try:
+            with self._locked():
+                if self.compression:
+                    for old in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}"):
+                        # 文件名中的日期是 ISO 格式, 按字符串比较即可
+                        if old == self.path or old.name >= rotated.name:
+                            continue
+                        with zipfile.ZipFile(old.with_suffix(old.suffix + ".zip"), "w", zipfile.ZIP_DEFLATED) as zf:
+                            zf.write(old, old.name)
+                        old.unlink()
+                cutoff = time.time() - self.retention_days * 86400
+                for old in self.path.parent.glob(f"{self.path.stem}.*"):
+                    if old not in (self.path, self._lock_path) and old.stat().st_mtime < cutoff:
+                        old.unlink()
+        except OSError:
+            pass
+
+
+class ChannelLimiter:
+    """日志通道的采样和限流
+
+    Args:
+        sample_rate: 采样率, 0~1
+        rate_limit: 每秒最多记录数, None 表示不限
+    """
+
+    def __init__(self, sample_rate: float = 1.0, rate_limit: Optional[float] = None):
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self._tokens = rate_limit or 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def allow(self) -> bool:
+        # 过滤器在记录日志的线程中执行, 可能同时来自事件循环和线程池
+        with self._lock:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                self.dropped += 1
+                return False
+            if self.rate_limit is not None:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+                self._updated = now
+                if self._tokens < 1.0:
+                    self.dropped += 1
+                    return False
+                self._tokens -= 1.0
+            return True
+
+
+class LogRouter:
+    """单一日志处理器: 按 ``extra["name"]`` 把记录分发到各个通道文件
+
+    作为唯一一个 ``enqueue=True`` 的 loguru 处理器注册, 所有通道共用一个队列和后台线程.
+    每条记录只格式化一次, 通道查找是一次字典访问; 文件写入经过缓冲, 由刷新线程
+    每 ``flush_interval`` 秒统一刷盘.
+
+    Args:
+        log_path: 日志目录
+        level_no: 最低记录级别
+        json_lines: 是否输出 JSON Lines 格式
+        channels: 通道名列表, 每个通道写入 ``<通道名>.log``
+        stdout: 是否同时输出到标准输出
+        buffer_size: 文件缓冲区大小(字节)
+        flush_interval: 刷盘间隔(秒)
+        retention_days: 日志保留天数
+    """
+
+    def __init__(
+        self,
+        log_path: Path,
+        level_no: int,
+        json_lines: bool = False,
+        channels=("agents", "chat", "payment"),
+        stdout: bool = True,
+        buffer_size: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        retention_days: int = 30,
+    ):
+        self.level_no = level_no
+        self.json_lines = json_lines
+        self.stdout = sys.stdout if stdout else None
+
+        def writer(name: str) -> BufferedFileWriter:
+            return BufferedFileWriter(log_path / f"{name}.log", buffer_size, retention_days)
+
+        self.info = writer("info")
+        self.error = writer("error")
+        self.channels: Dict[str, BufferedFileWriter] = {name: writer(name) for name in channels}
+        self._writers = [self.info, self.error, *self.channels.values()]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, args=(flush_interval,), name="log-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def __call__(self, message) -> None:
+        record = message.record
+        level_no = record["level"].no
+        timestamp = record["time"].timestamp()
+        line = self._format(record, str(message))
+        with self._lock:
+            self.info.write(line, timestamp)
+            if level_no >= ERROR_LEVEL_NO:
+                self.error.write(line, timestamp)
+            channel = self.channels.get(record["extra"].get("name"))
+            if channel is not None:
+                channel.write(line, timestamp)
+            if self.stdout is not None:
+                self.stdout.write(line)
+
+    def flush(self) -> None:
+        with self._lock:
+            for writer in self._writers:
+                writer.flush()
+            if self.stdout is not None:
+                self.stdout.flush()
+
+    def stop(self) -> None:
+        """loguru 移除处理器时调用"""
+        self._stopped.set()
+        with self._lock:
+            for writer in self._writers:
+                writer.close()
+            if self.stdout is not None:
+                self.stdout.flush()
+
+    def _flush_periodically(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _format(self, record, text: str) -> str:
+        if self.json_lines:
+            message, _, exception = text.partition("\n")
+            entry = {
+                "time": record["time"].isoformat(),
+                "level": record["level"].name,
+                "channel": record["extra"].get("name"),
+                "name": record["name"],
+                "function": record["function"],
+                "line": record["line"],
+                "message": message,
+            }
+            if exception.strip():
+                entry["exception"] = exception.rstrip("\n")
+            return json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        if not text.endswith("\n"):
+            text += "\n"
+        return TEXT_FORMAT.format(
+            time=record["time"],
+            level=record["level"].name,
+            name=record["name"],
+            function=record["function"],
+            line=record["line"],
+            message=text,
+        )
+
+
+def _channel_filter(limiters: Dict[str, ChannelLimiter]):
+    """在调用方线程中执行采样和限流, 被丢弃的记录不会进入队列; 警告及以上级别始终保留"""
+
+    def accept(record) -> bool:
+        limiter = limiters.get(record["extra"].get("name"))
+        return limiter is None or record["level"].no >= WARNING_LEVEL_NO or limiter.allow()
+
+    return accept
+
+
+_router: Optional[LogRouter] = None
+
+
+def shutdown_logger() -> None:
+    """移除处理器, 等待队列中的记录写完并关闭日志文件"""
+    global _router
     logger.remove()
-    level = "DEBUG" if settings.mode == "dev" else "INFO"
-    # 添加控制台处理器 (开发环境)
-    logger.add(
-        sys.stdout,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
-        "<level>{level: <8}</level> | "
-        "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
-        "<level>{message}</level>",
-        level=level,
-        enqueue=True,
-    )
+    if _router is not None:
+        _router.stop()
+        _router = None
 
-    # 添加文件处理器 (INFO级别)
-    logger.add(
-        log_path / "info.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        level=level,
-        rotation="1 day",  # 每天轮转
-        retention="30 days",  # 保留30天
-        compression="zip",  # 压缩
-        enqueue=True,
-    )
 
-    # 添加文件处理器 (ERROR级别)
-    logger.add(
-        log_path / "error.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        level="ERROR",
-        rotation="1 day",
-        retention="30 days",
-        compression="zip",
-        enqueue=True,
-    )
+def configure_logger(log_path: Optional[Path] = None):
+    """配置日志
 
-    # 智能体相关的日志
-    logger.add(
-        log_path / "agents.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        filter=lambda record: record.get("extra", {}).get("name") == "agents",
-        rotation="1 day",
-        level=level,
-        retention="30 days",
-        compression="zip",
-        enqueue=True,
-    )
-    # 添加聊天相关的日志处理器
-    logger.add(
-        log_path / "chat.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        filter=lambda record: record.get("extra", {}).get("name") == "chat",
-        rotation="1 day",  # 每天轮转
-        level=level,
-        retention="30 days",  # 保留30天
-        compression="zip",  # 压缩
-        enqueue=True,
+    Args:
+        log_path: 日志目录, 默认为项目根目录下的 .logs
+    """
+    global _router
+
+    # 日志文件路径
+    log_path = log_path or Path(__file__).parent.parent / ".logs"
+    log_path.mkdir(exist_ok=True)
+
+    # 移除默认处理器
+    shutdown_logger()
+    level = "DEBUG" if settings.mode == "dev" else "INFO"
+    limiters = {
+        name: ChannelLimiter(
+            sample_rate=settings.log_sample_rates.get(name, 1.0),
+            rate_limit=settings.log_rate_limits.get(name),
+        )
+        for name in set(settings.log_sample_rates) | set(settings.log_rate_limits)
+    }
+    router = LogRouter(
+        log_path,
+        level_no=logger.level(level).no,
+        json_lines=settings.log_format == "json",
+        buffer_size=settings.log_buffer_size,
+        flush_interval=settings.log_flush_interval,
+        retention_days=settings.log_retention_days,
     )
-    # 添加支付相关的日志处理器
+    # 进程退出时写完队列中的记录; 重复配置时只注册一次
+    atexit.unregister(shutdown_logger)
+    atexit.register(shutdown_logger)
+    _router = router
     logger.add(
-        log_path / "payment.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        filter=lambda record: record.get("extra", {}).get("name") == "payment",
-        rotation="1 day",  # 每天轮转
+        router,
+        format="{message}",
         level=level,
-        retention="30 days",  # 保留30天
-        compression="zip",  # 压缩
+        filter=_channel_filter(limiters) if limiters else None,
         enqueue=True,
     )
 
     return logger
 
 
-configure_logger()
+# 导入时不配置, 由应用启动时(lifespan)或脚本显式调用 configure_logger; 之前使用 loguru 默认的标准错误输出
 payment_logger = logger.bind(name="payment")
 agents_logger = logger.bind(name="agents")
 chat_logger = logger.bind(name="chat")
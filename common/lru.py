@@ -0,0 +1,90 @@
+"""
+进程内 LRU 缓存
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Iterator, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[V]):
+    """有容量上限的 LRU 缓存, 每个条目可以有独立的过期时间
+
+    仅供单个事件循环使用, 不做线程同步.
+
+    Args:
+        maxsize: 最大条目数, 超出时淘汰最久未使用的条目
+        ttl: 默认存活时间(秒), None 表示不过期
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[V, Optional[float]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[V]:
+        """
+        获取条目, 命中时将其移到队尾
+
+        Args:
+            key: 键
+            default: 未命中或已过期时的返回值
+
+        Returns:
+            缓存的值
+        """
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, deadline = entry
+        if deadline is not None and deadline <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        """
+        写入条目
+
+        Args:
+            key: 键
+            value: 值
+            ttl: 存活时间(秒), 默认使用构造时的 ttl; 小于等于 0 时不写入
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            self._data.pop(key, None)
+            return
+        deadline = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, deadline)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Optional[V]:
+        """移除条目并返回其值"""
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._data.clear()
+
+    def keys(self) -> Iterator[Hashable]:
+        """返回当前所有键(包含尚未清理的过期条目)"""
+        return iter(list(self._data.keys()))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,412 @@
+"""
+运行指标
+"""
+import asyncio
+import bisect
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .configs import settings
+
+# 已退出 worker 的快照合并后的文件
+_RETIRED = "retired.json"
+
+# 默认的延迟分桶上界(秒)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class LatencyStats:
+    """延迟统计: 计数、总和、最大值和分桶计数
+
+    只在单个 worker 内累加, 记录一次观测是 O(log n) 的二分查找加几次整数运算.
+
+    Args:
+        buckets: 分桶上界(秒), 必须升序
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 最后一个桶对应 +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """记录一次观测"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> Dict:
+        """返回当前统计的快照"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "buckets": dict(zip([*self.buckets, float("inf")], self.counts)),
+        }
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+class MetricsRegistry:
+    """单个 worker 内的指标注册表
+
+    热路径上只做元组键的字典累加; 标签渲染和落盘在 ``snapshot`` 中完成.
+    每个 worker 定期把快照写入共享目录下以 pid 命名的文件, 任一 worker
+    响应 /metrics 时读取目录中的全部文件并合并.
+
+    计数器和直方图会合并所有文件(包括已退出的 worker), 仪表只合并存活的 worker.
+    启动器在启动 worker 前清空目录(``reset``), 回收 worker 后把其快照并入
+    ``retired.json``(``compact``), 文件数不随重启次数增长.
+
+    Args:
+        directory: 多进程共享目录, None 表示只导出当前 worker
+        flush_interval: 落盘间隔(秒)
+    """
+
+    def __init__(self, directory: Optional[Path] = None, flush_interval: float = 5.0):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self.help: Dict[str, str] = {}
+        self.label_names: Dict[str, Tuple[str, ...]] = {}
+        self.counters: Dict[str, Dict[Tuple, float]] = {}
+        self.gauges: Dict[str, Dict[Tuple, float]] = {}
+        self.histograms: Dict[str, Dict[Tuple, LatencyStats]] = {}
+        self._collectors: List[Callable[["MetricsRegistry"], None]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Dict[Tuple, float]:
+        """声明计数器, 返回 标签值元组 -> 值 的字典"""
+        return self._declare(self.counters, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Dict[Tuple, float]:
+        """声明仪表, 返回 标签值元组 -> 值 的字典"""
+        return self._declare(self.gauges, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = ()) -> Dict[Tuple, LatencyStats]:
+        """声明直方图, 返回 标签值元组 -> LatencyStats 的字典"""
+        return self._declare(self.histograms, name, help, labels)
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]) -> None:
+        """注册采集函数, 在每次生成快照前调用, 用于拉取连接池等外部统计"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前 worker 的指标快照(可 JSON 序列化)"""
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception:
+                pass
+
+        def render(metrics, value):
+            return {
+                name: {_labels(self.label_names[name], key): value(v) for key, v in series.items()}
+                for name, series in metrics.items()
+            }
+
+        return {
+            "pid": os.getpid(),
+            "counters": render(self.counters, lambda v: v),
+            "gauges": render(self.gauges, lambda v: v),
+            "histograms": render(
+                self.histograms,
+                lambda s: {"counts": list(s.counts), "sum": s.sum, "buckets": list(s.buckets)},
+            ),
+        }
+
+    def flush(self) -> None:
+        """把快照原子地写入共享目录"""
+        self._write(self.snapshot())
+
+    def ensure_flusher(self) -> None:
+        """在当前事件循环中启动定期落盘任务"""
+        if self.directory is not None and (self._flusher is None or self._flusher.done()):
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """停止落盘任务并做最后一次落盘"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await asyncio.to_thread(self._write, self.snapshot())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # 快照在事件循环中生成(指标字典只在这里修改), 文件写入放到线程中
+                await asyncio.to_thread(self._write, self.snapshot())
+            except OSError:
+                pass
+
+    def _write(self, snapshot: Dict[str, Any]) -> None:
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{snapshot['pid']}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(snapshot, separators=(",", ":")))
+        os.replace(tmp, path)
+
+    def collect(self, local: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        读取所有 worker 的快照
+
+        Args:
+            local: 本 worker 的快照, 默认当场生成; 在线程中调用时应由事件循环提前生成
+
+        Returns:
+            快照列表, 本 worker 使用内存中的快照而不是落盘的文件
+        """
+        local = local if local is not None else self.snapshot()
+        if self.directory is None or not self.directory.exists():
+            return [local]
+        own = f"{local['pid']}.json"
+        snapshots = [local]
+        with self._locked(fcntl.LOCK_SH):
+            for path in self.directory.glob("*.json"):
+                if path.name == own:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def compact(self) -> int:
+        """
+        把已退出 worker 的快照合并到 ``retired.json`` 并删除原文件
+
+        计数器和直方图保留在合并文件中, 仪表丢弃. 由启动器在回收 worker 后调用,
+        目录中的文件数不随重启次数增长.
+
+        Returns:
+            合并的快照数
+        """
+        if self.directory is None or not self.directory.exists():
+            return 0
+        retired_path = self.directory / _RETIRED
+        with self._locked(fcntl.LOCK_EX):
+            dead = []
+            snapshots = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+                if path.name == _RETIRED:
+                    snapshots.append(snapshot)
+                elif not _pid_alive(snapshot.get("pid")):
+                    snapshots.append(snapshot)
+                    dead.append(path)
+            if not dead:
+                return 0
+            counters, _, histograms = _merge(snapshots)
+            tmp = retired_path.with_suffix(".tmp")
+            tmp.write_text(
+                json.dumps(
+                    {"pid": 0, "counters": counters, "gauges": {}, "histograms": histograms},
+                    separators=(",", ":"),
+                )
+            )
+            os.replace(tmp, retired_path)
+            for path in dead:
+                path.unlink(missing_ok=True)
+        return len(dead)
+
+    def reset(self) -> None:
+        """清空共享目录, 在启动 worker 之前调用"""
+        if self.directory is None or not self.directory.exists():
+            return
+        for path in [*self.directory.glob("*.json"), *self.directory.glob("*.tmp")]:
+            path.unlink(missing_ok=True)
+
+    def render_prometheus(self, local: Optional[Dict[str, Any]] = None) -> str:
+        """
+        合并所有 worker 的快照并输出 Prometheus 文本格式
+
+        Args:
+            local: 本 worker 的快照, 见 ``collect``
+        """
+        counters, gauges, histograms = _merge(self.collect(local))
+        lines: List[str] = []
+        for kind, metrics in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(metrics):
+                lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(metrics[name].items()):
+                    lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        for name in sorted(histograms):
+            lines.append(f"# HELP {name} {self.help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in sorted(histograms[name].items()):
+                prefix = f"{labels}," if labels else ""
+                cumulative = 0
+                for bound, count in zip([*h["buckets"], "+Inf"], h["counts"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {h['sum']}")
+                lines.append(f"{name}_count{suffix} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        """目录级文件锁: 读取时共享, 合并时独占, 读取不会看到合并到一半的目录"""
+        with open(self.directory / ".lock", "a") as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _declare(self, store: Dict, name: str, help: str, labels: Sequence[str]) -> Dict:
+        self.help[name] = help
+        self.label_names[name] = tuple(labels)
+        return store.setdefault(name, {})
+
+
+def _merge(snapshots: List[Dict[str, Any]]) -> Tuple[Dict, Dict, Dict]:
+    """合并快照: 计数器和直方图累加所有快照, 仪表只累加存活的 worker"""
+    counters: Dict[str, Dict[str, float]] = {}
+    gauges: Dict[str, Dict[str, float]] = {}
+    histograms: Dict[str, Dict[str, Dict]] = {}
+    for snap in snapshots:
+        alive = _pid_alive(snap.get("pid"))
+        for name, series in snap.get("counters", {}).items():
+            target = counters.setdefault(name, {})
+            for labels, value in series.items():
+                target[labels] = target.get(labels, 0) + value
+        if alive:
+            for name, series in snap.get("gauges", {}).items():
+                target = gauges.setdefault(name, {})
+                for labels, value in series.items():
+                    target[labels] = target.get(labels, 0) + value
+        for name, series in snap.get("histograms", {}).items():
+            target = histograms.setdefault(name, {})
+            for labels, h in series.items():
+                merged = target.get(labels)
+                if merged is None:
+                    target[labels] = {"counts": list(h["counts"]), "sum": h["sum"], "buckets": h["buckets"]}
+                else:
+                    merged["counts"] = [a + b for a, b in zip(merged["counts"], h["counts"])]
+                    merged["sum"] += h["sum"]
+    return counters, gauges, histograms
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _project_path(path: Optional[str]) -> Optional[Path]:
+    if not path:
+        return None
+    path = Path(path)
+    return path if path.is_absolute() else Path(__file__).parent.parent / path
+
+
+metrics_registry = MetricsRegistry(
+    directory=_project_path(settings.metrics_dir),
+    flush_interval=settings.metrics_flush_interval,
+)
+
+_request_latency = metrics_registry.histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时", ("method", "route")
+)
+_request_total = metrics_registry.counter(
+    "http_requests_total", "HTTP 请求数", ("method", "route", "status")
+)
+_in_flight = metrics_registry.gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+_exceptions = metrics_registry.counter(
+    "http_exceptions_total", "未处理异常数", ("type",)
+)
+_in_flight[()] = 0
+
+
+def record_exception(exc: BaseException) -> None:
+    """记录一次未处理异常"""
+    key = (type(exc).__name__,)
+    _exceptions[key] = _exceptions.get(key, 0) + 1
+
+
+class MetricsMiddleware:
+    """按路由记录请求耗时、状态码和并发数的 ASGI 中间件
+
+    路由使用匹配到的路径模板(如 ``/courses/{course_id}``), 未匹配的请求
+    归入 ``<unmatched>``, 避免标签基数失控.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics_registry.ensure_flusher()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        _in_flight[()] += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _in_flight[()] -= 1
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            method = scope["method"]
+            stats = _request_latency.get((method, path))
+            if stats is None:
+                stats = _request_latency[(method, path)] = LatencyStats()
+            stats.observe(elapsed)
+            key = (method, path, status_code)
+            _request_total[key] = _request_total.get(key, 0) + 1
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus 指标导出, 读取和合并各 worker 的快照在线程中进行"""
+    local = metrics_registry.snapshot()
+    return Response(
+        await asyncio.to_thread(metrics_registry.render_prometheus, local),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
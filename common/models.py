@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import List, TypeVar, Optional, Generic
+from typing import Dict, List, TypeVar, Optional, Generic
 
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -34,6 +34,22 @@ class DataPage(BaseModel, Generic[T]):
     has_more: bool = Field(description="是否有更多数据")
 
 
+class CursorPage(BaseModel, Generic[T]):
+    """游标分页
+
+    按排序键定位的分页, 不需要 OFFSET 和 COUNT(*). 游标对客户端不透明,
+    取下一页时传 next_cursor, 取上一页时传 prev_cursor.
+    """
+
+    items: List[T] = Field(default_factory=list, description="数据项列表")
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标")
+    prev_cursor: Optional[str] = Field(default=None, description="上一页游标")
+    has_more: bool = Field(description="当前方向上是否有更多数据")
+    total: Optional[int] = Field(
+        default=None, description="总记录数估算值(来自查询计划统计), 未统计时为空"
+    )
+
+
 class ResponsePayloads(BaseModel, Generic[T]):
     """响应载荷"""
 
@@ -45,9 +61,42 @@ class ResponsePayloads(BaseModel, Generic[T]):
 
 class Settings(BaseSettings):
     database_url: str = Field(default=None, description="数据库URL")
+    db_max_connections: int = Field(
+        default=100, description="所有 worker 共享的数据库连接预算"
+    )
+    db_pool_size: Optional[int] = Field(
+        default=None, description="每个 worker 的常驻连接数, 默认按 worker 数分配"
+    )
+    db_max_overflow: Optional[int] = Field(
+        default=None, description="每个 worker 的溢出连接数, 默认按 worker 数分配"
+    )
+    db_pool_timeout: float = Field(default=10.0, description="等待可用数据库连接的超时(秒)")
+    db_pool_recycle: int = Field(default=1800, description="数据库连接最长复用时间(秒)")
+    db_pool_pre_ping: bool = Field(default=True, description="检出连接前是否探活")
+    db_statement_cache_size: int = Field(
+        default=100, description="预编译语句缓存大小, 经过 pgbouncer 时设为 0"
+    )
+    db_application_name: str = Field(
+        default="py-api-template", description="数据库连接的 application_name"
+    )
+    db_echo: bool = Field(default=False, description="是否打印 SQL")
+    database_replica_urls: List[str] = Field(
+        default_factory=list, description="只读副本URL列表, 为空时读写都走主库"
+    )
+    db_replica_max_lag: float = Field(
+        default=5.0, description="副本复制延迟超过该值(秒)时不再接收读请求"
+    )
+    db_replica_lag_interval: float = Field(default=2.0, description="测量副本复制延迟的间隔(秒)")
+    db_replica_probe_timeout: float = Field(default=1.0, description="单次测量副本复制延迟的超时(秒)")
+    web_concurrency: int = Field(default=5, description="uvicorn worker 进程数")
     mode: str = Field(default="dev", description="运行模式")
     jwt_secret_key: str = Field(default=None, description="JWT密钥")
     jwt_algorithm: str = Field(default=None, description="JWT算法")
+    jwt_cache_size: int = Field(default=10000, description="已校验令牌缓存的最大条目数")
+    jwt_cache_ttl: float = Field(default=300.0, description="已校验令牌缓存的存活时间(秒)")
+    jwt_revocation_sync_interval: float = Field(
+        default=1.0, description="令牌吊销列表同步间隔(秒)"
+    )
     alipay_appid: str = Field(default="9021000133696987", description="支付宝应用ID")
     alipay_private_key_path: str = Field(
         default=".secrets/app_private_key.sandbox.pem", description="支付宝私钥路径"
@@ -82,6 +131,16 @@ class Settings(BaseSettings):
 
     sms_sign_name: str = Field(default=None, description="短信签名")
     sms_template_code: str = Field(default=None, description="短信模板代码")
+    sms_transport: str = Field(default="aliyun", description="短信通道: aliyun 或 fake(本地模拟, 不发送)")
+    sms_workers: int = Field(default=4, description="每个 worker 的短信发送任务数")
+    sms_queue_size: int = Field(default=1000, description="短信发送队列容量")
+    sms_max_retries: int = Field(default=3, description="短信发送最大重试次数")
+    sms_retry_backoff: float = Field(default=1.0, description="短信首次重试前的等待时间(秒), 之后每次翻倍")
+    sms_timeout: float = Field(default=5.0, description="单次短信发送超时(秒)")
+    sms_code_length: int = Field(default=6, description="验证码位数")
+    sms_code_ttl: int = Field(default=300, description="验证码有效期(秒)")
+    sms_code_max_attempts: int = Field(default=5, description="每个验证码最多校验次数")
+    sms_resend_interval: int = Field(default=60, description="同一手机号发送验证码的最小间隔(秒)")
 
     # 阿里云访问密钥配置
     aliyun_access_key_id: str = Field(default=None, description="阿里云访问密钥ID")
@@ -92,5 +151,117 @@ class Settings(BaseSettings):
     redis_port: int = Field(default=None, description="Redis Port")
     redis_password: str = Field(default=None, description="Redis Password")
     redis_db: int = Field(default=None, description="Redis DB")
+    redis_max_connections: int = Field(
+        default=50, description="每个 worker 的异步 Redis 连接池大小"
+    )
+    redis_pool_timeout: float = Field(
+        default=5.0, description="等待可用 Redis 连接的超时(秒)"
+    )
+    redis_socket_timeout: float = Field(default=5.0, description="Redis 读写超时(秒)")
+    redis_socket_connect_timeout: float = Field(
+        default=2.0, description="Redis 建立连接超时(秒)"
+    )
+    redis_health_check_interval: int = Field(
+        default=30, description="Redis 空闲连接健康检查间隔(秒)"
+    )
+    cache_local_maxsize: int = Field(default=1024, description="本地响应缓存最大条目数")
+    cache_local_ttl: float = Field(default=5.0, description="本地响应缓存最长存活时间(秒)")
+    entitlement_ttl: float = Field(default=3600.0, description="Redis 中用户权益集合的存活时间(秒)")
+    entitlement_local_maxsize: int = Field(default=10000, description="本地用户权益缓存最大条目数")
+    entitlement_local_ttl: float = Field(default=5.0, description="本地用户权益缓存最长存活时间(秒)")
+    course_tree_ttl: float = Field(default=3600.0, description="课程目录缓存存活时间(秒)")
+    course_tree_version_ttl: float = Field(default=5.0, description="课程目录版本号在本地的缓存时间(秒)")
+    tag_index_refresh_interval: float = Field(default=5.0, description="标签倒排索引检查数据库变化的间隔(秒)")
+    search_index_refresh_interval: float = Field(default=5.0, description="搜索索引检查数据库变化的间隔(秒)")
+    index_watermark_overlap: float = Field(
+        default=30.0, description="进程内索引增量刷新时水位回看的时间(秒), 应覆盖最长的写事务"
+    )
+    payment_notify_batch_size: int = Field(default=100, description="每个事务处理的最大支付通知数")
+    payment_notify_flush_interval: float = Field(default=0.5, description="支付通知队列空闲检查间隔(秒)")
+    payment_notify_visibility_timeout: float = Field(
+        default=60.0, description="支付通知取出后未确认的重新投递时间(秒)"
+    )
+    payment_notify_dedupe_ttl: int = Field(
+        default=3 * 86400, description="支付通知去重键存活时间(秒), 需覆盖网关重试周期"
+    )
+    payment_notify_max_attempts: int = Field(
+        default=5, description="单条支付通知入库失败多少次后移入死信队列"
+    )
+    expiry_sweep_interval: float = Field(default=60.0, description="到期扫描数据库的间隔(秒)")
+    expiry_batch_size: int = Field(default=500, description="到期扫描每次查询的最大行数")
+    expiry_tick: float = Field(default=1.0, description="到期时间轮的精度(秒)")
+    expiry_leader_ttl: float = Field(default=30.0, description="到期调度 leader 锁的存活时间(秒)")
+    dify_base_url: Optional[str] = Field(default=None, description="Dify 地址, 为空时不从控制台刷新 API 密钥")
+    dify_console_email: Optional[str] = Field(default=None, description="Dify 控制台账号")
+    dify_console_password: Optional[str] = Field(default=None, description="Dify 控制台密码")
+    dify_key_ttl: float = Field(default=3600.0, description="Dify API 密钥获取后视为有效的时间(秒)")
+    dify_key_refresh_ahead: float = Field(default=300.0, description="Dify API 密钥提前刷新的时间(秒)")
+    dify_key_sync_interval: float = Field(default=300.0, description="从数据库同步 Dify 应用列表的间隔(秒)")
+    dify_key_retry_interval: float = Field(default=30.0, description="Dify API 密钥获取失败后重试的间隔(秒)")
+    dify_proxy_max_connections: int = Field(default=100, description="每个 worker 到 Dify 的最大连接数")
+    dify_proxy_max_keepalive: int = Field(default=20, description="每个 worker 保留的 Dify 空闲连接数")
+    dify_proxy_keepalive_expiry: float = Field(default=30.0, description="Dify 空闲连接保留时间(秒)")
+    dify_proxy_connect_timeout: float = Field(default=5.0, description="连接 Dify 的超时(秒)")
+    dify_proxy_read_timeout: float = Field(default=120.0, description="等待 Dify 下一块数据的超时(秒)")
+    dify_proxy_pool_timeout: float = Field(default=5.0, description="等待空闲 Dify 连接的超时(秒)")
+    rate_limit_enabled: bool = Field(default=True, description="是否启用限流")
+    rate_limit_trusted_proxies: List[str] = Field(
+        default_factory=list, description="可信反向代理地址, 只有来自这些地址的 X-Forwarded-For 会被采信"
+    )
+    rate_limit_lease: int = Field(default=4, description="令牌充足时单次从 Redis 预支到本地的最大令牌数")
+    rate_limit_login_per_minute: float = Field(default=10.0, description="每个 IP 每分钟的登录次数")
+    rate_limit_login_burst: int = Field(default=5, description="每个 IP 允许的突发登录次数")
+    rate_limit_sms_ip_per_hour: float = Field(default=20.0, description="每个 IP 每小时的短信条数")
+    rate_limit_sms_ip_burst: int = Field(default=5, description="每个 IP 允许的突发短信条数")
+    rate_limit_sms_phone_per_hour: float = Field(default=5.0, description="每个手机号每小时的短信条数")
+    rate_limit_sms_phone_burst: int = Field(default=2, description="每个手机号允许的突发短信条数")
+    server_host: str = Field(default="0.0.0.0", description="监听地址")
+    server_port: int = Field(default=8000, description="监听端口")
+    server_workers: Optional[int] = Field(
+        default=None, description="worker 数, 为空时按 CPU 配额计算"
+    )
+    server_workers_per_cpu: float = Field(default=1.0, description="按 CPU 配额计算 worker 数时每个 CPU 的 worker 数")
+    server_loop: str = Field(default="auto", description="事件循环: auto、uvloop 或 asyncio")
+    server_http: str = Field(default="auto", description="HTTP 解析器: auto、httptools 或 h11")
+    server_backlog: int = Field(default=2048, description="监听队列长度")
+    server_keepalive_timeout: int = Field(default=5, description="空闲长连接保持时间(秒), 位于负载均衡之后时应大于其空闲超时")
+    server_limit_concurrency: Optional[int] = Field(
+        default=None, description="每个 worker 的最大并发连接数, 超出时返回 503; 为空时不限制"
+    )
+    server_graceful_timeout: int = Field(default=30, description="worker 平滑退出的最长等待时间(秒)")
+    server_ready_timeout: float = Field(default=60.0, description="滚动重启时等待新 worker 启动完成的时间(秒)")
+    server_preload: bool = Field(default=True, description="是否在 fork worker 之前导入应用")
+    server_access_log: bool = Field(default=False, description="是否输出 uvicorn 访问日志")
+    warmup_enabled: bool = Field(default=True, description="worker 启动时是否预热")
+    warmup_timeout: float = Field(default=10.0, description="每个预热步骤的超时(秒)")
+    warmup_paths: List[str] = Field(
+        default_factory=lambda: ["/courses/tree", "/catalog/tags"],
+        description="预热时在进程内请求的路径",
+    )
+    metrics_dir: Optional[str] = Field(
+        default=".metrics", description="多进程指标共享目录, 为空时只导出当前 worker"
+    )
+    metrics_flush_interval: float = Field(default=5.0, description="指标落盘间隔(秒)")
+    log_format: str = Field(default="text", description="日志格式: text 或 json")
+    log_buffer_size: int = Field(default=64 * 1024, description="日志文件缓冲区大小(字节)")
+    log_flush_interval: float = Field(default=1.0, description="日志刷盘间隔(秒)")
+    log_retention_days: int = Field(default=30, description="日志保留天数")
+    log_sample_rates: Dict[str, float] = Field(
+        default_factory=dict, description='日志通道采样率, 例如 {"chat": 0.1}'
+    )
+    log_rate_limits: Dict[str, float] = Field(
+        default_factory=dict, description='日志通道每秒最多记录数, 例如 {"chat": 200}'
+    )
     allow_registration: bool = Field(default=True, description="是否允许注册")
+    bcrypt_strength: int = Field(default=10, description="BCrypt 加密强度")
+    bcrypt_executor: str = Field(
+        default="process", description="BCrypt 执行器类型: process 或 thread"
+    )
+    bcrypt_max_workers: Optional[int] = Field(
+        default=None, description="BCrypt 执行器最大工作者数, 默认为 CPU 配额除以 worker 数"
+    )
+    bcrypt_max_pending: int = Field(
+        default=64, description="BCrypt 允许排队的最大任务数"
+    )
+    bcrypt_timeout: float = Field(default=5.0, description="BCrypt 单次运算超时(秒)")
     model_config = SettingsConfigDict(env_file=Path(__file__).parent.parent / ".env")
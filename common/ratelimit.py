@@ -0,0 +1,284 @@
+"""
+基于 Redis 令牌桶的限流
+"""
+import inspect
+import math
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+import redis
+from fastapi import Depends, HTTPException, Request
+from starlette import status
+
+from .configs import settings
+from .jwt import get_current_claims
+from .log import logger
+from .lru import LRUCache
+from .redis import async_redis_client
+
+# 令牌桶: 哈希字段 t 为剩余令牌, ts 为上次更新时间(毫秒).
+# 桶中令牌多于一半时, 除本次所需外最多再预支 lease-cost 个给调用方在本地使用,
+# 预支的令牌已经从桶中扣除, 因此本地使用不会超出全局限额.
+# 返回 {授予的令牌数(0 表示拒绝), 剩余令牌, 需要等待的毫秒数}
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local lease = tonumber(ARGV[4])
+-- 使用 Redis 的时钟, 不受各 worker 时钟偏差影响
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = 0
+local wait = 0
+if tokens >= cost then
+    granted = cost + math.max(0, math.min(lease - cost, math.floor(tokens - cost - capacity / 2)))
+    tokens = tokens - granted
+else
+    wait = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return {granted, tostring(tokens), wait}
+"""
+
+
+class RateLimitExceeded(Exception):
+    """超出限流"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Redis 令牌桶限流器
+
+    每个键一个桶, 容量为 ``burst``, 每秒补充 ``rate`` 个令牌, 所有 worker 共享.
+    检查与扣减在一个 Lua 脚本中原子完成.
+
+    本地预检查: 桶中令牌充足时, Redis 一次最多授予 ``lease`` 个令牌, 多出的部分在本 worker
+    内使用 ``lease_ttl`` 秒, 期间同一个键的请求不访问 Redis; 被拒绝的键在需要等待的时间内
+    直接在本地拒绝. 预支的令牌已从全局桶中扣除, 所以只可能少放行, 不会多放行.
+    Redis 不可用时退化为本 worker 内的令牌桶.
+
+    Args:
+        client: 异步 Redis 客户端
+        name: 限流器名称, 用于 Redis 键
+        rate: 每秒补充的令牌数
+        burst: 桶容量
+        lease: 单次最多从 Redis 预支的令牌数, 1 表示不预支
+        lease_ttl: 预支令牌在本地的有效期(秒)
+        maxsize: 本地状态最多保存的键数
+        prefix: Redis 键前缀
+    """
+
+    def __init__(
+        self,
+        client,
+        name: str,
+        rate: float,
+        burst: int,
+        lease: int = 1,
+        lease_ttl: float = 1.0,
+        maxsize: int = 10000,
+        prefix: str = "ratelimit",
+    ):
+        self.client = client
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.lease = max(1, lease)
+        self.lease_ttl = lease_ttl
+        self.prefix = prefix
+        self._script = client.register_script(_TOKEN_BUCKET_SCRIPT)
+        # 键 -> (预支的剩余令牌, 到期时间) 或 (0, 拒绝截止时间)
+        self._local: LRUCache[Tuple[int, float]] = LRUCache(maxsize=maxsize)
+        # Redis 不可用时使用的本地令牌桶: 键 -> (令牌, 更新时间)
+        self._fallback: LRUCache[Tuple[float, float]] = LRUCache(maxsize=maxsize)
+
+    async def hit(self, key: str, cost: int = 1) -> float:
+        """
+        消耗令牌
+
+        Args:
+            key: 限流键, 例如 IP 或手机号
+            cost: 消耗的令牌数
+
+        Returns:
+            0 表示放行, 否则为需要等待的秒数
+        """
+        now = time.monotonic()
+        local = self._local.get(key)
+        if local is not None:
+            tokens, until = local
+            if tokens == 0 and until > now:
+                return until - now
+            if tokens >= cost and until > now:
+                if tokens > cost:
+                    self._local.set(key, (tokens - cost, until))
+                else:
+                    # 用完后删除, 剩余 0 个令牌的条目表示拒绝
+                    self._local.pop(key)
+                return 0.0
+            self._local.pop(key)
+
+        try:
+            granted, _, wait_ms = await self._script(
+                keys=[f"{self.prefix}:{self.name}:{key}"],
+                args=[self.rate, self.burst, cost, max(self.lease, cost)],
+            )
+        except redis.RedisError as e:
+            logger.warning(f"限流器 {self.name} 访问 Redis 失败, 使用本地令牌桶: {e}")
+            return self._hit_fallback(key, cost, now)
+
+        if granted:
+            if granted > cost:
+                self._local.set(key, (granted - cost, now + self.lease_ttl))
+            return 0.0
+        retry_after = wait_ms / 1000
+        self._local.set(key, (0, now + retry_after))
+        return retry_after
+
+    async def check(self, key: str, cost: int = 1) -> None:
+        """
+        消耗令牌, 超出限流时抛出 ``RateLimitExceeded``
+
+        Args:
+            key: 限流键
+            cost: 消耗的令牌数
+        """
+        retry_after = await self.hit(key, cost)
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
+
+    def _hit_fallback(self, key: str, cost: int, now: float) -> float:
+        tokens, updated = self._fallback.get(key, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= cost:
+            self._fallback.set(key, (tokens - cost, now))
+            return 0.0
+        self._fallback.set(key, (tokens, now))
+        return (cost - tokens) / self.rate
+
+
+def client_ip(request: Request) -> str:
+    """
+    客户端 IP
+
+    配置了 ``rate_limit_trusted_proxies`` 时取 ``X-Forwarded-For`` 中最后一个不属于
+    可信代理的地址, 否则取连接的对端地址.
+    """
+    host = request.client.host if request.client else "unknown"
+    trusted = settings.rate_limit_trusted_proxies
+    if not trusted or host not in trusted:
+        return host
+    forwarded = request.headers.get("x-forwarded-for", "")
+    for address in reversed([a.strip() for a in forwarded.split(",") if a.strip()]):
+        if address not in trusted:
+            return address
+    return host
+
+
+async def phone_number(request: Request) -> Optional[str]:
+    """
+    请求中的手机号: 依次查找路径参数、查询参数和 JSON 请求体的 ``phone`` 字段
+
+    请求体会被 Starlette 缓存, 处理器仍然可以正常读取.
+    """
+    phone = request.path_params.get("phone") or request.query_params.get("phone")
+    if phone is None and request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        if isinstance(body, dict) and body.get("phone") is not None:
+            phone = str(body["phone"])
+    return phone
+
+
+KeyFunc = Callable[[Request], Union[Optional[str], Awaitable[Optional[str]]]]
+
+_KEY_FUNCS: Dict[str, KeyFunc] = {"ip": client_ip, "phone": phone_number}
+
+
+def rate_limit(limiter: RateLimiter, key: Union[str, KeyFunc] = "ip", cost: int = 1):
+    """
+    FastAPI 依赖工厂: 按键限流, 超出时返回 429 和 ``Retry-After`` 响应头
+
+    Args:
+        limiter: 限流器
+        key: ``"ip"``、``"phone"``、``"user"``(令牌中的用户ID)或接收 Request 的函数;
+            取不到键时不限流
+        cost: 每个请求消耗的令牌数
+
+    Returns:
+        依赖函数, 与 ``dependencies=[Depends(...)]`` 一起使用
+    """
+
+    async def enforce(value: Optional[str]) -> None:
+        if value is None or not settings.rate_limit_enabled:
+            return
+        retry_after = await limiter.hit(value, cost)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    if key == "user":
+
+        async def dependency(claims: dict = Depends(get_current_claims)) -> None:
+            await enforce(str(claims["sub"]))
+
+        return dependency
+
+    key_func = _KEY_FUNCS[key] if isinstance(key, str) else key
+
+    async def dependency(request: Request) -> None:
+        value = key_func(request)
+        if inspect.isawaitable(value):
+            value = await value
+        await enforce(value)
+
+    return dependency
+
+
+# 登录: 密码校验是刻意昂贵的 CPU 运算
+login_limiter = RateLimiter(
+    async_redis_client,
+    "login",
+    rate=settings.rate_limit_login_per_minute / 60,
+    burst=settings.rate_limit_login_burst,
+    lease=settings.rate_limit_lease,
+)
+# 短信: 每条都要付费
+sms_ip_limiter = RateLimiter(
+    async_redis_client,
+    "sms:ip",
+    rate=settings.rate_limit_sms_ip_per_hour / 3600,
+    burst=settings.rate_limit_sms_ip_burst,
+    lease=settings.rate_limit_lease,
+)
+sms_phone_limiter = RateLimiter(
+    async_redis_client,
+    "sms:phone",
+    rate=settings.rate_limit_sms_phone_per_hour / 3600,
+    burst=settings.rate_limit_sms_phone_burst,
+    lease=settings.rate_limit_lease,
+)
+
+# 供路由使用, 例如 @router.post("/login", dependencies=login_rate_limits)
+login_rate_limits = [Depends(rate_limit(login_limiter, "ip"))]
+sms_rate_limits = [
+    Depends(rate_limit(sms_ip_limiter, "ip")),
+    Depends(rate_limit(sms_phone_limiter, "phone")),
+]
@@ -1,9 +1,141 @@
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
 import redis
+import redis.asyncio as aioredis
+
 from .configs import settings
+from .metrics import LatencyStats, metrics_registry
+
+# 同步客户端, 供脚本和非异步代码使用; 异步处理器中请使用 async_redis_client
 redis_client = redis.Redis(
             host=settings.redis_host,
             port=settings.redis_port,
             db=settings.redis_db,
             password=settings.redis_password,
             decode_responses=True
-        )
\ No newline at end of file
+        )
+
+
+class InstrumentedConnectionPool(aioredis.BlockingConnectionPool):
+    """记录连接获取等待时间的阻塞连接池
+
+    连接用尽时请求会排队等待而不是直接报错, 等待时间(含新建连接)记录在 ``wait_stats`` 中.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = LatencyStats()
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        finally:
+            self.wait_stats.observe(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池使用情况"""
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "available": len(self._available_connections),
+            "wait": self.wait_stats.snapshot(),
+        }
+
+
+async_redis_pool = InstrumentedConnectionPool(
+    host=settings.redis_host,
+    port=settings.redis_port,
+    db=settings.redis_db,
+    password=settings.redis_password,
+    decode_responses=True,
+    max_connections=settings.redis_max_connections,
+    timeout=settings.redis_pool_timeout,
+    socket_timeout=settings.redis_socket_timeout,
+    socket_connect_timeout=settings.redis_socket_connect_timeout,
+    socket_keepalive=True,
+    health_check_interval=settings.redis_health_check_interval,
+)
+
+# 异步客户端, 与连接池一起在每个 worker 进程内创建, 连接按需建立
+async_redis_client = aioredis.Redis(connection_pool=async_redis_pool)
+
+metrics_registry.histogram("redis_pool_wait_seconds", "Redis 连接获取等待时间")[()] = (
+    async_redis_pool.wait_stats
+)
+_redis_pool_in_use = metrics_registry.gauge("redis_pool_in_use", "已检出的 Redis 连接数")
+
+
+def _collect_pool_metrics(registry) -> None:
+    _redis_pool_in_use[()] = len(async_redis_pool._in_use_connections)
+
+
+metrics_registry.add_collector(_collect_pool_metrics)
+
+
+async def ping_redis(client: Optional[aioredis.Redis] = None) -> bool:
+    """
+    检查 Redis 是否可用
+
+    Args:
+        client: 异步客户端, 默认使用 async_redis_client
+
+    Returns:
+        是否可用
+    """
+    client = client or async_redis_client
+    try:
+        return bool(await client.ping())
+    except (redis.RedisError, OSError):
+        return False
+
+
+async def redis_mget(keys: Iterable[str], client: Optional[aioredis.Redis] = None) -> List[Optional[str]]:
+    """
+    批量读取, 一次往返
+
+    Args:
+        keys: 键列表
+        client: 异步客户端, 默认使用 async_redis_client
+
+    Returns:
+        与 keys 顺序一致的值列表, 不存在的键为 None
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    client = client or async_redis_client
+    return await client.mget(keys)
+
+
+async def redis_mset(
+    mapping: Mapping[str, Any],
+    ttl: Optional[float] = None,
+    client: Optional[aioredis.Redis] = None,
+) -> None:
+    """
+    批量写入并设置过期时间, 通过非事务管道在一次往返中完成
+
+    Args:
+        mapping: 键值映射
+        ttl: 过期时间(秒), None 表示不过期
+        client: 异步客户端, 默认使用 async_redis_client
+    """
+    if not mapping:
+        return
+    client = client or async_redis_client
+    if ttl is None:
+        await client.mset(mapping)
+        return
+    async with client.pipeline(transaction=False) as pipe:
+        px = max(1, int(ttl * 1000))
+        for key, value in mapping.items():
+            pipe.set(key, value, px=px)
+        await pipe.execute()
+
+
+async def close_async_redis() -> None:
+    """关闭异步客户端和连接池"""
+    await async_redis_client.aclose()
+    await async_redis_pool.disconnect()
@@ -0,0 +1,83 @@
+"""
+JSON 响应
+"""
+from functools import lru_cache
+from typing import Any, Mapping, Optional
+
+import pydantic_core
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from .models import Error, ResponsePayloads
+
+
+def render_json(content: Any) -> bytes:
+    """
+    将内容直接序列化为 JSON 字节, 不经过中间字典和标准库 json
+
+    Args:
+        content: pydantic 模型、已编码的字节或可 JSON 编码的对象
+
+    Returns:
+        UTF-8 编码的 JSON
+    """
+    if isinstance(content, bytes):
+        return content
+    if isinstance(content, BaseModel):
+        return content.__pydantic_serializer__.to_json(content)
+    return pydantic_core.to_json(content)
+
+
+class PayloadResponse(JSONResponse):
+    """直接序列化 pydantic 模型的 JSON 响应
+
+    作为应用的默认响应类使用. 内容可以是 pydantic 模型(如 ``ResponsePayloads``)、
+    预先编码好的字节或普通的可 JSON 编码对象.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return render_json(content)
+
+
+@lru_cache(maxsize=512)
+def error_body(type: Optional[str], message: Optional[str], code: Optional[int]) -> bytes:
+    """
+    错误响应体, 相同的错误只编码一次
+
+    Args:
+        type: 错误类型
+        message: 错误信息
+        code: 错误码
+
+    Returns:
+        ``ResponsePayloads`` 格式的 JSON 字节
+    """
+    payload = ResponsePayloads(error=Error(type=type, message=message, code=code))
+    return render_json(payload)
+
+
+def error_response(
+    status_code: int,
+    type: Optional[str],
+    message: Any,
+    headers: Optional[Mapping[str, str]] = None,
+) -> PayloadResponse:
+    """
+    构造错误响应, 响应体来自 error_body 的缓存
+
+    Args:
+        status_code: HTTP 状态码, 同时作为错误码
+        type: 错误类型
+        message: 错误信息
+        headers: 额外的响应头
+
+    Returns:
+        JSON 响应
+    """
+    if message is not None and not isinstance(message, str):
+        message = str(message)
+    return PayloadResponse(
+        content=error_body(type, message, status_code),
+        status_code=status_code,
+        headers=headers,
+    )
@@ -1,7 +1,12 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from starlette import status
 
+from .cache import cached
 from .configs import settings
 from .models import ResponsePayloads
+from .ratelimit import sms_rate_limits
+from .sms import SmsCooldownError, SmsQueueFullError, SmsUnavailableError, sms_service
 
 router = APIRouter(tags=["系统设置"])
 
@@ -11,8 +16,45 @@ router = APIRouter(tags=["系统设置"])
     summary="获取站点设置",
     response_model=ResponsePayloads[dict],
 )
+@cached(ttl=60, tags=["settings"])
 async def get_site_settings():
     """获取当前站点配置"""
     return ResponsePayloads(data={
         "allow_registration": settings.allow_registration
     })
+
+
+class SmsCodeRequest(BaseModel):
+    """发送验证码请求"""
+
+    phone: str = Field(pattern=r"^1\d{10}$", description="手机号")
+
+
+class SmsCodeSent(BaseModel):
+    """验证码已进入发送队列"""
+
+    expires_in: int = Field(description="验证码有效期(秒)")
+    resend_after: int = Field(description="再次发送前需要等待的时间(秒)")
+
+
+@router.post(
+    "/sms/code",
+    summary="发送短信验证码",
+    response_model=ResponsePayloads[SmsCodeSent],
+    dependencies=sms_rate_limits,
+)
+async def send_sms_code(body: SmsCodeRequest):
+    """生成验证码并放入发送队列, 不等待短信网关返回"""
+    try:
+        await sms_service.send_code(body.phone)
+    except SmsCooldownError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except (SmsQueueFullError, SmsUnavailableError) as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return ResponsePayloads(
+        data=SmsCodeSent(expires_in=sms_service.code_ttl, resend_after=sms_service.resend_interval)
+    )
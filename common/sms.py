@@ -0,0 +1,434 @@
+"""
+短信发送与验证码
+"""
+import asyncio
+import json
+import random
+import secrets
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from .configs import settings
+from .log import logger
+from .redis import async_redis_client
+
+
+class SmsSendError(Exception):
+    """短信发送失败
+
+    Args:
+        message: 错误信息
+        retryable: 是否可以重试(网络错误、服务端繁忙等)
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class SmsQueueFullError(Exception):
+    """发送队列已满"""
+
+
+class SmsUnavailableError(Exception):
+    """短信通道不可用(例如缺少 SDK), 短信不会进入发送队列"""
+
+
+class SmsCooldownError(Exception):
+    """同一手机号发送过于频繁"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"SMS code already sent, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SmsMessage(BaseModel):
+    """待发送的短信"""
+
+    phone: str = Field(description="手机号")
+    template_code: Optional[str] = Field(default=None, description="模板代码")
+    params: Dict[str, Any] = Field(default_factory=dict, description="模板参数")
+    attempts: int = Field(default=0, description="已尝试次数")
+
+
+class SmsTransport:
+    """短信通道
+
+    子类实现 ``send``, 成功时返回通道的回执ID, 失败时抛出 ``SmsSendError``.
+    通道依赖的 SDK 或配置缺失时, ``check`` 抛出 ``SmsUnavailableError``.
+    """
+
+    async def send(self, message: SmsMessage) -> Optional[str]:
+        raise NotImplementedError
+
+    def check(self) -> None:
+        """确认通道可用, 在短信入队前调用"""
+
+    async def close(self) -> None:
+        """释放通道资源"""
+
+
+class AliyunSmsTransport(SmsTransport):
+    """阿里云短信通道
+
+    使用 SDK 的异步接口, 客户端在首次使用时创建(需要安装 ``alibabacloud_dysmsapi20170525``).
+    SDK 未安装时 ``check`` 抛出 ``SmsUnavailableError``, 验证码在入队前就会失败,
+    而不是在后台发送时才发现.
+
+    Args:
+        access_key_id: 访问密钥ID
+        access_key_secret: 访问密钥
+        sign_name: 短信签名
+        endpoint: 服务地址
+    """
+
+    # 这些错误重试也不会成功
+    NON_RETRYABLE = {
+        "isv.MOBILE_NUMBER_ILLEGAL",
+        "isv.TEMPLATE_MISSING_PARAMETERS",
+        "isv.INVALID_PARAMETERS",
+        "isv.SMS_TEMPLATE_ILLEGAL",
+        "isv.SMS_SIGNATURE_ILLEGAL",
+        "isv.BUSINESS_LIMIT_CONTROL",
+        "isv.AMOUNT_NOT_ENOUGH",
+        "isv.BLACK_KEY_CONTROL_LIMIT",
+    }
+
+    def __init__(
+        self,
+        access_key_id: str,
+        access_key_secret: str,
+        sign_name: str,
+        endpoint: str = "dysmsapi.aliyuncs.com",
+    ):
+        self.access_key_id = access_key_id
+        self.access_key_secret = access_key_secret
+        self.sign_name = sign_name
+        self.endpoint = endpoint
+        self._client = None
+
+    def check(self) -> None:
+        self._get_client()
+
+    def _get_client(self):
+        if self._client is None:
+            try:
+                from alibabacloud_dysmsapi20170525.client import Client
+                from alibabacloud_tea_openapi.models import Config
+            except ImportError as e:
+                raise SmsUnavailableError(f"Aliyun SMS SDK is not installed: {e}") from e
+
+            self._client = Client(
+                Config(
+                    access_key_id=self.access_key_id,
+                    access_key_secret=self.access_key_secret,
+                    endpoint=self.endpoint,
+                )
+            )
+        return self._client
+
+    async def send(self, message: SmsMessage) -> Optional[str]:
+        client = self._get_client()
+        from alibabacloud_dysmsapi20170525.models import SendSmsRequest
+        from alibabacloud_tea_util.models import RuntimeOptions
+
+        request = SendSmsRequest(
+            phone_numbers=message.phone,
+            sign_name=self.sign_name,
+            template_code=message.template_code,
+            # 模板参数必须是 JSON, str(dict) 生成的单引号格式会被拒绝
+            template_param=json.dumps(message.params, ensure_ascii=False) if message.params else None,
+        )
+        try:
+            response = await client.send_sms_with_options_async(request, RuntimeOptions())
+        except Exception as e:
+            raise SmsSendError(f"{type(e).__name__}: {e}") from e
+        body = response.body
+        if body.code != "OK":
+            raise SmsSendError(f"{body.code}: {body.message}", retryable=body.code not in self.NON_RETRYABLE)
+        return body.biz_id
+
+
+class FakeSmsTransport(SmsTransport):
+    """本地模拟通道, 不访问网络, 用于开发和压测
+
+    Args:
+        latency: 模拟的发送耗时(秒)
+        failure_rate: 随机失败(可重试)的比例
+        history: 保留最近发送的短信条数
+    """
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0, history: int = 1000):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent: Deque[SmsMessage] = deque(maxlen=history)
+        self.count = 0
+
+    async def send(self, message: SmsMessage) -> Optional[str]:
+        await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise SmsSendError("simulated failure")
+        self.count += 1
+        self.sent.append(message)
+        logger.debug(f"模拟短信 {message.phone}: {message.params}")
+        return f"fake-{self.count}"
+
+
+# 校验验证码: 不存在返回 -2, 尝试次数用尽返回 -1(并删除), 错误返回 0, 正确返回 1(并删除)
+_VERIFY_SCRIPT = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then
+    return -2
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if attempts > tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    return -1
+end
+if code == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+
+class SmsService:
+    """异步短信服务
+
+    ``send`` 只把短信放入本 worker 的发送队列就返回, 由 ``workers`` 个后台任务调用通道发送;
+    可重试的失败按指数退避(带随机抖动)最多重试 ``max_retries`` 次. 队列满时抛出
+    ``SmsQueueFullError``, 不会无限堆积.
+
+    验证码保存在 Redis 哈希 ``<prefix>:code:<手机号>`` 中, 带存活时间和尝试次数,
+    校验在 Lua 脚本中原子完成; 同一手机号在 ``resend_interval`` 秒内只能发送一次.
+
+    Args:
+        transport: 短信通道
+        client: 异步 Redis 客户端
+        template_code: 验证码短信的模板代码
+        workers: 发送任务数
+        queue_size: 队列容量
+        max_retries: 最大重试次数
+        backoff: 首次重试前的等待时间(秒), 之后每次翻倍
+        timeout: 单次发送超时(秒)
+        code_length: 验证码位数
+        code_ttl: 验证码有效期(秒)
+        max_attempts: 每个验证码最多校验次数
+        resend_interval: 同一手机号的最小发送间隔(秒)
+        prefix: Redis 键前缀
+    """
+
+    def __init__(
+        self,
+        transport: SmsTransport,
+        client,
+        template_code: Optional[str] = None,
+        workers: int = 4,
+        queue_size: int = 1000,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 5.0,
+        code_length: int = 6,
+        code_ttl: int = 300,
+        max_attempts: int = 5,
+        resend_interval: int = 60,
+        prefix: str = "sms",
+    ):
+        self.transport = transport
+        self.client = client
+        self.template_code = template_code
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.code_length = code_length
+        self.code_ttl = code_ttl
+        self.max_attempts = max_attempts
+        self.resend_interval = resend_interval
+        self.prefix = prefix
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._verify = client.register_script(_VERIFY_SCRIPT)
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, phone: str, params: Optional[Dict[str, Any]] = None, template_code: Optional[str] = None) -> None:
+        """
+        把短信放入发送队列
+
+        Args:
+            phone: 手机号
+            params: 模板参数
+            template_code: 模板代码, 默认使用验证码模板
+
+        Raises:
+            SmsQueueFullError: 队列已满
+        """
+        message = SmsMessage(phone=phone, template_code=template_code or self.template_code, params=params or {})
+        self.start()
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            raise SmsQueueFullError("SMS queue is full")
+
+    async def deliver(self, message: SmsMessage) -> bool:
+        """
+        立即发送一条短信, 按需重试
+
+        Args:
+            message: 短信
+
+        Returns:
+            是否发送成功
+        """
+        while True:
+            message.attempts += 1
+            try:
+                receipt = await asyncio.wait_for(self.transport.send(message), self.timeout)
+                self.sent += 1
+                logger.info(f"短信发送成功: {message.phone}, 回执 {receipt}")
+                return True
+            except (SmsSendError, asyncio.TimeoutError) as e:
+                retryable = getattr(e, "retryable", True)
+                if not retryable or message.attempts > self.max_retries:
+                    self.failed += 1
+                    logger.error(f"短信发送失败: {message.phone}, 第 {message.attempts} 次: {e}")
+                    return False
+                delay = self.backoff * 2 ** (message.attempts - 1)
+                logger.warning(f"短信发送失败, {delay:.1f} 秒后重试: {message.phone}: {e}")
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            except Exception as e:
+                # 通道实现的意外错误, 重试也不会成功
+                self.failed += 1
+                logger.exception(f"短信发送异常: {message.phone}, 第 {message.attempts} 次: {e}")
+                return False
+
+    async def send_code(self, phone: str) -> str:
+        """
+        生成验证码并放入发送队列
+
+        Args:
+            phone: 手机号
+
+        Returns:
+            验证码
+
+        Raises:
+            SmsUnavailableError: 短信通道不可用
+            SmsCooldownError: 距上次发送不足 ``resend_interval`` 秒
+            SmsQueueFullError: 队列已满
+        """
+        self.transport.check()
+        cooldown_key = f"{self.prefix}:cooldown:{phone}"
+        if not await self.client.set(cooldown_key, "1", nx=True, ex=self.resend_interval):
+            ttl = await self.client.ttl(cooldown_key)
+            raise SmsCooldownError(max(1, ttl))
+
+        code = "".join(secrets.choice("0123456789") for _ in range(self.code_length))
+        key = self._code_key(phone)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={"code": code, "attempts": 0})
+            pipe.expire(key, self.code_ttl)
+            await pipe.execute()
+        try:
+            self.send(phone, {"code": code})
+        except SmsQueueFullError:
+            await self.client.delete(key, cooldown_key)
+            raise
+        return code
+
+    async def verify_code(self, phone: str, code: str) -> bool:
+        """
+        校验验证码, 正确后验证码失效; 错误次数超过上限后也会失效
+
+        Args:
+            phone: 手机号
+            code: 用户输入的验证码
+
+        Returns:
+            是否正确
+        """
+        return await self._verify(keys=[self._code_key(phone)], args=[code, self.max_attempts]) == 1
+
+    def start(self) -> None:
+        """启动发送任务(已启动时忽略)"""
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """
+        停止发送任务
+
+        Args:
+            timeout: 等待队列中的短信发完的最长时间(秒)
+        """
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"关闭时仍有 {self._queue.qsize()} 条短信未发送")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.transport.close()
+
+    @property
+    def pending(self) -> int:
+        """队列中等待发送的短信数"""
+        return self._queue.qsize()
+
+    async def _run(self) -> None:
+        while True:
+            message = await self._queue.get()
+            try:
+                await self.deliver(message)
+            except Exception as e:
+                logger.exception(f"短信发送异常: {message.phone}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _code_key(self, phone: str) -> str:
+        return f"{self.prefix}:code:{phone}"
+
+
+def create_transport(name: str) -> SmsTransport:
+    """
+    按名称创建短信通道
+
+    Args:
+        name: aliyun 或 fake
+
+    Returns:
+        短信通道
+    """
+    if name == "fake":
+        return FakeSmsTransport()
+    if name == "aliyun":
+        return AliyunSmsTransport(
+            settings.aliyun_access_key_id,
+            settings.aliyun_access_key_secret,
+            settings.sms_sign_name,
+        )
+    raise ValueError(f"Unknown SMS transport: {name}")
+
+
+sms_service = SmsService(
+    create_transport(settings.sms_transport),
+    async_redis_client,
+    template_code=settings.sms_template_code,
+    workers=settings.sms_workers,
+    queue_size=settings.sms_queue_size,
+    max_retries=settings.sms_max_retries,
+    backoff=settings.sms_retry_backoff,
+    timeout=settings.sms_timeout,
+    code_length=settings.sms_code_length,
+    code_ttl=settings.sms_code_ttl,
+    max_attempts=settings.sms_code_max_attempts,
+    resend_interval=settings.sms_resend_interval,
+)
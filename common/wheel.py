@@ -0,0 +1,88 @@
+"""
+哈希时间轮
+"""
+import math
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class TimingWheel:
+    """单层哈希时间轮, 用于大量近期定时事件
+
+    时间按 ``tick`` 秒划分为槽, ``slots`` 个槽循环使用. 添加、取消都是 O(1),
+    ``advance`` 只检查经过的槽. 超过一圈的事件留在槽中, 到期那一圈才取出.
+    同一个键只保留最后一次添加的时间.
+
+    不自带定时器, 由调用方周期性地调用 ``advance``; 仅供单个事件循环使用.
+
+    Args:
+        tick: 每个槽的时间跨度(秒)
+        slots: 槽的数量
+        start: 起始时间戳, 早于它的事件在下一次 ``advance`` 时取出
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, start: float = 0.0):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, Tuple[float, Any]]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._current = self._tick_of(start)
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def add(self, key: Hashable, deadline: float, payload: Any = None) -> None:
+        """
+        添加或改期一个事件
+
+        Args:
+            key: 事件键
+            deadline: 到期时间戳
+            payload: 到期时随键一起返回的数据
+        """
+        self.discard(key)
+        # 已经过去的槽不会再检查, 过期的事件放进当前槽
+        tick = max(self._tick_of(deadline), self._current)
+        slot = tick % len(self._slots)
+        self._slots[slot][key] = (deadline, payload)
+        self._where[key] = slot
+
+    def discard(self, key: Hashable) -> None:
+        """取消一个事件, 不存在时忽略"""
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now: float) -> List[Tuple[Hashable, float, Any]]:
+        """
+        推进到 ``now``, 取出所有已到期的事件
+
+        Args:
+            now: 当前时间戳
+
+        Returns:
+            (键, 到期时间, 数据) 列表, 按到期时间排序
+        """
+        target = self._tick_of(now)
+        # 超过一圈时每个槽都要检查, 但不必重复检查
+        last = min(target, self._current + len(self._slots) - 1)
+        due = []
+        for tick in range(self._current, last + 1):
+            bucket = self._slots[tick % len(self._slots)]
+            for key, (deadline, payload) in list(bucket.items()):
+                if deadline <= now:
+                    del bucket[key]
+                    del self._where[key]
+                    due.append((key, deadline, payload))
+        self._current = max(self._current, target)
+        due.sort(key=lambda item: item[1])
+        return due
+
+    def next_deadline(self) -> Optional[float]:
+        """最早的到期时间, 没有事件时为 None(需要遍历, 仅用于诊断)"""
+        deadlines = [deadline for bucket in self._slots for deadline, _ in bucket.values()]
+        return min(deadlines, default=None)
+
+    def _tick_of(self, timestamp: float) -> int:
+        return math.floor(timestamp / self.tick)
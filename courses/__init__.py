@@ -0,0 +1,19 @@
+from .routes import router
+from .tree import (
+    CourseNode,
+    CourseSectionNode,
+    CourseTreeCache,
+    build_course_tree,
+    course_tree_cache,
+    course_tree_version,
+)
+
+__all__ = [
+    "router",
+    "CourseNode",
+    "CourseSectionNode",
+    "CourseTreeCache",
+    "build_course_tree",
+    "course_tree_cache",
+    "course_tree_version",
+]
@@ -0,0 +1,89 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.compiler import compiles
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.cache import ResponseCache
+from db.models import Course, CourseSection
+from db.session import create_engine
+from . import tree as tree_module
+from .tree import CourseTreeCache, build_course_tree, course_tree_version
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb(element, compiler, **kw):
+    return "JSON"
+
+
+def test_course_tree_version_tracks_changes(tmp_path, monkeypatch):
+    """课程或章节新增、修改、删除都会改变版本号; 本 worker 提交修改后立即读到新目录"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'courses.db'}")
+        factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        cache = CourseTreeCache(ResponseCache(fakeredis.FakeAsyncRedis(decode_responses=True)), version_ttl=60)
+        monkeypatch.setattr(tree_module, "course_tree_cache", cache)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+
+            updated = datetime(2026, 1, 1)
+            async with factory() as session:
+                session.add(Course(id=1, title="Python", description="", price=10, updated_at=updated))
+                session.add_all(
+                    [
+                        CourseSection(id=1, course_id=1, title="b", duration=60, sort_order=2, is_published=True),
+                        CourseSection(
+                            id=2, course_id=1, title="a", duration=30, sort_order=1, is_free=True,
+                            video_url="v", is_published=True,
+                        ),
+                        CourseSection(id=3, course_id=1, title="draft", duration=99, is_published=False),
+                    ]
+                )
+                await session.commit()
+
+                versions = [await course_tree_version(session)]
+                assert await course_tree_version(session) == versions[0]
+
+                tree = await build_course_tree(session)
+                assert [s.id for s in tree[0].sections] == [2, 1]
+                assert (tree[0].total_duration, tree[0].section_count, tree[0].free_section_count) == (90, 2, 1)
+                assert tree[0].sections[1].video_url is None
+
+                payload = json.loads(await cache.get(session))
+                assert payload["data"][0]["section_count"] == 2
+
+                # 修改课程: updated_at 变大
+                course = await session.get(Course, 1)
+                course.updated_at = updated + timedelta(seconds=1)
+                await session.commit()
+                versions.append(await course_tree_version(session))
+
+                # 删除章节: updated_at 不变, 行数变化
+                await session.delete(await session.get(CourseSection, 3))
+                await session.commit()
+                versions.append(await course_tree_version(session))
+
+                # 新增章节
+                session.add(CourseSection(id=4, course_id=1, title="c", duration=10, sort_order=3, is_published=True))
+                await session.commit()
+                versions.append(await course_tree_version(session))
+                assert len(set(versions)) == len(versions)
+
+                # 本 worker 的提交清除了版本号缓存, 不必等 version_ttl 到期
+                assert await cache.version(session) == versions[-1]
+                payload = json.loads(await cache.get(session))
+                assert payload["data"][0]["section_count"] == 3
+                assert (await session.exec(select(CourseSection.id).order_by(CourseSection.id))).all() == [1, 2, 4]
+            await cache.cache.close()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,24 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+from starlette.responses import Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.etag import conditional
+from common.models import ResponsePayloads
+from db.routing import get_read_session
+from .tree import CourseNode, course_tree_cache
+
+router = APIRouter(prefix="/courses", tags=["课程"])
+
+
+@router.get(
+    "/tree",
+    summary="获取课程目录",
+    response_model=ResponsePayloads[List[CourseNode]],
+)
+@conditional(course_tree_cache.version)
+async def get_course_tree(session: AsyncSession = Depends(get_read_session)):
+    """获取全部课程及其已发布章节"""
+    body = await course_tree_cache.get(session)
+    return Response(content=body, media_type="application/json")
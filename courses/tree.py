@@ -0,0 +1,203 @@
+"""
+课程目录读模型: 课程及其已发布章节, 预先序列化
+"""
+import hashlib
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.cache import ResponseCache, response_cache
+from common.configs import settings
+from common.models import ResponsePayloads
+from common.responses import render_json
+from db.models import Course, CourseSection
+
+
+class CourseSectionNode(BaseModel):
+    """课程目录中的章节"""
+
+    id: int = Field(description="章节ID")
+    title: str = Field(description="章节标题")
+    duration: int = Field(description="时长(秒)")
+    sort_order: int = Field(description="排序")
+    is_free: bool = Field(description="是否免费")
+    video_url: Optional[str] = Field(default=None, description="视频URL, 仅免费章节提供")
+
+
+class CourseNode(BaseModel):
+    """课程目录中的课程"""
+
+    id: int = Field(description="课程ID")
+    title: str = Field(description="课程标题")
+    description: str = Field(description="课程描述")
+    price: float = Field(description="价格")
+    tags: List[str] = Field(default_factory=list, description="标签列表")
+    cover_image: Optional[str] = Field(default=None, description="课程封面")
+    poster_url: Optional[str] = Field(default=None, description="海报图片")
+    instructor: Optional[str] = Field(default=None, description="导师")
+    updated_at: datetime = Field(description="更新时间")
+    total_duration: int = Field(description="已发布章节总时长(秒)")
+    section_count: int = Field(description="已发布章节数")
+    free_section_count: int = Field(description="免费章节数")
+    sections: List[CourseSectionNode] = Field(default_factory=list, description="已发布章节")
+
+
+async def course_tree_version(session: AsyncSession) -> str:
+    """
+    课程目录版本号
+
+    由课程和章节的最大 updated_at 与行数组成, 任一行更新、新增或删除都会改变版本号.
+
+    Args:
+        session: 数据库会话
+
+    Returns:
+        版本号
+    """
+    aggregates = [
+        select(aggregate).select_from(model).scalar_subquery()
+        for model in (Course, CourseSection)
+        for aggregate in (func.max(model.updated_at), func.count())
+    ]
+    row = (await session.exec(select(*aggregates))).one()
+    return hashlib.sha1("|".join(map(str, row)).encode("utf-8")).hexdigest()[:16]
+
+
+async def build_course_tree(session: AsyncSession) -> List[CourseNode]:
+    """
+    用两条查询加载全部课程和已发布章节, 并计算汇总字段
+
+    Args:
+        session: 数据库会话
+
+    Returns:
+        课程目录, 课程按ID排序, 章节按 sort_order 排序
+    """
+    courses = (await session.exec(select(Course).order_by(Course.id))).all()
+    sections = (
+        await session.exec(
+            select(CourseSection)
+            .where(CourseSection.is_published.is_(True))
+            .order_by(CourseSection.course_id, CourseSection.sort_order, CourseSection.id)
+        )
+    ).all()
+
+    by_course: Dict[int, List[CourseSectionNode]] = defaultdict(list)
+    for section in sections:
+        by_course[section.course_id].append(
+            CourseSectionNode(
+                id=section.id,
+                title=section.title,
+                duration=section.duration or 0,
+                sort_order=section.sort_order or 0,
+                is_free=bool(section.is_free),
+                video_url=section.video_url if section.is_free else None,
+            )
+        )
+
+    tree = []
+    for course in courses:
+        nodes = by_course.get(course.id, [])
+        tree.append(
+            CourseNode(
+                id=course.id,
+                title=course.title,
+                description=course.description,
+                price=course.price,
+                tags=course.tags or [],
+                cover_image=course.cover_image,
+                poster_url=course.poster_url,
+                instructor=course.instructor,
+                updated_at=course.updated_at,
+                total_duration=sum(n.duration for n in nodes),
+                section_count=len(nodes),
+                free_section_count=sum(1 for n in nodes if n.is_free),
+                sections=nodes,
+            )
+        )
+    return tree
+
+
+class CourseTreeCache:
+    """预先序列化的课程目录
+
+    序列化后的字节以版本号为键存入两级响应缓存, 内容变化后版本号随之改变, 旧条目自然过期.
+    版本号在本 worker 内缓存 ``version_ttl`` 秒, 因此目录页通常只是一次本地缓存命中;
+    本 worker 提交的课程或章节修改会立即清除版本号缓存.
+
+    Args:
+        cache: 响应缓存
+        ttl: 缓存条目存活时间(秒)
+        version_ttl: 版本号在本 worker 内的缓存时间(秒)
+    """
+
+    def __init__(self, cache: ResponseCache, ttl: float = 3600.0, version_ttl: float = 5.0):
+        self.cache = cache
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self._version: Optional[Tuple[str, float]] = None
+
+    async def get(self, session: AsyncSession) -> bytes:
+        """
+        获取序列化后的课程目录
+
+        Args:
+            session: 数据库会话
+
+        Returns:
+            ``ResponsePayloads[List[CourseNode]]`` 格式的 JSON 字节
+        """
+        version = await self.version(session)
+
+        async def compute() -> bytes:
+            tree = await build_course_tree(session)
+            return render_json(ResponsePayloads[List[CourseNode]](data=tree))
+
+        return await self.cache.get_or_compute(
+            f"courses:tree:{version}", compute, self.ttl, tags=["courses"]
+        )
+
+    async def version(self, session: AsyncSession) -> str:
+        """当前版本号, 优先使用本 worker 的缓存"""
+        if self._version is not None and self._version[1] > time.monotonic():
+            return self._version[0]
+        version = await course_tree_version(session)
+        self._version = (version, time.monotonic() + self.version_ttl)
+        return version
+
+    def reset(self) -> None:
+        """清除本 worker 缓存的版本号"""
+        self._version = None
+
+
+course_tree_cache = CourseTreeCache(
+    response_cache,
+    ttl=settings.course_tree_ttl,
+    version_ttl=settings.course_tree_version_ttl,
+)
+
+
+@event.listens_for(Session, "before_flush")
+def _mark_course_changes(session: Session, flush_context, instances) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Course, CourseSection)):
+            session.info["course_tree_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _reset_course_version(session: Session) -> None:
+    if session.info.pop("course_tree_changed", False):
+        course_tree_cache.reset()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_course_changes(session: Session) -> None:
+    session.info.pop("course_tree_changed", None)
@@ -1,4 +1,42 @@
-from .models import *
+"""
+数据库模型、分页与会话
+
+导出的名称按需从子模块加载(PEP 562): 只用到模型时(例如 Alembic)不会导入异步引擎、
+指标等运行时组件.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+# 名称 -> 所在子模块
+_EXPORTS = {
+    "User": ".models",
+    "Order": ".models",
+    "OrderItem": ".models",
+    "PaymentMethod": ".models",
+    "OrderStatus": ".models",
+    "AssetType": ".models",
+    "DifyAppMode": ".models",
+    "DifyApp": ".models",
+    "Course": ".models",
+    "CourseSection": ".models",
+    "UserAsset": ".models",
+    "paginate_keyset": ".pagination",
+    "estimate_count": ".pagination",
+    "encode_cursor": ".pagination",
+    "decode_cursor": ".pagination",
+    "InvalidCursorError": ".pagination",
+    "get_engine": ".session",
+    "get_session": ".session",
+    "get_session_factory": ".session",
+    "warm_up": ".session",
+    "pool_stats": ".session",
+    "dispose_engine": ".session",
+    "get_read_session": ".routing",
+    "get_read_session_factory": ".routing",
+    "get_replica_set": ".routing",
+    "warm_up_replicas": ".routing",
+    "dispose_replicas": ".routing",
+}
 
 __all__ = [
     "User",
@@ -8,4 +46,63 @@ __all__ = [
     "OrderStatus",
     "AssetType",
     "DifyAppMode",
-]
\ No newline at end of file
+    "DifyApp",
+    "Course",
+    "CourseSection",
+    "UserAsset",
+    "paginate_keyset",
+    "estimate_count",
+    "encode_cursor",
+    "decode_cursor",
+    "InvalidCursorError",
+    "get_engine",
+    "get_session",
+    "get_session_factory",
+    "warm_up",
+    "pool_stats",
+    "dispose_engine",
+    "get_read_session",
+    "get_read_session_factory",
+    "get_replica_set",
+    "warm_up_replicas",
+    "dispose_replicas",
+]
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    # 缓存到模块字典, 之后的访问不再经过 __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+if TYPE_CHECKING:
+    from .models import (
+        User,
+        Order,
+        OrderItem,
+        PaymentMethod,
+        OrderStatus,
+        AssetType,
+        DifyAppMode,
+        DifyApp,
+        Course,
+        CourseSection,
+        UserAsset,
+    )
+    from .pagination import paginate_keyset, estimate_count, encode_cursor, decode_cursor, InvalidCursorError
+    from .session import get_engine, get_session, get_session_factory, warm_up, pool_stats, dispose_engine
+    from .routing import (
+        get_read_session,
+        get_read_session_factory,
+        get_replica_set,
+        warm_up_replicas,
+        dispose_replicas,
+    )
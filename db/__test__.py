@@ -0,0 +1,198 @@
+import os
+
+import pytest
+
+from benchmarks.bench_import import HEAVY_MODULES, PROJECT_MODULES, imported_modules
+
+
+@pytest.mark.parametrize("module", list(PROJECT_MODULES))
+def test_import_loads_only_needed_modules(module):
+    """只需要配置或模型时, 不导入运行时依赖, 也不导入用不到的本项目子模块"""
+    modules = imported_modules(module)
+
+    heavy = sorted({name.split(".")[0] for name in modules} & set(HEAVY_MODULES))
+    assert not heavy, f"导入 {module} 时连带导入了 {heavy}"
+    project = {name for name in modules if name.split(".")[0] in ("common", "db")}
+    extra = sorted(project - PROJECT_MODULES[module])
+    assert not extra, f"导入 {module} 时连带导入了 {extra}"
+
+
+def test_read_session_routes_reads_to_replica(tmp_path):
+    """读取走延迟最小的可用副本, 本请求写入之后的读取回到主库"""
+    import asyncio
+
+    from sqlalchemy import Column, MetaData, String, Table, select, update
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from db.routing import Replica, ReplicaSet, RoutingSession, _install_listeners
+    from db.session import create_engine
+
+    kv = Table("kv", MetaData(), Column("k", String, primary_key=True), Column("v", String))
+    lags = {"fresh": 0.5, "stale": 30.0}
+
+    async def probe(conn):
+        return lags[conn.engine.url.database.rsplit("/", 1)[-1].removesuffix(".db")]
+
+    async def run():
+        engines = {}
+        for name in ("primary", "fresh", "stale"):
+            engine = engines[name] = create_engine(f"sqlite+aiosqlite:///{tmp_path / name}.db")
+            async with engine.begin() as conn:
+                await conn.run_sync(kv.metadata.create_all)
+                await conn.execute(kv.insert().values(k="a", v=name))
+
+        replicas = ReplicaSet([Replica(n, engines[n]) for n in ("fresh", "stale")], max_lag=5.0, probe=probe)
+        _install_listeners()
+        factory = async_sessionmaker(
+            engines["primary"], class_=AsyncSession, sync_session_class=RoutingSession, replicas=replicas
+        )
+
+        async def request():
+            await replicas.maybe_measure()
+            async with factory() as session:
+                before = await session.scalar(select(kv.c.v))
+                await session.exec(update(kv).values(v="written"))
+                await session.commit()
+            async with factory() as session:
+                after = await session.scalar(select(kv.c.v))
+            return before, after
+
+        try:
+            # 每个请求在独立的任务中处理
+            assert await asyncio.create_task(request()) == ("fresh", "written")
+            # 写入标记不影响其他请求
+            async with factory() as session:
+                assert await session.scalar(select(kv.c.v)) == "fresh"
+            # 副本延迟超限后回退到主库
+            lags["fresh"] = 10.0
+            await replicas.measure()
+            assert replicas.choose() is None
+            async with factory() as session:
+                assert await session.scalar(select(kv.c.v)) == "written"
+        finally:
+            for engine in engines.values():
+                await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_pool_limits_split_budget_between_workers():
+    """连接预算按 worker 数平分, 一半常驻一半溢出, 显式配置优先"""
+    from db.session import pool_limits
+
+    assert pool_limits(100, 5) == (10, 10)
+    assert pool_limits(100, 16) == (3, 3)
+    assert pool_limits(10, 40) == (1, 1)
+    assert pool_limits(100, 5, pool_size=4) == (4, 16)
+    assert pool_limits(100, 5, max_overflow=0) == (10, 0)
+
+
+def test_pool_size_follows_launcher_worker_count(monkeypatch):
+    """连接池按启动器实际的 worker 数分配, 而不是 WEB_CONCURRENCY 的默认值"""
+    import asyncio
+
+    from common.configs import settings
+    from db.session import create_engine, pool_limits
+    from launcher import export_worker_count
+
+    monkeypatch.setattr(settings, "web_concurrency", 5)
+    monkeypatch.setattr(settings, "db_pool_size", None)
+    monkeypatch.setattr(settings, "db_max_overflow", None)
+    monkeypatch.setenv("WEB_CONCURRENCY", "5")
+    export_worker_count(20)
+    assert settings.web_concurrency == 20
+    assert os.environ["WEB_CONCURRENCY"] == "20"
+
+    engine = create_engine("postgresql://u:p@localhost:5432/d")
+    try:
+        pool = engine.pool
+        assert (pool.size(), pool._max_overflow) == pool_limits(settings.db_max_connections, 20)
+        assert pool.size() < pool_limits(settings.db_max_connections, 5)[0]
+    finally:
+        asyncio.run(engine.dispose())
+
+
+def test_async_database_url_and_warm_up(tmp_path):
+    """postgresql 连接串切换到 asyncpg; 预热按连接数建立连接"""
+    import asyncio
+
+    from db.session import async_database_url, create_engine, warm_up
+
+    assert async_database_url("postgresql://u:p@h:5432/d") == "postgresql+asyncpg://u:p@h:5432/d"
+    assert async_database_url("sqlite+aiosqlite:///x.db") == "sqlite+aiosqlite:///x.db"
+
+    async def run():
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'warm.db'}")
+        try:
+            assert await warm_up(3, engine=engine) == 3
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_paginate_keyset_ties_and_tampering(tmp_path):
+    """created_at 相同的行按 id 区分, 前后翻页不重不漏; 篡改的游标被拒绝"""
+    import asyncio
+    import base64
+    import json
+    from datetime import datetime, timedelta
+
+    import pytest
+    from sqlalchemy import Column, DateTime, Integer, MetaData, Table, select
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from db.pagination import InvalidCursorError, encode_cursor, paginate_keyset
+    from db.session import create_engine
+
+    table = Table(
+        "keyset_rows", MetaData(), Column("id", Integer, primary_key=True), Column("created_at", DateTime)
+    )
+    # 每 3 行共用一个 created_at
+    base = datetime(2026, 1, 1)
+    rows = [{"id": i, "created_at": base + timedelta(minutes=i // 3)} for i in range(1, 11)]
+    order_by = [table.c.created_at, table.c.id]
+
+    async def run():
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'keyset.db'}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(table.metadata.create_all)
+                await conn.execute(table.insert(), rows)
+            factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            async with factory() as session:
+                seen, pages, cursor = [], [], None
+                while True:
+                    page = await paginate_keyset(session, select(table), order_by, cursor=cursor, limit=4)
+                    pages.append(page)
+                    seen.extend(r.id for r in page.items)
+                    if not page.has_more:
+                        break
+                    cursor = page.next_cursor
+                assert seen == list(range(10, 0, -1))
+
+                # 从第三页向前翻, 回到第二页
+                back = await paginate_keyset(session, select(table), order_by, cursor=pages[2].prev_cursor, limit=4)
+                assert [r.id for r in back.items] == [r.id for r in pages[1].items]
+
+                def forge(payload) -> str:
+                    raw = json.dumps(payload).encode()
+                    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+                tampered = [
+                    "not-base64!",
+                    forge({"v": "abc"}),
+                    forge({"v": [[1], 2]}),
+                    forge({"v": [{"dt": "garbage"}, 1]}),
+                    forge({"v": ["2026-01-01", 1]}),
+                    encode_cursor([base]),
+                ]
+                for cursor in tampered:
+                    with pytest.raises(InvalidCursorError):
+                        await paginate_keyset(session, select(table), order_by, cursor=cursor)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
@@ -3,7 +3,7 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from sqlmodel import SQLModel
-from .models import *
+from db.models import *  # noqa: F401,F403 注册全部模型到 SQLModel.metadata
 from alembic import context
 
 # this is the Alembic Config object, which provides
@@ -0,0 +1,136 @@
+"""base schema
+
+Revision ID: 0000_base_schema
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0000_base_schema'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 枚举类型单独创建, 多个表共用 difyappmode 时不会重复建类型
+_DIFY_APP_MODE = postgresql.ENUM('CHAT', 'AGENT_CHAT', 'WORKFLOW', 'COMPLETION', name='difyappmode', create_type=False)
+_ORDER_STATUS = postgresql.ENUM('PENDING', 'PAID', 'CANCELLED', 'REFUNDED', name='order_status_enum', create_type=False)
+_PAYMENT_METHOD = postgresql.ENUM('ALIPAY', 'WECHATPAY', name='paymentmethod', create_type=False)
+_ASSET_TYPE = postgresql.ENUM('APP', 'COURSE', name='assettype', create_type=False)
+_ENUMS = (_DIFY_APP_MODE, _ORDER_STATUS, _PAYMENT_METHOD, _ASSET_TYPE)
+
+
+def upgrade() -> None:
+    # 表已由 SQLModel.metadata.create_all 建好的数据库直接跳过, 后续修订只加索引
+    if not context.is_offline_mode() and sa.inspect(op.get_bind()).has_table('qu_users'):
+        return
+    for enum in _ENUMS:
+        enum.create(op.get_bind(), checkfirst=True)
+    op.create_table('qu_courses',
+    sa.Column('id', sa.Integer(), nullable=False, comment='课程ID'),
+    sa.Column('title', sa.String(), nullable=True, comment='课程标题'),
+    sa.Column('description', sa.String(), nullable=True, comment='课程描述'),
+    sa.Column('price', sa.Float(), nullable=True, comment='价格'),
+    sa.Column('tags', postgresql.JSONB(astext_type=sa.Text()), nullable=True, comment='标签列表'),
+    sa.Column('cover_image', sa.String(), nullable=True, comment='课程封面图片URL'),
+    sa.Column('poster_url', sa.String(), nullable=True, comment='海报图片URL'),
+    sa.Column('created_at', sa.DateTime(), nullable=True, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True, comment='更新时间'),
+    sa.Column('instructor', sa.String(), nullable=True, comment='导师'),
+    sa.PrimaryKeyConstraint('id'),
+    comment='课程信息表'
+    )
+    op.create_table('qu_dify_apps',
+    sa.Column('id', sa.String(), nullable=False, comment='应用ID'),
+    sa.Column('name', sa.String(), nullable=True, comment='名称'),
+    sa.Column('monthly_price', sa.Float(), nullable=True, comment='月付价格'),
+    sa.Column('yearly_price', sa.Float(), nullable=True, comment='年付价格'),
+    sa.Column('icon_type', sa.String(), nullable=True, comment='图标类型'),
+    sa.Column('icon', sa.String(), nullable=True, comment='图标'),
+    sa.Column('icon_background', sa.String(), nullable=True, comment='图标背景'),
+    sa.Column('icon_url', sa.String(), nullable=True, comment='图标URL'),
+    sa.Column('description', sa.String(), nullable=True, comment='功能描述'),
+    sa.Column('mode', _DIFY_APP_MODE, nullable=True, comment='应用模式'),
+    sa.Column('api_key', sa.String(), nullable=True, comment='API密钥'),
+    sa.Column('tags', postgresql.JSONB(astext_type=sa.Text()), nullable=True, comment='标签列表'),
+    sa.Column('created_at', sa.DateTime(), nullable=True, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True, comment='更新时间'),
+    sa.PrimaryKeyConstraint('id'),
+    comment='Dify应用表'
+    )
+    op.create_table('qu_users',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('username', sa.String(length=50), nullable=True, comment='用户名'),
+    sa.Column('phone', sa.String(length=11), nullable=True, comment='手机号'),
+    sa.Column('password', sa.String(length=100), nullable=True, comment='密码(加密存储)'),
+    sa.Column('membership_expires', sa.DateTime(), nullable=True, comment='会员到期时间'),
+    sa.Column('created_at', sa.DateTime(), nullable=True, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True, comment='更新时间'),
+    sa.PrimaryKeyConstraint('id'),
+    comment='用户表'
+    )
+    op.create_table('qu_course_sections',
+    sa.Column('id', sa.Integer(), nullable=False, comment='章节ID'),
+    sa.Column('title', sa.String(), nullable=True, comment='章节标题'),
+    sa.Column('duration', sa.Integer(), nullable=True, comment='时长(秒)'),
+    sa.Column('sort_order', sa.Integer(), nullable=True, comment='排序'),
+    sa.Column('is_free', sa.Boolean(), nullable=True, comment='是否免费'),
+    sa.Column('video_url', sa.String(), nullable=True, comment='视频URL'),
+    sa.Column('created_at', sa.DateTime(), nullable=True, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True, comment='更新时间'),
+    sa.Column('is_published', sa.Boolean(), nullable=True, comment='是否发布'),
+    sa.Column('course_id', sa.Integer(), nullable=True, comment='关联课程ID'),
+    sa.ForeignKeyConstraint(['course_id'], ['qu_courses.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    comment='课程章节表'
+    )
+    op.create_table('qu_orders',
+    sa.Column('id', sa.String(), nullable=False, comment='订单ID'),
+    sa.Column('user_id', sa.Integer(), nullable=True, comment='用户ID'),
+    sa.Column('amount', sa.Float(), nullable=True, comment='订单金额'),
+    sa.Column('status', _ORDER_STATUS, nullable=True, comment='订单状态'),
+    sa.Column('payment_method', _PAYMENT_METHOD, nullable=True, comment='支付方式'),
+    sa.Column('pay_time', sa.DateTime(), nullable=True, comment='支付时间'),
+    sa.Column('items', postgresql.JSONB(astext_type=sa.Text()), nullable=True, comment='订单项'),
+    sa.Column('created_at', sa.DateTime(), nullable=True, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True, comment='更新时间'),
+    sa.ForeignKeyConstraint(['user_id'], ['qu_users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    comment='订单信息表'
+    )
+    op.create_table('qu_user_assets',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True, comment='用户ID'),
+    sa.Column('asset_type', _ASSET_TYPE, nullable=True, comment='资产类型'),
+    sa.Column('app_mode', _DIFY_APP_MODE, nullable=True, comment='应用模式,当资产类型为APP时有效'),
+    sa.Column('asset_id', sa.String(), nullable=True, comment='资产ID'),
+    sa.Column('asset_name', sa.String(), nullable=True, comment='资产名称'),
+    sa.Column('quantity', sa.Integer(), nullable=True, comment='数量'),
+    sa.Column('expire_at', sa.DateTime(), nullable=True, comment='有效期至'),
+    sa.Column('created_at', sa.DateTime(), nullable=True, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True, comment='更新时间'),
+    sa.ForeignKeyConstraint(['user_id'], ['qu_users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    comment='用户资产表'
+    )
+    op.create_index(op.f('ix_qu_courses_title'), 'qu_courses', ['title'], unique=False)
+    op.create_index(op.f('ix_qu_dify_apps_api_key'), 'qu_dify_apps', ['api_key'], unique=False)
+    op.create_index(op.f('ix_qu_dify_apps_name'), 'qu_dify_apps', ['name'], unique=False)
+    op.create_index(op.f('ix_qu_course_sections_title'), 'qu_course_sections', ['title'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('qu_user_assets')
+    op.drop_table('qu_orders')
+    op.drop_table('qu_course_sections')
+    op.drop_table('qu_users')
+    op.drop_table('qu_dify_apps')
+    op.drop_table('qu_courses')
+    for enum in _ENUMS:
+        enum.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,53 @@
+"""keyset pagination indexes
+
+Revision ID: 0001_keyset_indexes
+Revises: 0000_base_schema
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_keyset_indexes'
+down_revision: Union[str, None] = '0000_base_schema'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY 不能在事务中执行, 建索引期间不锁写
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_qu_orders_user_created',
+            'qu_orders',
+            ['user_id', 'created_at', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_qu_user_assets_user_created',
+            'qu_user_assets',
+            ['user_id', 'created_at', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_qu_user_assets_user_created',
+            table_name='qu_user_assets',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            'ix_qu_orders_user_created',
+            table_name='qu_orders',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
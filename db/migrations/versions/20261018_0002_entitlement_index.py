@@ -0,0 +1,41 @@
+"""user asset entitlement index
+
+Revision ID: 0002_entitlement_index
+Revises: 0001_keyset_indexes
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_entitlement_index'
+down_revision: Union[str, None] = '0001_keyset_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 包含 expire_at, 加载用户权益时只需扫描索引
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_qu_user_assets_entitlement',
+            'qu_user_assets',
+            ['user_id', 'asset_type', 'asset_id'],
+            postgresql_include=['expire_at'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_qu_user_assets_entitlement',
+            table_name='qu_user_assets',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
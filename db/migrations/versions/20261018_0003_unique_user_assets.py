@@ -0,0 +1,99 @@
+"""unique user asset per (user, type, id)
+
+Revision ID: 0003_unique_user_assets
+Revises: 0002_entitlement_index
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_unique_user_assets'
+down_revision: Union[str, None] = '0002_entitlement_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 合并重复资产: 保留最早的一行, 数量求和, 有永久有效的记录则永久有效.
+    # 合并与建索引之间若又插入了重复行, 并发建索引会失败并留下 INVALID 的索引;
+    # 重新执行本迁移时会再次合并, 并先删掉无效的索引再重建.
+    op.execute(
+        """
+        UPDATE qu_user_assets a
+        SET quantity = d.quantity, expire_at = d.expire_at
+        FROM (
+            SELECT min(id) AS keep_id,
+                   sum(quantity) AS quantity,
+                   CASE WHEN bool_or(expire_at IS NULL) THEN NULL ELSE max(expire_at) END AS expire_at
+            FROM qu_user_assets
+            GROUP BY user_id, asset_type, asset_id
+            HAVING count(*) > 1
+        ) d
+        WHERE a.id = d.keep_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM qu_user_assets a
+        USING qu_user_assets b
+        WHERE a.user_id = b.user_id
+          AND a.asset_type = b.asset_type
+          AND a.asset_id = b.asset_id
+          AND a.id > b.id
+        """
+    )
+    with op.get_context().autocommit_block():
+        # 上次并发建索引失败留下的无效索引, 不删掉的话 if_not_exists 会直接跳过
+        op.execute(
+            """
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = 'uq_qu_user_assets_user_asset' AND NOT i.indisvalid
+                ) THEN
+                    DROP INDEX uq_qu_user_assets_user_asset;
+                END IF;
+            END $$
+            """
+        )
+        op.create_index(
+            'uq_qu_user_assets_user_asset',
+            'qu_user_assets',
+            ['user_id', 'asset_type', 'asset_id'],
+            unique=True,
+            postgresql_include=['expire_at'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # 唯一索引覆盖了权益检查的查询
+        op.drop_index(
+            'ix_qu_user_assets_entitlement',
+            table_name='qu_user_assets',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    # 只恢复索引; upgrade 合并掉的重复资产行无法还原
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_qu_user_assets_entitlement',
+            'qu_user_assets',
+            ['user_id', 'asset_type', 'asset_id'],
+            postgresql_include=['expire_at'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index(
+            'uq_qu_user_assets_user_asset',
+            table_name='qu_user_assets',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,55 @@
+"""GIN indexes on JSONB tags
+
+Revision ID: 0004_tag_gin_indexes
+Revises: 0003_unique_user_assets
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_tag_gin_indexes'
+down_revision: Union[str, None] = '0003_unique_user_assets'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 默认的 jsonb_ops 同时支持 @> 和 ?|
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_qu_courses_tags',
+            'qu_courses',
+            ['tags'],
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_qu_dify_apps_tags',
+            'qu_dify_apps',
+            ['tags'],
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_qu_dify_apps_tags',
+            table_name='qu_dify_apps',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            'ix_qu_courses_tags',
+            table_name='qu_courses',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,52 @@
+"""pg_trgm indexes for keyword search
+
+Revision ID: 0005_search_trgm_indexes
+Revises: 0004_tag_gin_indexes
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_search_trgm_indexes'
+down_revision: Union[str, None] = '0004_tag_gin_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_qu_courses_title_trgm', 'qu_courses', 'title'),
+    ('ix_qu_courses_description_trgm', 'qu_courses', 'description'),
+    ('ix_qu_dify_apps_name_trgm', 'qu_dify_apps', 'name'),
+    ('ix_qu_dify_apps_description_trgm', 'qu_dify_apps', 'description'),
+]
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.create_index(
+                name,
+                table,
+                [column],
+                postgresql_using='gin',
+                postgresql_ops={column: 'gin_trgm_ops'},
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    # 扩展可能被其他对象使用, 不删除
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
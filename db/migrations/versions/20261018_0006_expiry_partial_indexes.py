@@ -0,0 +1,55 @@
+"""partial indexes for membership and asset expiry sweeps
+
+Revision ID: 0006_expiry_partial_indexes
+Revises: 0005_search_trgm_indexes
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_expiry_partial_indexes'
+down_revision: Union[str, None] = '0005_search_trgm_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 到期扫描按 (到期时间, ID) 键集分页; 大部分行没有到期时间, 不进入索引
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_qu_users_membership_expires',
+            'qu_users',
+            ['membership_expires', 'id'],
+            postgresql_where=sa.text('membership_expires IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_qu_user_assets_expire_at',
+            'qu_user_assets',
+            ['expire_at', 'id'],
+            postgresql_where=sa.text('expire_at IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_qu_user_assets_expire_at',
+            table_name='qu_user_assets',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            'ix_qu_users_membership_expires',
+            table_name='qu_users',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
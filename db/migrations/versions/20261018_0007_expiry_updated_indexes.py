@@ -0,0 +1,55 @@
+"""partial updated_at indexes for the expiry sweep lookback
+
+Revision ID: 0007_expiry_updated_indexes
+Revises: 0006_expiry_partial_indexes
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_expiry_updated_indexes'
+down_revision: Union[str, None] = '0006_expiry_partial_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 到期扫描回看最近修改过的行, 找出到期时间落在已扫描窗口内的新增或续期记录
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_qu_users_membership_updated',
+            'qu_users',
+            ['updated_at'],
+            postgresql_where=sa.text('membership_expires IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_qu_user_assets_expire_updated',
+            'qu_user_assets',
+            ['updated_at'],
+            postgresql_where=sa.text('expire_at IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_qu_user_assets_expire_updated',
+            table_name='qu_user_assets',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            'ix_qu_users_membership_updated',
+            table_name='qu_users',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
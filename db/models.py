@@ -13,6 +13,8 @@ from sqlalchemy import (
     Integer,
     DateTime,
     Enum as SQLAlchemyEnum,
+    Index,
+    text,
 )
 from sqlmodel import Field, Relationship, SQLModel
 from sqlalchemy.dialects.postgresql import JSONB
@@ -37,6 +39,8 @@ class OrderItem(BaseModel):
     asset_id: str
     quantity: int
     unit_price: str
+    # 每份的有效天数, 为空表示永久有效(例如买断的课程)
+    duration_days: Optional[int] = None
 
 
 class OrderStatus(str, Enum):
@@ -85,12 +89,27 @@ class User(SQLModel, table=True):
     )
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(),
-        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now()),
+        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now),
         description="更新时间",
     )
     orders: List["Order"] = Relationship(back_populates="user")
     assets: List["UserAsset"] = Relationship(back_populates="user")
-    __table_args__ = {"comment": "用户表"}
+    __table_args__ = (
+        # 到期扫描按 (到期时间, ID) 键集分页, 只索引设置了到期时间的行
+        Index(
+            "ix_qu_users_membership_expires",
+            "membership_expires",
+            "id",
+            postgresql_where=text("membership_expires IS NOT NULL"),
+        ),
+        # 到期扫描回看最近修改过到期时间的行
+        Index(
+            "ix_qu_users_membership_updated",
+            "updated_at",
+            postgresql_where=text("membership_expires IS NOT NULL"),
+        ),
+        {"comment": "用户表"},
+    )
 
     __tablename__ = "qu_users"
 
@@ -156,11 +175,28 @@ class DifyApp(SQLModel, table=True):
     )
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(),
-        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now()),
+        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now),
         description="更新时间",
     )
 
-    __table_args__ = {"comment": "Dify应用表"}
+    __table_args__ = (
+        # 标签包含查询(@>, ?|)
+        Index("ix_qu_dify_apps_tags", "tags", postgresql_using="gin"),
+        # 关键词搜索(ILIKE '%...%')
+        Index(
+            "ix_qu_dify_apps_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_qu_dify_apps_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ),
+        {"comment": "Dify应用表"},
+    )
     __tablename__ = "qu_dify_apps"
 
 
@@ -206,7 +242,7 @@ class Course(SQLModel, table=True):
 
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(),
-        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now()),
+        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now),
         description="更新时间",
     )
     instructor: Optional[str] = Field(
@@ -215,7 +251,24 @@ class Course(SQLModel, table=True):
 
     # 添加这一行，建立与章节的关系
     sections: List["CourseSection"] = Relationship(back_populates="course")
-    __table_args__ = {"comment": "课程信息表"}
+    __table_args__ = (
+        # 标签包含查询(@>, ?|)
+        Index("ix_qu_courses_tags", "tags", postgresql_using="gin"),
+        # 关键词搜索(ILIKE '%...%')
+        Index(
+            "ix_qu_courses_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_qu_courses_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ),
+        {"comment": "课程信息表"},
+    )
     __tablename__ = "qu_courses"
 
 
@@ -260,7 +313,7 @@ class CourseSection(SQLModel, table=True):
 
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(),
-        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now()),
+        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now),
         description="更新时间",
     )
 
@@ -327,11 +380,37 @@ class UserAsset(SQLModel, table=True):
     )
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(),
-        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now()),
+        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now),
         description="更新时间",
     )
     user: "User" = Relationship(back_populates="assets")
-    __table_args__ = {"comment": "用户资产表"}
+    __table_args__ = (
+        # 按用户游标分页
+        Index("ix_qu_user_assets_user_created", "user_id", "created_at", "id"),
+        # 每个用户的同一资产只有一行, 支付入库按此 upsert;
+        # 权益检查按用户加载 (资产类型, 资产ID) -> 有效期, 仅扫描索引
+        Index(
+            "uq_qu_user_assets_user_asset",
+            "user_id",
+            "asset_type",
+            "asset_id",
+            unique=True,
+            postgresql_include=["expire_at"],
+        ),
+        # 到期扫描, 永久有效(expire_at 为空)的资产不进入索引
+        Index(
+            "ix_qu_user_assets_expire_at",
+            "expire_at",
+            "id",
+            postgresql_where=text("expire_at IS NOT NULL"),
+        ),
+        Index(
+            "ix_qu_user_assets_expire_updated",
+            "updated_at",
+            postgresql_where=text("expire_at IS NOT NULL"),
+        ),
+        {"comment": "用户资产表"},
+    )
     __tablename__ = "qu_user_assets"
 
 
@@ -381,10 +460,14 @@ class Order(SQLModel, table=True):
 
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(),
-        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now()),
+        sa_column=Column(DateTime(), comment="更新时间", onupdate=datetime.now),
         description="更新时间",
     )
     user: "User" = Relationship(back_populates="orders")
 
-    __table_args__ = {"comment": "订单信息表"}
+    __table_args__ = (
+        # 按用户游标分页
+        Index("ix_qu_orders_user_created", "user_id", "created_at", "id"),
+        {"comment": "订单信息表"},
+    )
     __tablename__ = "qu_orders"
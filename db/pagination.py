@@ -0,0 +1,226 @@
+"""
+游标(keyset)分页
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.models import CursorPage
+
+
+class InvalidCursorError(ValueError):
+    """游标无法解析"""
+
+
+# 游标中允许出现的值类型
+_SCALARS = (str, int, float, bool, type(None), datetime, date, Decimal)
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "dec" in value:
+            return Decimal(value["dec"])
+    return value
+
+
+def encode_cursor(values: Sequence[Any], backward: bool = False) -> str:
+    """
+    将排序键编码为不透明游标
+
+    Args:
+        values: 排序键的值, 顺序与排序列一致
+        backward: 是否为向前翻页(上一页)的游标
+
+    Returns:
+        URL 安全的 base64 字符串
+    """
+    payload = {"v": [_encode_value(v) for v in values]}
+    if backward:
+        payload["b"] = 1
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[List[Any], bool]:
+    """
+    解析游标
+
+    Args:
+        cursor: encode_cursor 生成的游标
+
+    Returns:
+        (排序键的值, 是否为向前翻页)
+
+    Raises:
+        InvalidCursorError: 游标格式错误
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = payload["v"]
+        if not isinstance(values, list):
+            raise TypeError("values must be a list")
+        values = [_decode_value(v) for v in values]
+        if not all(isinstance(v, _SCALARS) for v in values):
+            raise TypeError("values must be scalars")
+        return values, bool(payload.get("b"))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) 包装, 保留原语句的绑定参数"""
+
+    inherit_cache = False
+
+    def __init__(self, statement: ClauseElement):
+        self.statement = statement
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element: _Explain, compiler, **kw) -> str:
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+async def estimate_count(session: AsyncSession, statement: Select) -> Optional[int]:
+    """
+    用查询计划的行数估算代替 COUNT(*)
+
+    估算值来自 PostgreSQL 的表统计信息(ANALYZE), 不扫描数据, 精度取决于统计的新鲜度.
+
+    Args:
+        session: 数据库会话
+        statement: 不带分页条件的查询
+
+    Returns:
+        估算的行数, 非 PostgreSQL 数据库返回 None
+    """
+    if session.bind.dialect.name != "postgresql":
+        return None
+    result = await session.execute(_Explain(statement.order_by(None).limit(None)))
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _coerce(column: Any, value: Any) -> Any:
+    """校验游标中的值与排序列类型一致, 防止篡改的游标把错误类型的参数带进 SQL"""
+    try:
+        expected = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return value
+    if value is None or isinstance(value, expected):
+        return value
+    if issubclass(expected, Enum):
+        try:
+            return expected(value)
+        except ValueError as e:
+            raise InvalidCursorError("Invalid cursor") from e
+    if expected is float and isinstance(value, int):
+        return float(value)
+    raise InvalidCursorError("Invalid cursor")
+
+
+def _keyset_condition(columns: Sequence[Any], values: Sequence[Any], descending: bool, backward: bool):
+    """构造 (c1, c2, ...) < (v1, v2, ...) 形式的条件"""
+    after = descending != backward
+    if len(columns) > 1:
+        left, right = tuple_(*columns), tuple_(*values)
+        return left < right if after else left > right
+    return columns[0] < values[0] if after else columns[0] > values[0]
+
+
+async def paginate_keyset(
+    session: AsyncSession,
+    statement: Select,
+    order_by: Sequence[Any],
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    descending: bool = True,
+    with_total: bool = False,
+) -> CursorPage:
+    """
+    执行游标分页查询
+
+    排序列的组合必须唯一(通常以主键结尾), 并且应当有对应的复合索引,
+    例如 ``(created_at, id)``. 所有排序列使用同一个方向.
+
+    Args:
+        session: 数据库会话
+        statement: 查询单个实体的语句, 例如 ``select(Order).where(Order.user_id == 1)``
+        order_by: 排序列, 例如 ``[Order.created_at, Order.id]``
+        cursor: 上一次返回的 next_cursor 或 prev_cursor
+        limit: 每页条数
+        descending: 是否倒序
+        with_total: 是否附带总数估算值
+
+    Returns:
+        游标分页结果
+
+    Raises:
+        InvalidCursorError: 游标格式错误或与排序列数量不符
+    """
+    backward = False
+    paged = statement
+    if cursor:
+        values, backward = decode_cursor(cursor)
+        if len(values) != len(order_by):
+            raise InvalidCursorError("Cursor does not match sort keys")
+        values = [_coerce(column, value) for column, value in zip(order_by, values)]
+        paged = paged.where(_keyset_condition(order_by, values, descending, backward))
+
+    # 向前翻页时反向排序, 取出后再翻转
+    reverse = descending != backward
+    paged = paged.order_by(*(c.desc() if reverse else c.asc() for c in order_by)).limit(limit + 1)
+
+    rows = list((await session.exec(paged)).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    def key_of(item: Any) -> List[Any]:
+        return [getattr(item, c.key) for c in order_by]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backward:
+            next_cursor = encode_cursor(key_of(rows[-1]))
+        if cursor and (has_more or not backward):
+            prev_cursor = encode_cursor(key_of(rows[0]), backward=True)
+
+    total = await estimate_count(session, statement) if with_total else None
+    return CursorPage(
+        items=rows,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        has_more=has_more,
+        total=total,
+    )
@@ -0,0 +1,311 @@
+"""
+读写分离的会话路由
+"""
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import ORMExecuteState, Session as OrmSession
+from sqlalchemy.sql import Select
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.configs import settings
+from common.log import logger
+from common.metrics import metrics_registry
+from .session import create_engine, get_engine, get_session_factory, warm_up
+
+# 连接 -> 复制延迟(秒)
+LagProbe = Callable[[AsyncConnection], Awaitable[float]]
+
+# 当前请求是否写过数据库, 写过之后的读取都走主库.
+# 每个请求在独立的任务中处理, 标记不会带到下一个请求.
+_written: ContextVar[bool] = ContextVar("db_written", default=False)
+
+# 已回放完收到的全部 WAL 时延迟为 0, 避免主库空闲时把最后一次回放的时间差当作延迟
+_REPLAY_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+async def replay_lag(conn: AsyncConnection) -> float:
+    """
+    PostgreSQL 备库的回放延迟
+
+    Args:
+        conn: 备库连接
+
+    Returns:
+        延迟(秒)
+    """
+    return float((await conn.execute(_REPLAY_LAG)).scalar() or 0.0)
+
+
+def mark_written() -> None:
+    """标记当前请求已写入数据库, 之后的读取走主库"""
+    _written.set(True)
+
+
+def has_written() -> bool:
+    """当前请求是否写入过数据库"""
+    return _written.get()
+
+
+class Replica:
+    """只读副本及其最近一次测得的复制延迟
+
+    Args:
+        name: 名称, 用于日志和指标
+        engine: 副本的异步引擎
+    """
+
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        # None 表示尚未测得或副本不可用
+        self.lag: Optional[float] = None
+
+
+class ReplicaSet:
+    """只读副本集合
+
+    每隔 ``lag_interval`` 秒测量一次各副本的复制延迟, 测量按需触发并在后台进行, 不阻塞请求.
+    延迟不低于 ``max_lag`` 或测量失败的副本不参与路由; 其余副本按 ``1 - lag / max_lag``
+    加权随机选择, 延迟越小分到的读请求越多. 没有可用副本时 ``choose`` 返回 None,
+    由调用方回退到主库.
+
+    Args:
+        replicas: 副本列表
+        max_lag: 允许的最大复制延迟(秒)
+        lag_interval: 测量间隔(秒)
+        probe_timeout: 单个副本的测量超时(秒)
+        probe: 测量延迟的函数, 默认查询 PostgreSQL 的回放进度
+    """
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        max_lag: float = 5.0,
+        lag_interval: float = 2.0,
+        probe_timeout: float = 1.0,
+        probe: LagProbe = replay_lag,
+    ):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.lag_interval = lag_interval
+        self.probe_timeout = probe_timeout
+        self.probe = probe
+        self._measured_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        """
+        按延迟加权选择一个副本
+
+        Returns:
+            副本, 没有可用副本时返回 None
+        """
+        candidates = [r for r in self.replicas if r.lag is not None and r.lag < self.max_lag]
+        if not candidates:
+            return None
+        return random.choices(candidates, [1.0 - r.lag / self.max_lag for r in candidates])[0]
+
+    async def measure(self) -> None:
+        """立即测量所有副本的复制延迟"""
+        await asyncio.gather(*(self._measure(replica) for replica in self.replicas))
+        self._measured_at = time.monotonic()
+
+    async def maybe_measure(self) -> None:
+        """
+        按需测量: 首次调用时等待测量完成, 之后到期时在后台测量, 不阻塞当前请求
+        """
+        if not self.replicas:
+            return
+        if self._measured_at is not None and time.monotonic() - self._measured_at < self.lag_interval:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.measure())
+        if self._measured_at is None:
+            # 首次测量完成前没有可用副本, 等待而不是让这批读取全部落到主库
+            await asyncio.shield(self._task)
+
+    async def warm_up(self) -> int:
+        """
+        预热各副本的连接池并测量延迟, 副本不可用不影响启动
+
+        Returns:
+            成功预热的连接数
+        """
+        results = await asyncio.gather(
+            *(warm_up(engine=replica.engine) for replica in self.replicas), return_exceptions=True
+        )
+        for replica, result in zip(self.replicas, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"预热副本 {replica.name} 失败: {result}")
+        await self.measure()
+        return sum(r for r in results if isinstance(r, int))
+
+    async def dispose(self) -> None:
+        """停止测量并关闭所有副本的连接"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    async def _measure(self, replica: Replica) -> None:
+        async def probe() -> float:
+            async with replica.engine.connect() as conn:
+                return await self.probe(conn)
+
+        try:
+            lag = await asyncio.wait_for(probe(), self.probe_timeout)
+        except Exception as e:
+            if replica.lag is not None:
+                logger.warning(f"副本 {replica.name} 不可用, 读请求改走其他副本或主库: {e}")
+            replica.lag = None
+            return
+        if lag >= self.max_lag and (replica.lag is None or replica.lag < self.max_lag):
+            logger.warning(f"副本 {replica.name} 复制延迟 {lag:.1f} 秒, 暂停向其路由读请求")
+        replica.lag = lag
+
+
+class RoutingSession(Session):
+    """读写分离的同步会话, 由 ``AsyncSession`` 包装使用
+
+    不加锁的 SELECT 发往副本; 写入、``FOR UPDATE`` 读取和其他语句发往主库. 副本在会话
+    第一次读取时选定, 之后固定使用, 同一会话内的读取不会在副本之间跳动. 当前请求写入过
+    数据库后(任一会话 flush 或执行 INSERT/UPDATE/DELETE), 后续读取都走主库, 保证读己之写.
+
+    Args:
+        replicas: 副本集合, 为空时与普通会话相同
+    """
+
+    def __init__(self, *args, replicas: Optional[ReplicaSet] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self._replica: Optional[Replica] = None
+        self._replica_chosen = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.replicas
+            and not self._flushing
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+            and not _written.get()
+        ):
+            if not self._replica_chosen:
+                self._replica = self.replicas.choose()
+                self._replica_chosen = True
+            if self._replica is not None:
+                return self._replica.engine.sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+def _after_flush(session: OrmSession, flush_context) -> None:
+    _written.set(True)
+
+
+def _do_orm_execute(state: ORMExecuteState) -> None:
+    # 文本语句无法判断是否写入, 同样按写入处理
+    if not state.is_select:
+        _written.set(True)
+
+
+def _install_listeners() -> None:
+    """监听所有会话的写入; 只在配置了副本时安装, 单库部署不增加执行开销"""
+    if not event.contains(OrmSession, "after_flush", _after_flush):
+        event.listen(OrmSession, "after_flush", _after_flush)
+        event.listen(OrmSession, "do_orm_execute", _do_orm_execute)
+
+
+def _replica_name(url: str) -> str:
+    parsed = make_url(url)
+    return f"{parsed.host}:{parsed.port}" if parsed.host else parsed.render_as_string()
+
+
+_replica_set: Optional[ReplicaSet] = None
+_read_session_factory: Optional[async_sessionmaker] = None
+
+
+def get_replica_set() -> ReplicaSet:
+    """获取本 worker 的副本集合, 首次调用时按配置创建"""
+    global _replica_set
+    if _replica_set is None:
+        _replica_set = ReplicaSet(
+            [Replica(_replica_name(url), create_engine(url)) for url in settings.database_replica_urls],
+            max_lag=settings.db_replica_max_lag,
+            lag_interval=settings.db_replica_lag_interval,
+            probe_timeout=settings.db_replica_probe_timeout,
+        )
+        if _replica_set:
+            _install_listeners()
+    return _replica_set
+
+
+def get_read_session_factory() -> async_sessionmaker:
+    """获取读写分离的会话工厂, 没有配置副本时即为 ``get_session_factory()``"""
+    global _read_session_factory
+    if _read_session_factory is None:
+        replicas = get_replica_set()
+        if not replicas:
+            return get_session_factory()
+        _read_session_factory = async_sessionmaker(
+            get_engine(),
+            class_=AsyncSession,
+            sync_session_class=RoutingSession,
+            replicas=replicas,
+            expire_on_commit=False,
+        )
+    return _read_session_factory
+
+
+async def get_read_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI 依赖: 以读取为主的请求范围会话, 读取走副本, 写入及写入之后的读取走主库"""
+    await get_replica_set().maybe_measure()
+    async with get_read_session_factory()() as session:
+        yield session
+
+
+async def warm_up_replicas() -> int:
+    """预热副本连接池并测量延迟"""
+    return await get_replica_set().warm_up()
+
+
+_replica_lag = metrics_registry.gauge("db_replica_lag_seconds", "只读副本复制延迟", labels=("replica",))
+
+
+def _collect_replica_metrics(registry) -> None:
+    if _replica_set is None:
+        return
+    for replica in _replica_set.replicas:
+        if replica.lag is None:
+            _replica_lag.pop((replica.name,), None)
+        else:
+            _replica_lag[(replica.name,)] = replica.lag
+
+
+metrics_registry.add_collector(_collect_replica_metrics)
+
+
+async def dispose_replicas() -> None:
+    """关闭所有副本的连接"""
+    global _replica_set, _read_session_factory
+    if _replica_set is not None:
+        await _replica_set.dispose()
+    _replica_set = None
+    _read_session_factory = None
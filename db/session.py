@@ -0,0 +1,237 @@
+"""
+异步数据库引擎与会话
+"""
+import asyncio
+import math
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from common.configs import settings
+from common.metrics import LatencyStats, metrics_registry
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """记录连接检出耗时的连接池
+
+    检出耗时包含排队等待和新建连接的时间, 记录在 ``checkout_stats`` 中.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats = LatencyStats()
+        self.timeouts = 0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.checkout_stats.observe(time.perf_counter() - start)
+
+
+def pool_limits(
+    max_connections: int,
+    workers: int,
+    pool_size: Optional[int] = None,
+    max_overflow: Optional[int] = None,
+) -> Tuple[int, int]:
+    """
+    按 worker 数分配连接数
+
+    每个 worker 分到 ``max_connections // workers`` 个连接, 其中一半作为常驻连接,
+    其余作为突发溢出连接. 显式配置的值优先.
+
+    Args:
+        max_connections: 所有 worker 共享的连接预算
+        workers: worker 进程数
+        pool_size: 显式配置的常驻连接数
+        max_overflow: 显式配置的溢出连接数
+
+    Returns:
+        (pool_size, max_overflow)
+    """
+    per_worker = max(2, max_connections // max(1, workers))
+    if pool_size is None:
+        pool_size = max(1, math.ceil(per_worker / 2))
+    if max_overflow is None:
+        max_overflow = max(0, per_worker - pool_size)
+    return pool_size, max_overflow
+
+
+def async_database_url(url: str) -> str:
+    """
+    将 postgresql:// 连接串转换为 asyncpg 驱动的连接串
+
+    Args:
+        url: 数据库URL
+
+    Returns:
+        使用异步驱动的数据库URL
+    """
+    parsed = make_url(url)
+    if parsed.drivername in ("postgresql", "postgres", "postgresql+psycopg2"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+def create_engine(url: str, **kwargs: Any) -> AsyncEngine:
+    """
+    根据配置创建异步引擎
+
+    Args:
+        url: 数据库URL
+        kwargs: 覆盖默认参数
+
+    Returns:
+        异步引擎
+    """
+    url = async_database_url(url)
+    options: Dict[str, Any] = dict(
+        echo=settings.db_echo,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle,
+    )
+    if make_url(url).get_backend_name() == "postgresql":
+        pool_size, max_overflow = pool_limits(
+            settings.db_max_connections,
+            settings.web_concurrency,
+            settings.db_pool_size,
+            settings.db_max_overflow,
+        )
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            # 后进先出, 让多余的空闲连接能够自然回收
+            pool_use_lifo=True,
+            connect_args={
+                # asyncpg 服务端预编译语句缓存, 经过 pgbouncer 事务池时需设为 0
+                "statement_cache_size": settings.db_statement_cache_size,
+                "server_settings": {"application_name": settings.db_application_name},
+            },
+        )
+        url = make_url(url).update_query_dict(
+            {"prepared_statement_cache_size": str(settings.db_statement_cache_size)}
+        ).render_as_string(hide_password=False)
+    options.update(kwargs)
+    return create_async_engine(url, **options)
+
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker] = None
+
+
+def get_engine() -> AsyncEngine:
+    """获取本 worker 的异步引擎, 首次调用时创建"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(settings.database_url)
+    return _engine
+
+
+def get_session_factory() -> async_sessionmaker:
+    """获取会话工厂"""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(
+            get_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _session_factory
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI 依赖: 提供一个请求范围内的异步会话"""
+    async with get_session_factory()() as session:
+        yield session
+
+
+async def warm_up(connections: Optional[int] = None, engine: Optional[AsyncEngine] = None) -> int:
+    """
+    预先建立连接, 避免第一批请求承担建连开销
+
+    Args:
+        connections: 预热的连接数, 默认为常驻连接数
+        engine: 预热的引擎, 默认为主库引擎
+
+    Returns:
+        成功预热的连接数
+    """
+    engine = engine or get_engine()
+    if connections is None:
+        size = getattr(engine.pool, "size", None)
+        connections = size() if callable(size) else 1
+
+    async def ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    results = await asyncio.gather(
+        *(ping() for _ in range(connections)), return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors and len(errors) == len(results):
+        raise errors[0]
+    return len(results) - len(errors)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """
+    连接池使用情况
+
+    Returns:
+        常驻连接数、已检出连接数、溢出连接数、饱和度和检出耗时统计
+    """
+    if _engine is None:
+        return {}
+    pool = _engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {"status": pool.status()}
+    capacity = pool.size() + pool._max_overflow
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": checked_out / capacity if capacity else 0.0,
+        "timeouts": pool.timeouts,
+        "checkout": pool.checkout_stats.snapshot(),
+    }
+
+
+_checkout_latency = metrics_registry.histogram("db_pool_checkout_seconds", "数据库连接检出耗时")
+_checked_out = metrics_registry.gauge("db_pool_checked_out", "已检出的数据库连接数")
+_capacity = metrics_registry.gauge("db_pool_capacity", "数据库连接池容量(常驻+溢出)")
+
+
+def _collect_pool_metrics(registry) -> None:
+    pool = _engine.pool if _engine is not None else None
+    if not isinstance(pool, InstrumentedQueuePool):
+        return
+    _checkout_latency[()] = pool.checkout_stats
+    _checked_out[()] = pool.checkedout()
+    _capacity[()] = pool.size() + pool._max_overflow
+
+
+metrics_registry.add_collector(_collect_pool_metrics)
+
+
+async def dispose_engine() -> None:
+    """关闭引擎并释放所有连接"""
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _session_factory = None
@@ -0,0 +1,17 @@
+from .keys import DifyConsoleClient, DifyKeyManager, DifyKeyNotFoundError, dify_console, dify_key_manager
+from .proxy import DifyStreamProxy, DifyUpstreamError, RelayResponse, StreamRelay, dify_proxy
+from .routes import router
+
+__all__ = [
+    "DifyConsoleClient",
+    "DifyKeyManager",
+    "DifyKeyNotFoundError",
+    "dify_console",
+    "dify_key_manager",
+    "DifyStreamProxy",
+    "DifyUpstreamError",
+    "RelayResponse",
+    "StreamRelay",
+    "dify_proxy",
+    "router",
+]
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from db.models import DifyAppMode
+from . import routes as routes_module
+from .proxy import DifyStreamProxy, DifyUpstreamError, RelayResponse, StreamRelay
+
+
+class FakeSseServer:
+    """本地 SSE 服务: 每隔 ``interval`` 秒发送一个事件, 记录收到的请求和连接是否被关闭
+
+    使用 ``rejected_keys`` 中的密钥的请求返回 401.
+    """
+
+    def __init__(self, events: int = 5, interval: float = 0.05, status: int = 200, rejected_keys=()):
+        self.events = events
+        self.interval = interval
+        self.status = status
+        self.rejected_keys = set(rejected_keys)
+        self.requests = []
+        self.disconnected = asyncio.Event()
+        self.sent = 0
+
+    async def __aenter__(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        head = (await reader.readuntil(b"\r\n\r\n")).decode()
+        length = next(
+            (int(line.split(":")[1]) for line in head.split("\r\n") if line.lower().startswith("content-length")), 0
+        )
+        self.requests.append((head.split("\r\n")[0], json.loads(await reader.readexactly(length))))
+        rejected = any(f"bearer {key}" in head.lower() for key in self.rejected_keys)
+        if self.status != 200 or rejected:
+            status = 401 if rejected else self.status
+            body = json.dumps({"code": "invalid_param", "message": "bad request"}).encode()
+            writer.write(
+                f"HTTP/1.1 {status} Error\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            writer.close()
+            return
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        try:
+            for i in range(self.events):
+                event = f'data: {{"event": "message", "answer": "{i}"}}\n\n'.encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(event), event))
+                await writer.drain()
+                self.sent += 1
+                await asyncio.sleep(self.interval)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnected.set()
+            writer.close()
+
+
+def test_relay_streams_chunks_as_they_arrive():
+    """测试事件逐个转发, 而不是等上游全部发完"""
+
+    async def run():
+        async with FakeSseServer(events=5, interval=0.1) as base_url:
+            proxy = DifyStreamProxy(base_url)
+            upstream = await proxy.open(DifyAppMode.CHAT, "app-key", {"query": "hi", "user": "u"})
+            relay = StreamRelay(upstream)
+            started = time.perf_counter()
+            arrivals = []
+            async for chunk in relay:
+                arrivals.append((time.perf_counter() - started, chunk))
+            await relay.aclose()
+            await proxy.close()
+        assert relay.outcome == "completed"
+        assert [json.loads(c[6:])["answer"] for _, c in arrivals] == ["0", "1", "2", "3", "4"]
+        # 第一个事件在上游发完之前就已转发
+        assert arrivals[0][0] < 0.2 < arrivals[-1][0]
+
+    asyncio.run(run())
+
+
+def test_upstream_error_is_raised_before_streaming():
+    """测试上游错误状态码在开始转发前抛出"""
+
+    async def run():
+        async with FakeSseServer(status=400) as base_url:
+            proxy = DifyStreamProxy(base_url)
+            with pytest.raises(DifyUpstreamError) as e:
+                await proxy.open(DifyAppMode.WORKFLOW, "app-key", {"inputs": {}, "user": "u"})
+            await proxy.close()
+        assert e.value.status_code == 400
+        assert str(e.value) == "bad request"
+
+    asyncio.run(run())
+
+
+def test_client_disconnect_closes_upstream():
+    """测试客户端读到两个事件后断开时, 停止读取并关闭上游连接"""
+
+    async def run():
+        server = FakeSseServer(events=100, interval=0.02)
+        async with server as base_url:
+            proxy = DifyStreamProxy(base_url)
+            upstream = await proxy.open(DifyAppMode.AGENT_CHAT, "app-key", {"query": "hi", "user": "u"})
+            relay = StreamRelay(upstream)
+            received = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.body" and message.get("body"):
+                    received.append(message["body"])
+                    if len(received) == 2:
+                        disconnected.set()
+
+            scope = {"type": "http", "asgi": {"spec_version": "2.3"}}
+            await RelayResponse(relay)(scope, receive, send)
+            await asyncio.wait_for(server.disconnected.wait(), 5)
+            await proxy.close()
+        assert relay.outcome == "cancelled"
+        assert len(received) == 2
+        assert server.sent < 100
+        assert server.requests[0][0].startswith("POST /v1/chat-messages")
+        assert server.requests[0][1]["response_mode"] == "streaming"
+
+    asyncio.run(run())
+
+
+def test_rejected_key_is_refreshed_and_retried_once(monkeypatch):
+    """上游返回 401 时刷新密钥并重试一次; 刷新后仍被拒绝时返回 502"""
+
+    class FakeKeyManager:
+        def __init__(self, fresh):
+            self.fresh = fresh
+            self.refreshed = []
+
+        async def resolve(self, app_id):
+            return "old-key"
+
+        async def refresh(self, app_id, rejected=None):
+            self.refreshed.append((app_id, rejected))
+            return self.fresh
+
+    async def app_mode(app_id):
+        return DifyAppMode.CHAT
+
+    async def run():
+        server = FakeSseServer(events=1, interval=0, rejected_keys=["old-key", "also-rejected"])
+        async with server as base_url:
+            # 测试服务每个连接只处理一个请求, 不复用连接
+            proxy = DifyStreamProxy(base_url, max_keepalive=0)
+            monkeypatch.setattr(routes_module, "dify_proxy", proxy)
+            monkeypatch.setattr(routes_module, "_app_mode", app_mode)
+            body = routes_module.DifyRunRequest(query="hi")
+
+            keys = FakeKeyManager("new-key")
+            monkeypatch.setattr(routes_module, "dify_key_manager", keys)
+            response = await routes_module.run_app("a1", body, claims={"sub": "1"})
+            chunks = [chunk async for chunk in response.relay]
+            await response.relay.aclose()
+            assert keys.refreshed == [("a1", "old-key")]
+            assert json.loads(chunks[0][6:])["answer"] == "0"
+
+            keys = FakeKeyManager("also-rejected")
+            monkeypatch.setattr(routes_module, "dify_key_manager", keys)
+            with pytest.raises(HTTPException) as e:
+                await routes_module.run_app("a1", body, claims={"sub": "1"})
+            assert e.value.status_code == 502
+            assert len(keys.refreshed) == 1
+            await proxy.close()
+        assert len(server.requests) == 4
+
+    asyncio.run(run())
+
+
+def test_key_refresh_skips_fetch_when_rejected_key_already_replaced():
+    """被拒绝的密钥已被其他请求换掉时直接使用新密钥, 不重复获取"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from .keys import DifyKeyManager
+
+    fetched = []
+
+    async def fetch(app_id):
+        fetched.append(app_id)
+        return "new-key"
+
+    async def run():
+        manager = DifyKeyManager(fakeredis.FakeAsyncRedis(decode_responses=True), fetch=fetch, session_factory=None)
+        manager._keys["a1"] = "current-key"
+        assert await manager.refresh("a1", rejected="old-key") == "current-key"
+        assert fetched == []
+
+    asyncio.run(run())
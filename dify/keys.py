@@ -0,0 +1,354 @@
+"""
+Dify 应用 API 密钥管理
+"""
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+import redis
+from sqlmodel import select
+
+from common.configs import settings
+from common.leader import LeaderLock
+from common.log import logger
+from common.redis import async_redis_client
+from common.wheel import TimingWheel
+from db.models import DifyApp
+from db.session import get_session_factory
+
+# 应用ID -> 可用的 API 密钥, 没有时返回 None
+KeyFetcher = Callable[[str], Awaitable[Optional[str]]]
+
+
+class DifyKeyNotFoundError(Exception):
+    """应用没有可用的 API 密钥"""
+
+
+class DifyConsoleClient:
+    """Dify 控制台接口客户端, 用于查询和创建应用的 API 密钥
+
+    控制台访问令牌在首次调用时登录获取, 返回 401 时重新登录一次.
+
+    Args:
+        base_url: Dify 地址, 例如 ``https://dify.example.com``
+        email: 控制台账号
+        password: 控制台密码
+        timeout: 请求超时(秒)
+    """
+
+    def __init__(self, base_url: str, email: str, password: str, timeout: float = 10.0):
+        self.email = email
+        self.password = password
+        self._http = httpx.AsyncClient(base_url=f"{base_url.rstrip('/')}/console/api", timeout=timeout)
+        self._access_token: Optional[str] = None
+        self._login_lock = asyncio.Lock()
+
+    async def fetch_api_key(self, app_id: str) -> Optional[str]:
+        """
+        获取应用的 API 密钥: 取最早创建的一个, 没有时创建
+
+        Args:
+            app_id: 应用ID
+
+        Returns:
+            API 密钥
+        """
+        keys = (await self._request("GET", f"/apps/{app_id}/api-keys")).get("data") or []
+        if keys:
+            return min(keys, key=lambda k: k.get("created_at") or 0)["token"]
+        return (await self._request("POST", f"/apps/{app_id}/api-keys")).get("token")
+
+    async def close(self) -> None:
+        """关闭连接"""
+        await self._http.aclose()
+
+    async def _request(self, method: str, path: str) -> dict:
+        token = await self._login()
+        response = await self._http.request(method, path, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code == 401:
+            token = await self._login(expired=token)
+            response = await self._http.request(method, path, headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+        return response.json()
+
+    async def _login(self, expired: Optional[str] = None) -> str:
+        async with self._login_lock:
+            # 并发请求同时遇到 401 时只重新登录一次
+            if self._access_token is None or self._access_token == expired:
+                response = await self._http.post(
+                    "/login", json={"email": self.email, "password": self.password, "remember_me": True}
+                )
+                response.raise_for_status()
+                self._access_token = response.json()["data"]["access_token"]
+            return self._access_token
+
+
+class DifyKeyManager:
+    """Dify 应用 API 密钥的本地映射
+
+    所有 worker 在内存中保存 应用ID -> API 密钥 的字典, 聊天请求通过 ``get`` 取密钥只是
+    一次字典查找, 不访问数据库或 Redis. 字典启动时从 Redis 哈希 ``<prefix>`` 加载,
+    之后通过频道 ``<prefix>:updates`` 接收更新; 订阅断开重连后重新加载全部密钥.
+
+    刷新只在 leader worker 上进行(见 ``LeaderLock``): 每个密钥自上次获取起 ``ttl`` 秒
+    内视为有效, 在到期前 ``refresh_ahead`` 秒由时间轮触发重新获取, 写入 Redis 和
+    ``DifyApp.api_key`` 并广播. 获取失败时保留旧密钥, ``retry_interval`` 秒后重试.
+    leader 每 ``sync_interval`` 秒从数据库同步一次应用列表, 新应用先使用数据库中的
+    密钥, 随后立即刷新; 已删除的应用从映射中移除.
+
+    Args:
+        client: 异步 Redis 客户端
+        fetch: 获取密钥的函数, 为空时只同步数据库中已有的密钥
+        session_factory: 返回数据库会话工厂的函数
+        ttl: 密钥视为有效的时间(秒)
+        refresh_ahead: 提前刷新的时间(秒)
+        sync_interval: 同步应用列表的间隔(秒)
+        retry_interval: 获取失败后重试的间隔(秒)
+        tick: 时间轮的精度(秒)
+        leader_ttl: leader 锁的存活时间(秒)
+        prefix: Redis 键前缀
+    """
+
+    def __init__(
+        self,
+        client,
+        fetch: Optional[KeyFetcher] = None,
+        session_factory: Callable = get_session_factory,
+        ttl: float = 3600.0,
+        refresh_ahead: float = 300.0,
+        sync_interval: float = 300.0,
+        retry_interval: float = 30.0,
+        tick: float = 1.0,
+        leader_ttl: float = 30.0,
+        prefix: str = "dify:keys",
+    ):
+        self.client = client
+        self.fetch = fetch
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.sync_interval = sync_interval
+        self.retry_interval = retry_interval
+        self.tick = tick
+        self.key = prefix
+        self.channel = f"{prefix}:updates"
+        self.leader = LeaderLock(client, prefix, ttl=leader_ttl)
+        self._keys: Dict[str, str] = {}
+        self._refresh_locks: Dict[str, asyncio.Lock] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, app_id: str) -> Optional[str]:
+        """
+        本地查找应用的 API 密钥
+
+        Args:
+            app_id: 应用ID
+
+        Returns:
+            API 密钥, 没有时返回 None
+        """
+        return self._keys.get(app_id)
+
+    async def resolve(self, app_id: str) -> str:
+        """
+        获取应用的 API 密钥, 本地没有时依次查找 Redis 和数据库
+
+        只有映射尚未加载或应用刚刚创建时才会走到后两步.
+
+        Args:
+            app_id: 应用ID
+
+        Returns:
+            API 密钥
+
+        Raises:
+            DifyKeyNotFoundError: 应用没有可用的密钥
+        """
+        api_key = self._keys.get(app_id)
+        if api_key is not None:
+            return api_key
+        try:
+            entry = await self.client.hget(self.key, app_id)
+        except redis.RedisError as e:
+            logger.warning(f"读取 Dify 密钥失败 {app_id}: {e}")
+            entry = None
+        if entry is not None:
+            api_key = json.loads(entry)["api_key"]
+        else:
+            async with self.session_factory()() as session:
+                api_key = (await session.exec(select(DifyApp.api_key).where(DifyApp.id == app_id))).first()
+        if not api_key:
+            raise DifyKeyNotFoundError(f"No API key for Dify app {app_id}")
+        self._keys[app_id] = api_key
+        return api_key
+
+    def start(self) -> None:
+        """订阅更新并参与 leader 竞争(已启动时忽略)"""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.leader.run(self._run))
+
+    async def stop(self) -> None:
+        """停止订阅和刷新, 释放 leader 锁"""
+        for task in (self._task, self._listener):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = self._listener = None
+
+    async def load(self) -> None:
+        """从 Redis 加载全部密钥, 替换本地映射"""
+        entries = await self.client.hgetall(self.key)
+        self._keys = {app_id: json.loads(entry)["api_key"] for app_id, entry in entries.items()}
+
+    async def refresh(self, app_id: str, rejected: Optional[str] = None) -> Optional[str]:
+        """
+        重新获取应用的密钥, 保存并广播
+
+        同一个应用的刷新在本 worker 内依次进行. 传入 ``rejected`` 时(上游拒绝了该密钥),
+        如果本地密钥已经被其他请求或广播换掉, 直接返回新密钥, 不再重复获取.
+
+        Args:
+            app_id: 应用ID
+            rejected: 被上游拒绝的密钥
+
+        Returns:
+            新的密钥, 获取失败时返回 None
+        """
+        async with self._refresh_locks.setdefault(app_id, asyncio.Lock()):
+            current = self._keys.get(app_id)
+            if rejected is not None and current is not None and current != rejected:
+                return current
+            return await self._refresh(app_id)
+
+    async def _refresh(self, app_id: str) -> Optional[str]:
+        if self.fetch is None:
+            logger.warning(f"没有配置 Dify 密钥获取方式, 无法刷新应用 {app_id} 的密钥")
+            return None
+        try:
+            api_key = await self.fetch(app_id)
+            if not api_key:
+                logger.warning(f"Dify 应用 {app_id} 没有可用的密钥")
+                return None
+            await self._publish({app_id: api_key}, time.time() + self.ttl)
+            if api_key != self._keys.get(app_id):
+                async with self.session_factory()() as session:
+                    app = await session.get(DifyApp, app_id)
+                    if app is not None and app.api_key != api_key:
+                        app.api_key = api_key
+                        await session.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"刷新 Dify 应用 {app_id} 的密钥失败: {e}")
+            return None
+        self._keys[app_id] = api_key
+        return api_key
+
+    async def _run(self) -> None:
+        """leader 上的主循环"""
+        wheel = TimingWheel(self.tick, start=time.time())
+        next_sync = 0.0
+        while True:
+            now = time.time()
+            if now >= next_sync:
+                try:
+                    await self._sync(wheel, now)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"同步 Dify 应用列表失败: {e}")
+                next_sync = now + self.sync_interval
+
+            for app_id, _, _ in wheel.advance(now):
+                refreshed = await self.refresh(app_id)
+                delay = self.ttl - self.refresh_ahead if refreshed else self.retry_interval
+                wheel.add(app_id, time.time() + delay)
+            await asyncio.sleep(self.tick)
+
+    async def _sync(self, wheel: TimingWheel, now: float) -> None:
+        """对比数据库中的应用和 Redis 中的密钥, 安排刷新"""
+        async with self.session_factory()() as session:
+            apps = dict((await session.exec(select(DifyApp.id, DifyApp.api_key))).all())
+        entries = {app_id: json.loads(entry) for app_id, entry in (await self.client.hgetall(self.key)).items()}
+
+        removed = [app_id for app_id in entries if app_id not in apps]
+        if removed:
+            await self._publish({app_id: None for app_id in removed}, now)
+        for app_id in removed:
+            self._keys.pop(app_id, None)
+            wheel.discard(app_id)
+
+        # 新应用先用数据库中的密钥顶上, 到期时间设为现在, 随后立即刷新
+        seeded = {app_id: api_key for app_id, api_key in apps.items() if app_id not in entries and api_key}
+        if seeded:
+            await self._publish(seeded, now)
+            self._keys.update(seeded)
+
+        if self.fetch is None:
+            return
+        for app_id in apps:
+            if app_id not in wheel:
+                expires_at = entries[app_id]["expires_at"] if app_id in entries else now
+                wheel.add(app_id, expires_at - self.refresh_ahead)
+
+    async def _publish(self, keys: Dict[str, Optional[str]], expires_at: float) -> None:
+        """写入 Redis 并通知所有 worker; 值为 None 表示删除"""
+        message = json.dumps(keys)
+        async with self.client.pipeline(transaction=True) as pipe:
+            removed = [app_id for app_id, api_key in keys.items() if api_key is None]
+            if removed:
+                pipe.hdel(self.key, *removed)
+            mapping = {
+                app_id: json.dumps({"api_key": api_key, "expires_at": expires_at})
+                for app_id, api_key in keys.items()
+                if api_key is not None
+            }
+            if mapping:
+                pipe.hset(self.key, mapping=mapping)
+            pipe.publish(self.channel, message)
+            await pipe.execute()
+
+    async def _listen(self) -> None:
+        """订阅更新, 断线后重连并重新加载"""
+        while True:
+            try:
+                async with self.client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # 订阅之后再加载, 期间的更新不会丢失
+                    await self.load()
+                    async for message in pubsub.listen():
+                        for app_id, api_key in json.loads(message["data"]).items():
+                            if api_key is None:
+                                self._keys.pop(app_id, None)
+                            else:
+                                self._keys[app_id] = api_key
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Dify 密钥更新订阅中断: {e}")
+                await asyncio.sleep(1)
+
+
+# 未配置 Dify 地址时不刷新, 只同步数据库中已有的密钥
+dify_console = (
+    DifyConsoleClient(settings.dify_base_url, settings.dify_console_email, settings.dify_console_password)
+    if settings.dify_base_url
+    else None
+)
+
+dify_key_manager = DifyKeyManager(
+    async_redis_client,
+    fetch=dify_console.fetch_api_key if dify_console else None,
+    ttl=settings.dify_key_ttl,
+    refresh_ahead=settings.dify_key_refresh_ahead,
+    sync_interval=settings.dify_key_sync_interval,
+    retry_interval=settings.dify_key_retry_interval,
+)
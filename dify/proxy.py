@@ -0,0 +1,249 @@
+"""
+Dify 应用流式响应代理
+"""
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from common.configs import settings
+from common.log import logger
+from db.models import DifyAppMode
+
+# 应用模式 -> 服务接口
+_ENDPOINTS = {
+    DifyAppMode.CHAT: "/chat-messages",
+    DifyAppMode.AGENT_CHAT: "/chat-messages",
+    DifyAppMode.COMPLETION: "/completion-messages",
+    DifyAppMode.WORKFLOW: "/workflows/run",
+}
+
+
+class DifyUpstreamError(Exception):
+    """Dify 返回错误或无法连接
+
+    Args:
+        status_code: 返回给客户端的状态码
+        message: 错误信息
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class DifyUnauthorizedError(DifyUpstreamError):
+    """Dify 拒绝了应用的 API 密钥(已吊销或已轮换), 重新获取密钥后可以重试"""
+
+    def __init__(self, message: str):
+        super().__init__(502, message)
+
+
+class StreamRelay:
+    """把上游的 SSE 响应逐块转发给客户端
+
+    作为 ``StreamingResponse`` 的内容使用: 每取一块才从上游读下一块, 客户端读得慢时
+    上游连接随之停止读取(背压), 中间没有缓冲队列. 客户端断开时 Starlette 取消迭代.
+    结束后由 ``RelayResponse`` 调用 ``aclose`` 关闭上游连接并记录一条汇总日志,
+    逐块转发的过程中不写日志.
+
+    Args:
+        upstream: 以流式方式打开的上游响应
+        log: 汇总日志使用的 logger
+        context: 附加到汇总日志中的字段
+    """
+
+    def __init__(self, upstream: httpx.Response, log=logger, context: Optional[Dict[str, Any]] = None):
+        self.upstream = upstream
+        self.log = log
+        self.context = context or {}
+        self.started = time.perf_counter()
+        self.first_chunk: Optional[float] = None
+        self.chunks = 0
+        self.bytes = 0
+        # 迭代没有正常结束(客户端断开)时保持为 cancelled
+        self.outcome = "cancelled"
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.upstream.aiter_raw():
+                if self.first_chunk is None:
+                    self.first_chunk = time.perf_counter()
+                self.chunks += 1
+                self.bytes += len(chunk)
+                yield chunk
+            self.outcome = "completed"
+        except httpx.HTTPError as e:
+            # 响应头已经发出, 只能以 SSE 事件的形式告知客户端
+            self.outcome = f"upstream error: {type(e).__name__}"
+            event = {"event": "error", "status": 502, "code": "upstream_error", "message": str(e) or type(e).__name__}
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+
+    async def aclose(self) -> None:
+        """关闭上游连接并记录汇总日志, 可重复调用"""
+        if self._closed:
+            return
+        self._closed = True
+        await self.upstream.aclose()
+        elapsed = time.perf_counter() - self.started
+        first = (self.first_chunk - self.started) * 1000 if self.first_chunk is not None else None
+        self.log.info(
+            json.dumps(
+                {
+                    **self.context,
+                    "outcome": self.outcome,
+                    "chunks": self.chunks,
+                    "bytes": self.bytes,
+                    "first_chunk_ms": None if first is None else round(first, 1),
+                    "duration_ms": round(elapsed * 1000, 1),
+                },
+                ensure_ascii=False,
+            )
+        )
+
+
+class RelayResponse(StreamingResponse):
+    """转发上游 SSE 的响应, 无论正常结束、客户端断开还是出错都会关闭上游连接
+
+    Args:
+        relay: 转发器
+    """
+
+    def __init__(self, relay: StreamRelay):
+        super().__init__(
+            relay,
+            media_type="text/event-stream",
+            # 禁止反向代理缓冲和缓存
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        self.relay = relay
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.relay.aclose()
+
+
+class DifyStreamProxy:
+    """Dify 服务接口的流式代理
+
+    本 worker 内所有请求共用一个 ``httpx.AsyncClient``, 连接保持长连接复用, 同时打开的
+    上游连接不超过 ``max_connections``, 连接池满时等待 ``pool_timeout`` 秒后返回 503.
+    ``read_timeout`` 是两块数据之间的最长等待时间, 不限制整个流的时长.
+
+    Args:
+        base_url: Dify 服务接口地址, 例如 ``https://dify.example.com/v1``
+        max_connections: 最大上游连接数
+        max_keepalive: 最多保留的空闲连接数
+        keepalive_expiry: 空闲连接保留时间(秒)
+        connect_timeout: 建立连接超时(秒)
+        read_timeout: 读取超时(秒)
+        pool_timeout: 等待空闲连接的超时(秒)
+        transport: 自定义传输层, 用于测试
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        pool_timeout: float = 5.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(connect_timeout, read=read_timeout, pool=pool_timeout)
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的上游客户端, 首次使用时创建"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self.limits,
+                timeout=self.timeout,
+                transport=self.transport,
+                # 原样转发字节, 不让上游压缩
+                headers={"Accept-Encoding": "identity"},
+            )
+        return self._client
+
+    async def open(self, mode: DifyAppMode, api_key: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        以流式方式调用应用, 返回已收到响应头的上游响应
+
+        调用方负责关闭返回的响应(通常交给 ``StreamRelay``).
+
+        Args:
+            mode: 应用模式
+            api_key: 应用的 API 密钥
+            payload: 请求体, ``response_mode`` 会被设置为 streaming
+
+        Returns:
+            上游响应, 响应体尚未读取
+
+        Raises:
+            DifyUnauthorizedError: 上游拒绝了 API 密钥
+            DifyUpstreamError: 上游返回其他错误状态码、连接失败或超时
+        """
+        request = self.client.build_request(
+            "POST",
+            _ENDPOINTS[mode],
+            json={**payload, "response_mode": "streaming"},
+            headers={"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"},
+        )
+        try:
+            response = await self.client.send(request, stream=True)
+        except httpx.PoolTimeout:
+            raise DifyUpstreamError(503, "Too many concurrent Dify requests")
+        except httpx.TimeoutException as e:
+            raise DifyUpstreamError(504, f"Dify timed out: {type(e).__name__}")
+        except httpx.HTTPError as e:
+            raise DifyUpstreamError(502, f"Dify unavailable: {type(e).__name__}")
+
+        if response.status_code >= 400:
+            try:
+                body = await response.aread()
+            finally:
+                await response.aclose()
+            try:
+                message = json.loads(body).get("message") or body.decode(errors="replace")
+            except (ValueError, AttributeError):
+                message = body.decode(errors="replace")
+            if response.status_code == 401:
+                raise DifyUnauthorizedError(message)
+            # 请求错误和限流原样返回, 其余视为网关错误
+            status_code = response.status_code if response.status_code in (400, 404, 429) else 502
+            raise DifyUpstreamError(status_code, message)
+        return response
+
+    async def close(self) -> None:
+        """关闭共享客户端和其中的连接"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+dify_proxy = DifyStreamProxy(
+    f"{(settings.dify_base_url or 'http://localhost').rstrip('/')}/v1",
+    max_connections=settings.dify_proxy_max_connections,
+    max_keepalive=settings.dify_proxy_max_keepalive,
+    keepalive_expiry=settings.dify_proxy_keepalive_expiry,
+    connect_timeout=settings.dify_proxy_connect_timeout,
+    read_timeout=settings.dify_proxy_read_timeout,
+    pool_timeout=settings.dify_proxy_pool_timeout,
+)
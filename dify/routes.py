@@ -0,0 +1,88 @@
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlmodel import select
+from starlette import status
+
+from common.log import agents_logger, chat_logger
+from common.lru import LRUCache
+from db.models import AssetType, DifyApp, DifyAppMode
+from db.session import get_session_factory
+from users.entitlements import require_entitlement
+from .keys import DifyKeyNotFoundError, dify_key_manager
+from .proxy import DifyUnauthorizedError, DifyUpstreamError, RelayResponse, StreamRelay, dify_proxy
+
+router = APIRouter(prefix="/dify", tags=["Dify应用"])
+
+_CHAT_MODES = (DifyAppMode.CHAT, DifyAppMode.AGENT_CHAT)
+
+# 应用模式几乎不变, 在本 worker 内缓存
+_app_modes: LRUCache[DifyAppMode] = LRUCache(maxsize=1024, ttl=300)
+
+
+class DifyRunRequest(BaseModel):
+    """调用应用请求"""
+
+    query: Optional[str] = Field(default=None, description="用户输入, 对话类应用必填")
+    inputs: Dict[str, Any] = Field(default_factory=dict, description="应用变量")
+    conversation_id: Optional[str] = Field(default=None, description="会话ID, 为空时开始新会话")
+    files: List[Dict[str, Any]] = Field(default_factory=list, description="文件列表")
+
+
+async def _app_mode(app_id: str) -> DifyAppMode:
+    mode = _app_modes.get(app_id)
+    if mode is None:
+        async with get_session_factory()() as session:
+            mode = (await session.exec(select(DifyApp.mode).where(DifyApp.id == app_id))).first()
+        if mode is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dify app not found")
+        _app_modes.set(app_id, mode)
+    return mode
+
+
+@router.post(
+    "/apps/{app_id}/messages",
+    summary="调用应用(流式)",
+    response_class=RelayResponse,
+    responses={200: {"content": {"text/event-stream": {}}, "description": "Dify 的 SSE 事件流"}},
+)
+async def run_app(
+    app_id: str,
+    body: DifyRunRequest,
+    claims: dict = Depends(require_entitlement(AssetType.APP, "app_id")),
+):
+    """按应用模式调用对话、智能体、文本生成或工作流接口, 边收边转发 SSE 事件"""
+    mode = await _app_mode(app_id)
+    user = f"user-{claims['sub']}"
+    if mode in _CHAT_MODES:
+        if not body.query:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="query is required")
+        payload = {
+            "query": body.query,
+            "inputs": body.inputs,
+            "conversation_id": body.conversation_id or "",
+            "files": body.files,
+            "user": user,
+        }
+    else:
+        payload = {"inputs": body.inputs, "files": body.files, "user": user}
+
+    try:
+        api_key = await dify_key_manager.resolve(app_id)
+        try:
+            upstream = await dify_proxy.open(mode, api_key, payload)
+        except DifyUnauthorizedError:
+            # 密钥已被吊销或轮换: 重新获取后重试一次
+            api_key = await dify_key_manager.refresh(app_id, rejected=api_key)
+            if api_key is None:
+                raise
+            upstream = await dify_proxy.open(mode, api_key, payload)
+    except DifyKeyNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except DifyUpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    log = agents_logger if mode in (DifyAppMode.AGENT_CHAT, DifyAppMode.WORKFLOW) else chat_logger
+    context = {"app_id": app_id, "mode": mode.value, "user": user, "conversation_id": body.conversation_id}
+    return RelayResponse(StreamRelay(upstream, log, context))
@@ -0,0 +1,339 @@
+"""
+生产环境启动器
+
+按容器的 CPU 配额确定 worker 数, 显式选择 uvloop/httptools(未安装时退回 asyncio/h11),
+监听参数来自 ``Settings``. 主进程绑定端口后 fork 出 worker, 各 worker 共用同一个监听
+socket; 开启预加载时主进程先导入应用再 fork, 代码和只读数据以写时复制的方式共享.
+
+信号:
+
+- ``SIGTERM``/``SIGINT``: 平滑退出, worker 处理完进行中的请求后退出
+- ``SIGHUP``: 滚动重启, 逐个启动新 worker, 新 worker 完成 lifespan 启动(含预热)后
+  再让一个旧 worker 退出, 整个过程中可用 worker 数不减少
+- worker 异常退出时自动补充
+
+预加载时新 worker 沿用主进程中已加载的代码, 部署新代码需要重启主进程(或关闭预加载).
+依赖 ``os.fork`` 和 ``signal.sigtimedwait``, 仅支持 Linux; 本地开发请直接运行 ``python main.py``.
+
+运行: python launcher.py [--check]
+"""
+import argparse
+import gc
+import math
+import os
+import select
+import signal
+import socket
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+
+from common.configs import settings
+from common.cpu import cpu_limit
+from common.log import logger
+from common.metrics import metrics_registry
+
+# 主进程处理的信号, 平时屏蔽, 由 sigtimedwait 同步取出
+_SIGNALS = {signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGQUIT, signal.SIGHUP}
+_STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGQUIT}
+
+# worker 在启动后这么短的时间内退出视为启动失败, 补充前等待, 避免快速循环 fork
+_CRASH_WINDOW = 5.0
+
+
+def worker_count(cpus: float) -> int:
+    """
+    worker 数: 配置了 ``server_workers`` 时使用配置值, 否则为 CPU 数乘以 ``server_workers_per_cpu``
+
+    Args:
+        cpus: 可用的 CPU 数
+
+    Returns:
+        worker 数, 至少为 1
+    """
+    if settings.server_workers:
+        return settings.server_workers
+    return max(1, math.ceil(cpus * settings.server_workers_per_cpu))
+
+
+def export_worker_count(workers: int) -> None:
+    """
+    把启动器实际的 worker 数写入配置和环境变量 ``WEB_CONCURRENCY``
+
+    连接池等按 ``web_concurrency`` 分配的资源据此计算; 须在导入应用和 fork 之前调用,
+    worker 继承修改后的配置.
+
+    Args:
+        workers: worker 数
+    """
+    settings.web_concurrency = workers
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+
+def _available(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def select_loop() -> str:
+    """事件循环实现: 配置为 auto 时优先 uvloop"""
+    if settings.server_loop != "auto":
+        return settings.server_loop
+    return "uvloop" if _available("uvloop") else "asyncio"
+
+
+def select_http() -> str:
+    """HTTP 解析器: 配置为 auto 时优先 httptools"""
+    if settings.server_http != "auto":
+        return settings.server_http
+    return "httptools" if _available("httptools") else "h11"
+
+
+def build_config(app: str = "main:app") -> uvicorn.Config:
+    """按 ``Settings`` 创建 uvicorn 配置"""
+    return uvicorn.Config(
+        app,
+        host=settings.server_host,
+        port=settings.server_port,
+        loop=select_loop(),
+        http=select_http(),
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keepalive_timeout,
+        limit_concurrency=settings.server_limit_concurrency,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        access_log=settings.server_access_log,
+    )
+
+
+class _Server(uvicorn.Server):
+    """lifespan 启动完成后通过管道通知主进程"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        await super().startup(sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+
+class Launcher:
+    """预 fork 的 worker 管理器
+
+    Args:
+        config: uvicorn 配置
+        workers: worker 数
+        preload: 是否在 fork 前导入应用
+        graceful_timeout: 等待 worker 平滑退出的时间(秒), 超时后强制结束
+        ready_timeout: 滚动重启时等待新 worker 启动完成的时间(秒)
+    """
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        workers: int,
+        preload: bool = True,
+        graceful_timeout: float = 30.0,
+        ready_timeout: float = 60.0,
+    ):
+        self.config = config
+        self.workers = workers
+        self.preload = preload
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        # pid -> (启动完成通知管道, 启动时间)
+        self._children: Dict[int, Tuple[int, float]] = {}
+        self._socket: Optional[socket.socket] = None
+        self._stopping = False
+        self._respawn_after = 0.0
+
+    def run(self) -> None:
+        """启动 worker 并监管, 直到收到退出信号"""
+        export_worker_count(self.workers)
+        self._socket = self.config.bind_socket()
+        if self.preload:
+            self.config.load()
+            # 把导入产生的对象移出 GC 跟踪, 避免 GC 改写引用计数破坏写时复制
+            gc.freeze()
+        signal.pthread_sigmask(signal.SIG_BLOCK, _SIGNALS)
+        # 上一次运行留下的指标快照对应的进程都已不存在
+        metrics_registry.reset()
+        self._log(
+            f"监听 {self.config.host}:{self.config.port}, {self.workers} 个 worker, "
+            f"loop={self.config.loop}, http={self.config.http}, 预加载={self.preload}"
+        )
+        for _ in range(self.workers):
+            self._spawn()
+
+        while not self._stopping:
+            info = signal.sigtimedwait(_SIGNALS, 1.0)
+            if info is None or info.si_signo == signal.SIGCHLD:
+                self._reap()
+                self._replenish()
+            elif info.si_signo == signal.SIGHUP:
+                self.rolling_restart()
+            elif info.si_signo in _STOP_SIGNALS:
+                self._stopping = True
+        self.stop()
+
+    def rolling_restart(self) -> None:
+        """逐个替换 worker; 新 worker 启动失败时中止, 保留剩余的旧 worker"""
+        self._log("滚动重启")
+        for old in list(self._children):
+            if old not in self._children:
+                continue
+            new = self._spawn()
+            if not self._wait_ready(new):
+                self._log(f"新 worker {new} 未能启动, 中止滚动重启")
+                self._terminate([new])
+                return
+            self._terminate([old])
+            if self._stop_requested():
+                return
+        self._log("滚动重启完成")
+
+    def stop(self) -> None:
+        """让所有 worker 平滑退出"""
+        self._stopping = True
+        self._log("正在退出")
+        self._terminate(list(self._children))
+        if self._socket is not None:
+            self._socket.close()
+
+    def _spawn(self) -> int:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            for fd in [ready_r, *(r for r, _ in self._children.values())]:
+                os.close(fd)
+            code = 0
+            try:
+                for signum in _SIGNALS:
+                    signal.signal(signum, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+                _Server(self.config, ready_w).run(sockets=[self._socket])
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        self._children[pid] = (ready_r, time.monotonic())
+        return pid
+
+    def _wait_ready(self, pid: int) -> bool:
+        """等待 worker 完成启动; 期间退出或超时返回 False"""
+        ready_r, _ = self._children[pid]
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([ready_r], [], [], 0.5)
+            if readable:
+                return os.read(ready_r, 1) == b"1"
+            if self._reap(pid) or self._stop_requested():
+                return False
+        return False
+
+    def _terminate(self, pids: List[int]) -> None:
+        """发送 SIGTERM, 超时后 SIGKILL, 并等待退出"""
+        for pid in pids:
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while any(pid in self._children for pid in pids):
+            if time.monotonic() >= deadline:
+                for pid in pids:
+                    if pid in self._children:
+                        self._log(f"worker {pid} 未在 {self.graceful_timeout} 秒内退出, 强制结束")
+                        self._kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            signal.sigtimedwait({signal.SIGCHLD}, 0.2)
+            self._reap()
+
+    def _reap(self, watch: Optional[int] = None) -> bool:
+        """回收已退出的 worker, 返回 ``watch`` 是否已退出"""
+        exited = False
+        reaped = False
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            ready_r, started = self._children.pop(pid, (None, 0.0))
+            if ready_r is None:
+                continue
+            os.close(ready_r)
+            reaped = True
+            exited = exited or pid == watch
+            if not self._stopping:
+                uptime = time.monotonic() - started
+                code = os.waitstatus_to_exitcode(status)
+                self._log(f"worker {pid} 退出, 退出码 {code}, 运行 {uptime:.1f} 秒")
+                if uptime < _CRASH_WINDOW:
+                    self._respawn_after = time.monotonic() + _CRASH_WINDOW
+        if reaped:
+            self._compact_metrics()
+        return exited
+
+    def _compact_metrics(self) -> None:
+        try:
+            metrics_registry.compact()
+        except OSError as e:
+            self._log(f"合并已退出 worker 的指标失败: {e}")
+
+    def _replenish(self) -> None:
+        if self._stopping or time.monotonic() < self._respawn_after:
+            return
+        while len(self._children) < self.workers:
+            self._spawn()
+
+    def _stop_requested(self) -> bool:
+        if signal.sigpending() & _STOP_SIGNALS:
+            self._stopping = True
+        return self._stopping
+
+    @staticmethod
+    def _kill(pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _log(message: str) -> None:
+        logger.info(f"[launcher {os.getpid()}] {message}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="生产环境启动器")
+    parser.add_argument("--check", action="store_true", help="只打印计算出的启动参数")
+    args = parser.parse_args()
+
+    cpus = cpu_limit()
+    workers = worker_count(cpus)
+    config = build_config()
+    if args.check:
+        print(
+            f"cpus={cpus:g} workers={workers} loop={config.loop} http={config.http} "
+            f"backlog={config.backlog} keepalive={config.timeout_keep_alive} "
+            f"limit_concurrency={config.limit_concurrency} preload={settings.server_preload}"
+        )
+        return
+    Launcher(
+        config,
+        workers,
+        preload=settings.server_preload,
+        graceful_timeout=settings.server_graceful_timeout,
+        ready_timeout=settings.server_ready_timeout,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
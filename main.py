@@ -1,79 +1,137 @@
+import asyncio
+
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from starlette import status
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse
 from contextlib import asynccontextmanager
 
+import catalog
 import common
-from common import ResponsePayloads, Error
+import courses
+import db
+import dify
+import orders
+import users
+from common import ResponsePayloads, Error, default_password_encoder, ping_redis, response_cache, settings
+from common.etag import ETagMiddleware
+from common.lifecycle import run_shutdown, run_warm_up
+from common.log import configure_logger, shutdown_logger
+from common.metrics import MetricsMiddleware, metrics_endpoint, metrics_registry, record_exception
+from common.redis import close_async_redis
+from common.responses import PayloadResponse, error_response
+
+
+async def _warm_redis():
+    if not await ping_redis():
+        raise ConnectionError("Redis 不可用")
+
+
+async def _check_sms():
+    # 短信通道缺少 SDK 或配置时在启动日志中暴露, 而不是等到第一条验证码
+    common.sms_service.transport.check()
+
+
+async def _warm_indexes():
+    async with db.get_session_factory()() as session:
+        await catalog.refresh_indexes(session)
 
 
-# @asynccontextmanager
-# async def lifespan(app: FastAPI):
-#     # 启动时执行
-#     dify.TokenManager.start_scheduler()
-#     yield
-#     # 关闭时执行（可留空）
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时执行: 配置日志、建立连接池并预热, 完成之前 worker 不会接收请求
+    configure_logger()
+    if settings.warmup_enabled:
+        await run_warm_up(
+            app,
+            {
+                "redis": _warm_redis,
+                "database": db.warm_up,
+                "replicas": db.warm_up_replicas,
+                "indexes": _warm_indexes,
+                "sms": _check_sms,
+            },
+            paths=settings.warmup_paths,
+            timeout=settings.warmup_timeout,
+        )
+    # 每个 worker 订阅密钥更新, 只有 leader 刷新
+    dify.dify_key_manager.start()
+    # 每个 worker 都参与竞争, 只有 leader 执行到期扫描
+    users.expiry_sweeper.start()
+    # 接管上次部署或崩溃时留在队列和处理中集合里的支付通知
+    orders.payment_notify_ingest.start()
+    yield
+    # 关闭时执行: 先停止后台任务, 再关闭它们使用的连接
+    await run_shutdown(
+        {
+            "expiry_sweeper": users.expiry_sweeper.stop,
+            "dify_key_manager": dify.dify_key_manager.stop,
+            "dify_console": dify.dify_console.close if dify.dify_console else lambda: None,
+            "dify_proxy": dify.dify_proxy.close,
+            "payment_notify_ingest": orders.payment_notify_ingest.stop,
+            "sms_service": common.sms_service.stop,
+            "entitlement_service": users.entitlement_service.close,
+            "response_cache": response_cache.close,
+            "metrics": metrics_registry.close,
+            "redis": close_async_redis,
+            "replicas": db.dispose_replicas,
+            "database": db.dispose_engine,
+            "password_encoder": lambda: default_password_encoder.shutdown(wait=False),
+            "logger": lambda: asyncio.to_thread(shutdown_logger),
+        }
+    )
 
 
 app = FastAPI(
-    # lifespan=lifespan,  # 添加生命周期管理
+    lifespan=lifespan,  # 添加生命周期管理
     title="AI智元API文档",
     description="包含课程和智能体",
     version="1.0.0",
     servers=[{"url": "http://localhost:8000", "description": "本地开发环境"}],
+    default_response_class=PayloadResponse,
 )
 
 
 @app.exception_handler(Exception)
 async def api_exception_handler(request: Request, exc):
     """处理自定义API异常"""
-    return JSONResponse(
+    record_exception(exc)
+    return PayloadResponse(
         status_code=500,
         content=ResponsePayloads(
             error=Error(type=type(exc).__name__, message=str(exc), code=500)
-        ).model_dump(),
+        ),
     )
 
 
 # 1. 自定义未授权异常处理器
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
+    # 保留 WWW-Authenticate、Retry-After 等响应头
     if exc.status_code == status.HTTP_401_UNAUTHORIZED:
-        return JSONResponse(
-            status_code=exc.status_code,
-            content=ResponsePayloads(
-                data=None,
-                error=Error(type="Unauthorized", message=exc.detail, code=exc.status_code),
-            ).model_dump(),
-        )
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=ResponsePayloads(
-            data=None,
-            error=Error(type="HTTPException", message=exc.detail, code=exc.status_code),
-        ).model_dump(),
-    )
+        return error_response(exc.status_code, "Unauthorized", exc.detail, exc.headers)
+    if exc.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+        return error_response(exc.status_code, "TooManyRequests", exc.detail, exc.headers)
+    return error_response(exc.status_code, "HTTPException", exc.detail, exc.headers)
 
 
 @app.exception_handler(StarletteHTTPException)
 async def not_found_exception_handler(request: Request, exc: StarletteHTTPException):
     """处理404等HTTP异常"""
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=ResponsePayloads(
-            error=Error(
-                type="NotFound" if exc.status_code == 404 else type(exc).__name__,
-                message=str(exc.detail),
-                code=exc.status_code,
-            )
-        ).model_dump(),
+    return error_response(
+        exc.status_code,
+        "NotFound" if exc.status_code == 404 else type(exc).__name__,
+        str(exc.detail),
+        exc.headers,
     )
 
 
+app.add_middleware(ETagMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 # app.add_middleware(
 #     CORSMiddleware,
 #     allow_origins=["http://localhost:1420", "https://return.cruldra.cn"],
@@ -86,9 +144,11 @@ async def not_found_exception_handler(request: Request, exc: StarletteHTTPExcept
 
 # app.include_router(users.router)
 # app.include_router(orders.router)
-# app.include_router(dify.router)
-# app.include_router(courses.router)
-# app.include_router(common.router)
+app.include_router(dify.router)
+app.include_router(courses.router)
+app.include_router(catalog.router)
+app.include_router(common.router)
 
 if __name__ == "__main__":
+    metrics_registry.reset()
     uvicorn.run(app, host="0.0.0.0")
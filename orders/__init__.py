@@ -0,0 +1,7 @@
+from .notify import PaymentNotification, PaymentNotifyIngest, payment_notify_ingest
+
+__all__ = [
+    "PaymentNotification",
+    "PaymentNotifyIngest",
+    "payment_notify_ingest",
+]
@@ -0,0 +1,149 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.compiler import compiles
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.models import AssetType, Course, Order, OrderStatus, PaymentMethod, User, UserAsset
+from db.session import create_engine
+from .notify import PaymentNotification, PaymentNotifyIngest
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb(element, compiler, **kw):
+    return "JSON"
+
+
+def _order(order_id: str, asset_id: str, **item) -> dict:
+    item = {"asset_type": "course", "asset_id": asset_id, "quantity": 1, "unit_price": "10", **item}
+    return dict(
+        id=order_id,
+        user_id=1,
+        amount=10.0,
+        status=OrderStatus.PENDING,
+        payment_method=PaymentMethod.ALIPAY,
+        items=[item],
+        created_at=datetime.now(),
+        updated_at=datetime.now(),
+    )
+
+
+def test_payment_notify_dedupe_fallback_and_dead_letter(tmp_path):
+    """重复通知只入队一次; 整批失败时逐条处理, 坏通知重新投递直至移入死信队列"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'orders.db'}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+                await conn.execute(insert(User.__table__).values(id=1, username="u"))
+                await conn.execute(insert(Course.__table__).values(id=1, title="Python"))
+                await conn.execute(insert(Order.__table__), [_order("o1", "1"), _order("o2", "2")])
+
+            factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            client = fakeredis.FakeAsyncRedis(decode_responses=True)
+            ingest = PaymentNotifyIngest(
+                client, session_factory=lambda: factory, visibility_timeout=0, max_attempts=2
+            )
+            # 由测试驱动处理, 不启动后台任务
+            ingest.start = lambda: None
+            grant_assets = ingest._grant_assets
+
+            async def failing_grant(session, orders):
+                # 模拟订单 o2 入库时数据库报错
+                if any(order.id == "o2" for order in orders):
+                    raise RuntimeError("database error")
+                await grant_assets(session, orders)
+
+            ingest._grant_assets = failing_grant
+
+            first, second = (
+                PaymentNotification(order_id=o, payment_method=PaymentMethod.ALIPAY, trade_no=f"t-{o}", amount=10.0)
+                for o in ("o1", "o2")
+            )
+            assert await ingest.accept(first)
+            assert not await ingest.accept(first)
+            assert await ingest.accept(second)
+            assert await client.llen(ingest.queue_key) == 2
+
+            # 整批失败后逐条处理, 好的通知照常入库, 坏的通知留在处理中集合
+            assert await ingest.drain() == 2
+            assert await client.zrange(ingest.processing_key, 0, -1) == [second.model_dump_json()]
+            assert await client.hget(ingest.attempts_key, second.model_dump_json()) == "1"
+
+            # 超时后重新投递, 达到失败上限后移入死信队列
+            assert await ingest.drain() == 1
+            assert await client.zcard(ingest.processing_key) == 0
+            assert await client.hlen(ingest.attempts_key) == 0
+            assert [json.loads(m)["order_id"] for m in await client.lrange(ingest.dead_letter_key, 0, -1)] == ["o2"]
+            assert await ingest.drain() == 0
+
+            async with engine.connect() as conn:
+                statuses = dict((await conn.execute(select(Order.__table__.c.id, Order.__table__.c.status))).all())
+                assets = (await conn.execute(select(UserAsset.__table__.c.asset_id))).scalars().all()
+            assert statuses == {"o1": "PAID", "o2": "PENDING"}
+            assert assets == ["1"]
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_payment_notify_grants_expiry_and_skips_bad_items(tmp_path):
+    """限时购买从现有有效期顺延, 永久资产保持永久; 坏的订单项跳过, 订单照常置为已支付"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'orders.db'}")
+        try:
+            now = datetime.now()
+            async with engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+                await conn.execute(insert(User.__table__).values(id=1, username="u"))
+                await conn.execute(
+                    insert(UserAsset.__table__),
+                    [
+                        dict(user_id=1, asset_type=AssetType.APP, asset_id="a", asset_name="a", quantity=1,
+                             expire_at=now + timedelta(days=10)),
+                        dict(user_id=1, asset_type=AssetType.APP, asset_id="b", asset_name="b", quantity=1,
+                             expire_at=None),
+                    ],
+                )
+                await conn.execute(
+                    insert(Order.__table__),
+                    [
+                        _order("o1", "a", asset_type="app", duration_days=30),
+                        _order("o2", "b", asset_type="app", duration_days=30),
+                        _order("o3", "c", asset_type="app", duration_days=30, quantity=2),
+                        _order("o4", "not-a-course-id"),
+                    ],
+                )
+
+            factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            ingest = PaymentNotifyIngest(fakeredis.FakeAsyncRedis(decode_responses=True), session_factory=lambda: factory)
+            settled = await ingest.apply(
+                PaymentNotification(order_id=o, payment_method=PaymentMethod.ALIPAY, trade_no=f"t-{o}", amount=10.0)
+                for o in ("o1", "o2", "o3", "o4")
+            )
+            assert settled == {"o1", "o2", "o3", "o4"}
+
+            async with engine.connect() as conn:
+                statuses = set((await conn.execute(select(Order.__table__.c.status))).scalars())
+                table = UserAsset.__table__
+                expiry = dict((await conn.execute(select(table.c.asset_id, table.c.expire_at))).all())
+            assert statuses == {"PAID"}
+            assert set(expiry) == {"a", "b", "c"}
+            assert abs((expiry["a"] - now - timedelta(days=40)).total_seconds()) < 60
+            assert expiry["b"] is None
+            assert abs((expiry["c"] - now - timedelta(days=60)).total_seconds()) < 60
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
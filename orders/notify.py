@@ -0,0 +1,426 @@
+"""
+支付异步通知入库
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import case, func, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+
+from common.configs import settings
+from common.log import payment_logger
+from common.redis import async_redis_client
+from db.models import (
+    AssetType,
+    Course,
+    DifyApp,
+    Order,
+    OrderItem,
+    OrderStatus,
+    PaymentMethod,
+    UserAsset,
+)
+from db.session import get_session_factory
+
+# 首次出现的通知才入队: 去重键与入队在一次脚本中完成, 不会出现只占了键却没入队的情况
+_ENQUEUE_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[2]) then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# 先把处理超时的通知放回队列, 再取出一批移入处理中集合(分值为超时时间)
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, member in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('RPUSH', KEYS[1], member)
+end
+local claimed = {}
+for i = 1, tonumber(ARGV[2]) do
+    local member = redis.call('LPOP', KEYS[1])
+    if not member then break end
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), member)
+    claimed[i] = member
+end
+return claimed
+"""
+
+
+class PaymentNotification(BaseModel):
+    """已验签的支付成功通知"""
+
+    order_id: str
+    payment_method: PaymentMethod
+    trade_no: str
+    amount: Optional[float] = None
+    paid_at: Optional[datetime] = None
+
+
+class PaymentNotifyIngest:
+    """支付通知入库流水线
+
+    网关回调验签后调用 ``accept``: 通知按 (支付方式, 交易号) 在 Redis 中去重后写入队列,
+    随即可以应答网关, 重复推送直接丢弃. 后台任务成批取出通知, 在一个事务中把订单置为已支付,
+    并批量 upsert 订单项对应的用户资产.
+
+    取出的通知在确认前保存在处理中集合里, worker 崩溃或事务失败时, 超过
+    ``visibility_timeout`` 后会被重新投递; 状态转换本身是幂等的.
+
+    整批事务失败时逐条重试, 一条坏通知不会拖住同批的其他通知. 单条失败计入
+    尝试次数, 达到 ``max_attempts`` 后移入死信队列 ``<prefix>:dead`` 等待人工处理.
+
+    Args:
+        client: 异步 Redis 客户端
+        session_factory: 返回数据库会话工厂的函数
+        batch_size: 每个事务处理的最大通知数
+        flush_interval: 空闲时检查队列的间隔(秒)
+        visibility_timeout: 通知取出后未确认的重新投递时间(秒)
+        dedupe_ttl: 去重键存活时间(秒), 应覆盖网关的重试周期
+        max_attempts: 单条通知入库失败多少次后移入死信队列
+        prefix: Redis 键前缀
+    """
+
+    def __init__(
+        self,
+        client,
+        session_factory: Callable = get_session_factory,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        visibility_timeout: float = 60.0,
+        dedupe_ttl: int = 3 * 86400,
+        max_attempts: int = 5,
+        prefix: str = "payment:notify",
+    ):
+        self.client = client
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.visibility_timeout = visibility_timeout
+        self.dedupe_ttl = dedupe_ttl
+        self.max_attempts = max_attempts
+        self.queue_key = f"{prefix}:queue"
+        self.processing_key = f"{prefix}:processing"
+        self.attempts_key = f"{prefix}:attempts"
+        self.dead_letter_key = f"{prefix}:dead"
+        self.prefix = prefix
+        self._enqueue = client.register_script(_ENQUEUE_SCRIPT)
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def accept(self, notification: PaymentNotification) -> bool:
+        """
+        接收一条通知, 写入队列后即可应答网关
+
+        Args:
+            notification: 已验签的支付成功通知
+
+        Returns:
+            是否为首次接收, 重复推送返回 False
+        """
+        dedupe_key = f"{self.prefix}:seen:{notification.payment_method.value}:{notification.trade_no}"
+        accepted = await self._enqueue(
+            keys=[dedupe_key, self.queue_key],
+            args=[notification.model_dump_json(), self.dedupe_ttl],
+        )
+        if accepted:
+            self.start()
+            self._wakeup.set()
+        return bool(accepted)
+
+    async def drain(self) -> int:
+        """
+        取出并处理一批通知
+
+        Returns:
+            取出的通知数
+        """
+        members = await self._claim(
+            keys=[self.queue_key, self.processing_key],
+            args=[time.time(), self.batch_size, self.visibility_timeout],
+        )
+        if not members:
+            return 0
+
+        notifications: Dict[str, PaymentNotification] = {}
+        done = []
+        for member in members:
+            try:
+                notifications[member] = PaymentNotification.model_validate_json(member)
+            except ValidationError as e:
+                payment_logger.error(f"丢弃无法解析的支付通知 {member}: {e}")
+                done.append(member)
+
+        try:
+            settled = await self.apply(notifications.values())
+        except Exception as e:
+            payment_logger.warning(f"支付通知批量入库失败, 共 {len(notifications)} 条, 改为逐条处理: {e}")
+            settled, failed = await self._apply_each(notifications)
+            dead = await self._record_failures(failed)
+            done.extend(dead)
+        done.extend(m for m, n in notifications.items() if n.order_id in settled)
+
+        if done:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.zrem(self.processing_key, *done)
+                pipe.hdel(self.attempts_key, *done)
+                await pipe.execute()
+        return len(members)
+
+    async def _apply_each(self, notifications: Dict[str, PaymentNotification]) -> Tuple[Set[str], List[str]]:
+        """逐条应用通知, 返回已处理的订单ID和失败的通知"""
+        settled: Set[str] = set()
+        failed: List[str] = []
+        for member, notification in notifications.items():
+            try:
+                settled |= await self.apply([notification])
+            except Exception as e:
+                payment_logger.exception(f"支付通知入库失败, 订单 {notification.order_id}: {e}")
+                failed.append(member)
+        return settled, failed
+
+    async def _record_failures(self, members: Sequence[str]) -> List[str]:
+        """
+        累计失败次数, 达到上限的通知移入死信队列
+
+        未达上限的通知不确认, 超时后重新投递.
+
+        Returns:
+            已移入死信队列的通知
+        """
+        if not members:
+            return []
+        async with self.client.pipeline(transaction=False) as pipe:
+            for member in members:
+                pipe.hincrby(self.attempts_key, member, 1)
+            attempts = await pipe.execute()
+        dead = [m for m, n in zip(members, attempts) if n >= self.max_attempts]
+        if dead:
+            await self.client.rpush(self.dead_letter_key, *dead)
+            for member in dead:
+                payment_logger.error(f"支付通知失败 {self.max_attempts} 次, 移入死信队列: {member}")
+        return dead
+
+    async def apply(self, notifications: Iterable[PaymentNotification]) -> Set[str]:
+        """
+        在一个事务中应用一批通知
+
+        订单按主键顺序以 ``FOR UPDATE SKIP LOCKED`` 锁定, 被其他事务锁住的订单留待重新投递.
+        只有待支付的订单会被置为已支付, 其他状态视为已处理. 订单变为已支付后,
+        提交时会自动使相关用户的权益缓存失效.
+
+        Args:
+            notifications: 通知列表
+
+        Returns:
+            已处理完毕的订单ID
+        """
+        by_order = {n.order_id: n for n in notifications}
+        if not by_order:
+            return set()
+
+        settled: Set[str] = set()
+        paid: List[Order] = []
+        async with self.session_factory()() as session:
+            async with session.begin():
+                orders = (
+                    await session.exec(
+                        select(Order)
+                        .where(Order.id.in_(sorted(by_order)))
+                        .order_by(Order.id)
+                        .with_for_update(skip_locked=True)
+                    )
+                ).all()
+                locked = {order.id for order in orders}
+                missing = set(by_order) - locked
+                if missing:
+                    existing = set((await session.exec(select(Order.id).where(Order.id.in_(missing)))).all())
+                    for order_id in missing - existing:
+                        payment_logger.error(f"支付通知对应的订单不存在: {order_id}")
+                        settled.add(order_id)
+
+                for order in orders:
+                    notification = by_order[order.id]
+                    settled.add(order.id)
+                    if order.status != OrderStatus.PENDING:
+                        if order.status != OrderStatus.PAID:
+                            payment_logger.warning(
+                                f"订单 {order.id} 状态为 {order.status}, 收到支付通知 {notification.trade_no}, 需人工处理"
+                            )
+                        continue
+                    if notification.amount is not None and abs(notification.amount - order.amount) > 0.005:
+                        payment_logger.error(
+                            f"订单 {order.id} 金额不符: 订单 {order.amount}, 通知 {notification.amount}"
+                        )
+                        continue
+                    order.status = OrderStatus.PAID
+                    order.pay_time = notification.paid_at or datetime.now()
+                    order.payment_method = notification.payment_method
+                    paid.append(order)
+
+                if paid:
+                    await self._grant_assets(session, paid)
+
+        for order in paid:
+            payment_logger.info(f"订单 {order.id} 已支付, 交易号 {by_order[order.id].trade_no}")
+        return settled
+
+    @staticmethod
+    def _valid_items(order: Order) -> List[OrderItem]:
+        """
+        校验订单项, 无法授予的订单项记录日志后跳过
+
+        订单已在网关支付, 坏的订单项不能让整张订单重试直至进入死信队列, 需人工补发.
+        """
+        items = []
+        for raw in order.items or []:
+            try:
+                item = OrderItem.model_validate(raw)
+            except ValidationError as e:
+                payment_logger.error(f"订单 {order.id} 的订单项无法解析, 未授予资产, 需人工处理: {raw}: {e}")
+                continue
+            if item.asset_type == AssetType.COURSE and not item.asset_id.isdigit():
+                payment_logger.error(f"订单 {order.id} 的课程ID无效, 未授予资产, 需人工处理: {item.asset_id}")
+                continue
+            if item.quantity <= 0 or (item.duration_days is not None and item.duration_days <= 0):
+                payment_logger.error(f"订单 {order.id} 的订单项数量或有效期无效, 未授予资产, 需人工处理: {raw}")
+                continue
+            items.append(item)
+        return items
+
+    async def _grant_assets(self, session, orders: Sequence[Order]) -> None:
+        """
+        按 (用户, 资产类型, 资产ID) 汇总订单项后批量 upsert
+
+        有效期: 订单项没有 ``duration_days`` 时为永久购买, 资产置为永久有效; 否则为限时购买,
+        从现有有效期(已过期则从现在)起顺延 ``duration_days * quantity`` 天.
+        已经永久有效的资产不会因限时购买变为限时.
+        """
+        quantities: Dict[Tuple[int, AssetType, str], int] = {}
+        # 限时购买累计的有效天数, 同一资产只要有一项永久购买即为永久(None)
+        durations: Dict[Tuple[int, AssetType, str], Optional[int]] = {}
+        for order in orders:
+            for item in self._valid_items(order):
+                key = (order.user_id, item.asset_type, item.asset_id)
+                quantities[key] = quantities.get(key, 0) + item.quantity
+                if item.duration_days is None or (key in durations and durations[key] is None):
+                    durations[key] = None
+                else:
+                    durations[key] = durations.get(key, 0) + item.duration_days * item.quantity
+        if not quantities:
+            return
+
+        app_ids = {asset_id for _, t, asset_id in quantities if t == AssetType.APP}
+        course_ids = {int(asset_id) for _, t, asset_id in quantities if t == AssetType.COURSE}
+        apps = {}
+        if app_ids:
+            rows = await session.exec(select(DifyApp.id, DifyApp.name, DifyApp.mode).where(DifyApp.id.in_(app_ids)))
+            apps = {app_id: (name, mode) for app_id, name, mode in rows}
+        courses = {}
+        if course_ids:
+            rows = await session.exec(select(Course.id, Course.title).where(Course.id.in_(course_ids)))
+            courses = {str(course_id): title for course_id, title in rows}
+
+        # 限时购买从现有有效期顺延; 锁住已有的资产行, 并发授予同一资产时依次计算
+        current: Dict[Tuple[int, AssetType, str], Optional[datetime]] = {}
+        limited = [key for key, days in durations.items() if days is not None]
+        if limited:
+            rows = await session.exec(
+                select(UserAsset.user_id, UserAsset.asset_type, UserAsset.asset_id, UserAsset.expire_at)
+                .where(tuple_(UserAsset.user_id, UserAsset.asset_type, UserAsset.asset_id).in_(limited))
+                .with_for_update()
+            )
+            current = {(user_id, asset_type, asset_id): expire_at for user_id, asset_type, asset_id, expire_at in rows}
+
+        now = datetime.now()
+        values = []
+        for key, quantity in quantities.items():
+            user_id, asset_type, asset_id = key
+            if asset_type == AssetType.APP:
+                name, mode = apps.get(asset_id, (asset_id, None))
+            else:
+                name, mode = courses.get(asset_id, asset_id), None
+            expire_at = None
+            if durations[key] is not None:
+                expire_at = max(current.get(key) or now, now) + timedelta(days=durations[key])
+            values.append(
+                dict(
+                    user_id=user_id,
+                    asset_type=asset_type,
+                    app_mode=mode,
+                    asset_id=asset_id,
+                    asset_name=name,
+                    quantity=quantity,
+                    expire_at=expire_at,
+                    created_at=now,
+                    updated_at=now,
+                )
+            )
+
+        table = UserAsset.__table__
+        postgresql = session.bind.dialect.name == "postgresql"
+        insert = postgresql_insert if postgresql else sqlite_insert
+        statement = insert(table).values(values)
+        greatest = func.greatest if postgresql else func.max
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.asset_type, table.c.asset_id],
+            set_={
+                "quantity": table.c.quantity + statement.excluded.quantity,
+                # 永久购买或现有资产永久有效时为永久, 否则取较晚的有效期
+                "expire_at": case(
+                    (or_(statement.excluded.expire_at.is_(None), table.c.expire_at.is_(None)), None),
+                    else_=greatest(table.c.expire_at, statement.excluded.expire_at),
+                ),
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+        await session.exec(statement)
+
+    def start(self) -> None:
+        """启动后台处理任务(已启动时忽略)"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台处理任务, 未处理的通知留在 Redis 中"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.drain() >= self.batch_size:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                payment_logger.warning(f"读取支付通知队列失败: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+payment_notify_ingest = PaymentNotifyIngest(
+    async_redis_client,
+    batch_size=settings.payment_notify_batch_size,
+    flush_interval=settings.payment_notify_flush_interval,
+    visibility_timeout=settings.payment_notify_visibility_timeout,
+    dedupe_ttl=settings.payment_notify_dedupe_ttl,
+    max_attempts=settings.payment_notify_max_attempts,
+)
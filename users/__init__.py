@@ -0,0 +1,17 @@
+from .entitlements import (
+    EntitlementService,
+    entitlement_service,
+    invalidate_entitlements,
+    require_entitlement,
+)
+from .expiry import ExpiredRecord, ExpirySweeper, expiry_sweeper
+
+__all__ = [
+    "EntitlementService",
+    "entitlement_service",
+    "invalidate_entitlements",
+    "require_entitlement",
+    "ExpiredRecord",
+    "ExpirySweeper",
+    "expiry_sweeper",
+]
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.requests import Request
+
+from common.wheel import TimingWheel
+from db.models import AssetType, User, UserAsset
+from db.session import create_engine
+from . import expiry as expiry_module
+from .entitlements import EntitlementService, require_entitlement
+from .expiry import ASSET, ExpirySweeper
+
+
+class FakeEntitlementService(EntitlementService):
+    """用内存中的资产代替数据库查询, 可以让查询停在中途"""
+
+    def __init__(self, client, assets, **kwargs):
+        super().__init__(client, session_factory=None, **kwargs)
+        self.assets = assets
+        self.queries = 0
+        self.gate = None
+
+    async def _query(self, user_id):
+        self.queries += 1
+        snapshot = dict(self.assets.get(user_id, {}))
+        if self.gate is not None:
+            await self.gate.wait()
+        return snapshot
+
+
+def test_entitlement_invalidation_across_workers():
+    """失效后所有 worker 重新加载, 加载期间发生的失效不会被旧数据覆盖"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        server = fakeredis.FakeServer()
+        assets = {1: {("course", "7"): None}}
+        worker_a, worker_b = (
+            FakeEntitlementService(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), assets)
+            for _ in range(2)
+        )
+        try:
+            assert await worker_a.has_access(1, AssetType.COURSE, "7")
+            # 第二个 worker 直接读取 Redis 中的集合
+            assert await worker_b.has_access(1, AssetType.COURSE, 7)
+            assert worker_b.queries == 0
+            await asyncio.sleep(0.05)
+
+            # 资产被删除: 一个 worker 失效, 另一个 worker 收到通知后清理本地缓存
+            assets[1] = {}
+            await worker_a.invalidate(1)
+            await asyncio.sleep(0.05)
+            assert not await worker_b.has_access(1, AssetType.COURSE, "7")
+            assert worker_b.queries == 1
+
+            # 加载查到旧数据后、写回之前发生失效, 旧数据不能写回 Redis 和本地缓存
+            assets[1] = {("course", "8"): None}
+            await worker_a.invalidate(1)
+            worker_a.gate = asyncio.Event()
+            loading = asyncio.create_task(worker_a.get(1))
+            await asyncio.sleep(0.05)
+            assets[1] = {}
+            await worker_b.invalidate(1)
+            worker_a.gate.set()
+            assert await loading == {("course", "8"): None}
+            worker_a.gate = None
+            assert not await worker_a.client.exists("entitlements:1")
+            assert not await worker_a.has_access(1, AssetType.COURSE, "8")
+            assert await worker_a.client.hgetall("entitlements:1") == {"__built__": "1"}
+        finally:
+            await worker_a.close()
+            await worker_b.close()
+
+    asyncio.run(run())
+
+
+def test_entitlement_waiter_takes_over_cancelled_load():
+    """负责加载的请求被取消时, 等待者接手加载, 不会收到取消"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        service = FakeEntitlementService(fakeredis.FakeAsyncRedis(decode_responses=True), {1: {("course", "7"): None}})
+        service.gate = asyncio.Event()
+        try:
+            leader = asyncio.create_task(service.get(1))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(service.has_access(1, AssetType.COURSE, "7"))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            await asyncio.sleep(0.01)
+            service.gate.set()
+            assert await waiter is True
+            assert leader.cancelled()
+            assert service.queries == 2
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_require_entitlement_rejects_token_without_subject():
+    """令牌缺少用户ID时返回 401 而不是服务器错误"""
+    dependency = require_entitlement(AssetType.APP, "app_id")
+    request = Request({"type": "http", "path_params": {"app_id": "a"}})
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(dependency(request, claims={"jti": "t1"}))
+    assert e.value.status_code == 401
+
+
+def _asset(asset_id: int, expire_at: float, updated_at: float) -> dict:
+    return dict(
+        id=asset_id,
+        user_id=1,
+        asset_type=AssetType.COURSE,
+        asset_id=str(asset_id),
+        expire_at=datetime.fromtimestamp(expire_at),
+        updated_at=datetime.fromtimestamp(updated_at),
+    )
+
+
+async def _expiry_database(path):
+    engine = create_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all, tables=[User.__table__, UserAsset.__table__])
+        await conn.execute(insert(User.__table__).values(id=1, username="u"))
+    return engine, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def test_expiry_sweep_looks_back_at_changed_rows(tmp_path, monkeypatch):
+    """到期时间落在已扫描窗口内的新增或续期记录由回看加入时间轮, 已触发的不重复加入"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        monkeypatch.setattr(expiry_module, "entitlement_service", FakeEntitlementService(client, {}))
+        engine, factory = await _expiry_database(tmp_path / "expiry.db")
+        try:
+            t0 = time.time()
+            sweeper = ExpirySweeper(client, session_factory=lambda: factory, sweep_interval=60)
+            sweeper._wheel = TimingWheel(1.0, slots=512, start=t0)
+            async with engine.begin() as conn:
+                await conn.execute(insert(UserAsset.__table__).values(_asset(1, t0 + 30, t0 - 100)))
+            loaded = await sweeper.sweep(ASSET, (t0, 0), t0 + 120)
+            assert (ASSET, 1) in sweeper._wheel
+
+            # 扫描之后: 新增一个在已扫描窗口内到期的资产, 另一个续期到窗口之外
+            async with engine.begin() as conn:
+                await conn.execute(insert(UserAsset.__table__).values(_asset(2, t0 + 50, t0 + 1)))
+                await conn.execute(
+                    update(UserAsset.__table__)
+                    .where(UserAsset.id == 1)
+                    .values(expire_at=datetime.fromtimestamp(t0 + 200), updated_at=datetime.fromtimestamp(t0 + 1))
+                )
+            loaded = await sweeper.sweep(ASSET, loaded, t0 + 240, changed_since=t0 - 60)
+            assert (ASSET, 2) in sweeper._wheel
+
+            due = sweeper._wheel.advance(t0 + 60)
+            records = await sweeper.fire([key for key, _, _ in due], t0 + 60)
+            assert [r.id for r in records] == [2]
+
+            # 回看窗口与上次重叠, 已触发的同一到期时间不会再次加入
+            await sweeper.sweep(ASSET, loaded, t0 + 300, changed_since=t0 - 60)
+            assert (ASSET, 2) not in sweeper._wheel
+            assert (ASSET, 1) in sweeper._wheel
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_expiry_watermark_saved_only_when_records_fire(tmp_path, monkeypatch):
+    """处理进度只在首次启动和有记录触发时写入 Redis, 而不是每个 tick 都写"""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        monkeypatch.setattr(expiry_module, "entitlement_service", FakeEntitlementService(client, {}))
+        engine, factory = await _expiry_database(tmp_path / "expiry.db")
+        try:
+            now = time.time()
+            async with engine.begin() as conn:
+                await conn.execute(insert(UserAsset.__table__).values(_asset(1, now + 0.2, now)))
+
+            sweeper = ExpirySweeper(client, session_factory=lambda: factory, sweep_interval=60, tick=0.05)
+            fired = []
+
+            @sweeper.add_handler
+            async def record(records):
+                fired.extend(records)
+
+            saved = []
+            save = sweeper._save_watermark
+
+            async def save_watermark(value):
+                saved.append(value)
+                await save(value)
+
+            sweeper._save_watermark = save_watermark
+            task = asyncio.create_task(sweeper._run())
+            await asyncio.sleep(0.6)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            assert [r.id for r in fired] == [1]
+            assert len(saved) == 2
+            assert float(await client.get("expiry:watermark")) == saved[-1] >= now + 0.2
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
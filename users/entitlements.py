@@ -0,0 +1,368 @@
+"""
+用户权益(资产使用权)检查
+"""
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+import redis
+from fastapi import Depends, HTTPException
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from starlette import status
+from starlette.requests import Request
+
+from common.configs import settings
+from common.jwt import get_current_claims
+from common.log import logger
+from common.lru import LRUCache
+from common.redis import async_redis_client
+from db.models import AssetType, Order, OrderStatus, UserAsset
+from db.session import get_session_factory
+
+# (资产类型, 资产ID) -> 过期时间戳, None 表示永久有效
+Entitlements = Dict[Tuple[str, str], Optional[float]]
+
+# 标记集合已构建, 区分 "没有任何资产" 和 "尚未加载"
+_BUILT_FIELD = "__built__"
+
+# 只有代数与加载前读到的一致时才写回集合, 加载期间发生过失效则放弃写入, 不会写回旧数据
+_STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class _LeaderCancelled(Exception):
+    """负责加载的请求被取消, 等待者需要重新发起加载"""
+
+
+def _field(asset_type, asset_id: str) -> str:
+    asset_type = asset_type.value if isinstance(asset_type, AssetType) else asset_type
+    return f"{asset_type}:{asset_id}"
+
+
+class EntitlementService:
+    """用户权益索引
+
+    每个用户的有效资产保存为 Redis 哈希 ``entitlements:<用户ID>``, 字段为
+    ``<资产类型>:<资产ID>``, 值为过期时间戳(永久有效为空字符串). 集合在首次检查时从
+    数据库加载, 本 worker 另有一层短时的本地缓存. 集合和本地条目的存活时间都不超过
+    其中最早的资产过期时间, 资产过期后会自动重建.
+
+    资产变化(订单支付、资产增删改)时调用 ``invalidate``, 通过发布/订阅通知所有 worker.
+    每次失效都会递增用户的代数 ``entitlements:<用户ID>:gen``, 加载期间代数变化时
+    不写回集合, 也不放入本地缓存, 避免失效之前查到的旧数据覆盖失效结果.
+
+    Args:
+        client: 异步 Redis 客户端
+        session_factory: 返回数据库会话工厂的函数
+        ttl: Redis 集合最长存活时间(秒)
+        maxsize: 本地缓存最大用户数
+        local_ttl: 本地条目最长存活时间(秒)
+        prefix: Redis 键前缀
+    """
+
+    def __init__(
+        self,
+        client,
+        session_factory: Callable = get_session_factory,
+        ttl: float = 3600.0,
+        maxsize: int = 10000,
+        local_ttl: float = 5.0,
+        prefix: str = "entitlements",
+    ):
+        self.client = client
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.prefix = prefix
+        self.channel = f"{prefix}:invalidate"
+        self._local: LRUCache[Entitlements] = LRUCache(maxsize=maxsize)
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._listener: Optional[asyncio.Task] = None
+        # 本 worker 收到的失效次数, 加载期间变化时不写入本地缓存
+        self._epoch = 0
+        self._store = client.register_script(_STORE_SCRIPT)
+
+    async def has_access(self, user_id: int, asset_type, asset_id: str) -> bool:
+        """
+        检查用户是否拥有未过期的资产
+
+        Args:
+            user_id: 用户ID
+            asset_type: 资产类型
+            asset_id: 资产ID
+
+        Returns:
+            是否拥有
+        """
+        entitlements = await self.get(user_id)
+        asset_type = asset_type.value if isinstance(asset_type, AssetType) else asset_type
+        key = (asset_type, str(asset_id))
+        if key not in entitlements:
+            return False
+        expire_at = entitlements[key]
+        return expire_at is None or expire_at > time.time()
+
+    async def get(self, user_id: int) -> Entitlements:
+        """
+        获取用户的全部有效资产
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            (资产类型, 资产ID) -> 过期时间戳
+        """
+        while True:
+            entitlements = self._local.get(user_id)
+            if entitlements is not None:
+                return entitlements
+            inflight = self._inflight.get(user_id)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                # 负责加载的请求被取消(例如客户端断开), 由等待者之一接手重新加载
+                continue
+
+        self._ensure_listener()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        epoch = self._epoch
+        try:
+            entitlements = await self._load(user_id)
+            if self._epoch == epoch:
+                self._local.set(user_id, entitlements, ttl=self._ttl_for(entitlements, self.local_ttl))
+            future.set_result(entitlements)
+            return entitlements
+        except asyncio.CancelledError:
+            # 不把取消传给等待者, 否则一个客户端断开会让该用户的所有并发检查失败
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(user_id, None)
+
+    async def invalidate(self, *user_ids: int) -> None:
+        """
+        删除用户的权益集合, 并通知所有 worker 清理本地缓存
+
+        Args:
+            user_ids: 用户ID列表
+        """
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return
+        self._forget(user_ids)
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.incr(self._generation_key(user_id))
+                    pipe.expire(self._generation_key(user_id), max(1, int(self.ttl)))
+                pipe.delete(*(self._key(u) for u in user_ids))
+                pipe.publish(self.channel, json.dumps(user_ids))
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"清理用户权益缓存失败 {user_ids}: {e}")
+
+    async def close(self) -> None:
+        """停止失效通知监听"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+    async def _load(self, user_id: int) -> Entitlements:
+        key = self._key(user_id)
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.hgetall(key)
+                pipe.get(self._generation_key(user_id))
+                cached, generation = await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"读取用户权益缓存失败 {user_id}: {e}")
+            return await self._query(user_id)
+        if cached.pop(_BUILT_FIELD, None) is not None:
+            return {
+                tuple(field.split(":", 1)): float(value) if value else None
+                for field, value in cached.items()
+            }
+
+        entitlements = await self._query(user_id)
+        args = [generation or "0", max(1, int(self._ttl_for(entitlements, self.ttl))), _BUILT_FIELD, "1"]
+        for (asset_type, asset_id), expire_at in entitlements.items():
+            args += [_field(asset_type, asset_id), "" if expire_at is None else repr(expire_at)]
+        try:
+            await self._store(keys=[key, self._generation_key(user_id)], args=args)
+        except redis.RedisError as e:
+            logger.warning(f"写入用户权益缓存失败 {user_id}: {e}")
+        return entitlements
+
+    async def _query(self, user_id: int) -> Entitlements:
+        """从数据库加载未过期的资产, 同一资产有多条记录时取最晚的过期时间"""
+        statement = select(UserAsset.asset_type, UserAsset.asset_id, UserAsset.expire_at).where(
+            UserAsset.user_id == user_id,
+            or_(UserAsset.expire_at.is_(None), UserAsset.expire_at > datetime.now()),
+        )
+        async with self.session_factory()() as session:
+            rows = (await session.exec(statement)).all()
+
+        entitlements: Entitlements = {}
+        for asset_type, asset_id, expire_at in rows:
+            key = (asset_type.value if isinstance(asset_type, AssetType) else asset_type, asset_id)
+            expires = None if expire_at is None else expire_at.timestamp()
+            if key in entitlements:
+                current = entitlements[key]
+                expires = None if current is None or expires is None else max(current, expires)
+            entitlements[key] = expires
+        return entitlements
+
+    @staticmethod
+    def _ttl_for(entitlements: Entitlements, ttl: float) -> float:
+        """存活时间不超过最早的资产过期时间"""
+        expiries = [e for e in entitlements.values() if e is not None]
+        if expiries:
+            ttl = min(ttl, min(expiries) - time.time())
+        return max(ttl, 0.001)
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        """订阅失效通知, 断线后重连"""
+        while True:
+            try:
+                async with self.client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        self._forget(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"用户权益失效通知订阅中断: {e}")
+                self._epoch += 1
+                self._local.clear()
+                await asyncio.sleep(1)
+
+    def _forget(self, user_ids: Iterable[int]) -> None:
+        self._epoch += 1
+        for user_id in user_ids:
+            self._local.pop(user_id)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}:gen"
+
+
+entitlement_service = EntitlementService(
+    async_redis_client,
+    ttl=settings.entitlement_ttl,
+    maxsize=settings.entitlement_local_maxsize,
+    local_ttl=settings.entitlement_local_ttl,
+)
+
+# 提交后触发的失效任务, 保留引用直到完成, 避免任务被垃圾回收
+_pending_invalidations: Set[asyncio.Task] = set()
+
+
+def _changed_users(session: Session) -> Set[int]:
+    """本次 flush 中资产发生变化或订单变为已支付的用户"""
+    user_ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, UserAsset) and obj.user_id is not None:
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Order) and obj.user_id is not None:
+            if OrderStatus.PAID in inspect(obj).attrs.status.history.added:
+                user_ids.add(obj.user_id)
+    return user_ids
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_users(session: Session, flush_context, instances) -> None:
+    session.info.setdefault("entitlement_users", set()).update(_changed_users(session))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    user_ids = session.info.pop("entitlement_users", None)
+    if not user_ids:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # 同步代码中提交(例如脚本), 没有事件循环可用
+        return
+    task = loop.create_task(entitlement_service.invalidate(*user_ids))
+    _pending_invalidations.add(task)
+    task.add_done_callback(_pending_invalidations.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop("entitlement_users", None)
+
+
+async def invalidate_entitlements(user_ids: Iterable[int]) -> None:
+    """
+    使用户权益缓存失效
+
+    通过 ORM 提交的资产和订单变化会自动触发; 批量 UPDATE/INSERT 等绕过 ORM 的写入需要
+    在提交后显式调用.
+
+    Args:
+        user_ids: 用户ID列表
+    """
+    await entitlement_service.invalidate(*user_ids)
+
+
+def require_entitlement(asset_type: AssetType, param: str):
+    """
+    FastAPI 依赖工厂: 要求当前用户拥有路径参数指定的资产
+
+    Args:
+        asset_type: 资产类型
+        param: 保存资产ID的路径参数名
+
+    Returns:
+        依赖函数, 返回令牌声明; 令牌缺少用户ID时抛出 401, 未拥有资产时抛出 403
+    """
+
+    async def dependency(request: Request, claims: dict = Depends(get_current_claims)) -> dict:
+        try:
+            user_id = int(claims["sub"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token subject",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        asset_id = request.path_params.get(param)
+        if asset_id is None or not await entitlement_service.has_access(user_id, asset_type, asset_id):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="No access to this asset",
+            )
+        return claims
+
+    return dependency
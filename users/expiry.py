@@ -0,0 +1,312 @@
+"""
+会员与资产到期处理
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import redis
+from pydantic import BaseModel, Field
+from sqlalchemy import tuple_
+from sqlmodel import select
+
+from common.configs import settings
+from common.leader import LeaderLock
+from common.log import logger
+from common.redis import async_redis_client
+from common.wheel import TimingWheel
+from db.models import User, UserAsset
+from db.session import get_session_factory
+from .entitlements import entitlement_service
+
+MEMBERSHIP = "membership"
+ASSET = "asset"
+
+
+class ExpiredRecord(BaseModel):
+    """到期的会员或资产"""
+
+    kind: str = Field(description="类型: membership 或 asset")
+    id: int = Field(description="用户ID或资产ID")
+    user_id: int = Field(description="用户ID")
+    expire_at: datetime = Field(description="到期时间")
+    asset_type: Optional[str] = Field(default=None, description="资产类型, 仅资产有效")
+    asset_id: Optional[str] = Field(default=None, description="资产ID, 仅资产有效")
+
+
+ExpiryHandler = Callable[[List[ExpiredRecord]], Awaitable[None]]
+
+
+class ExpirySweeper:
+    """会员和资产的到期调度
+
+    只在 leader worker 上运行(见 ``LeaderLock``). 每 ``sweep_interval`` 秒按
+    (到期时间, ID) 的键集顺序, 通过部分索引分批加载未来 ``horizon`` 秒内到期的记录,
+    放入时间轮; 时间轮每 ``tick`` 秒推进一次, 到期的记录在触发前批量回查数据库,
+    续期过的跳过. 因此数据库只是每个扫描周期查询一次, 而不是每秒轮询.
+
+    加载窗口只向前推进, 新增或修改后到期时间落在已加载窗口内的记录不会被向前扫描看到,
+    因此每次扫描还按 ``updated_at`` 回看上次扫描以来修改过的记录(多回看一个周期,
+    覆盖扫描时尚未提交的事务). 已经触发过的同一到期时间不会重复加入.
+
+    触发时使相关用户的权益缓存失效, 并依次调用 ``add_handler`` 注册的处理函数.
+    已处理到的时间点在有记录触发时保存到 Redis, leader 切换后从该处继续;
+    没有记录时从当前时间开始, 不补发历史到期.
+
+    Args:
+        client: 异步 Redis 客户端
+        session_factory: 返回数据库会话工厂的函数
+        sweep_interval: 扫描数据库的间隔(秒)
+        batch_size: 每次查询的最大行数
+        tick: 时间轮的精度(秒)
+        leader_ttl: leader 锁的存活时间(秒)
+        prefix: Redis 键前缀
+    """
+
+    def __init__(
+        self,
+        client,
+        session_factory: Callable = get_session_factory,
+        sweep_interval: float = 60.0,
+        batch_size: int = 500,
+        tick: float = 1.0,
+        leader_ttl: float = 30.0,
+        prefix: str = "expiry",
+    ):
+        self.client = client
+        self.session_factory = session_factory
+        self.sweep_interval = sweep_interval
+        # 加载窗口覆盖两个扫描周期, 一次扫描失败也不会漏掉
+        self.horizon = sweep_interval * 2
+        self.batch_size = batch_size
+        self.tick = tick
+        self.prefix = prefix
+        self.leader = LeaderLock(client, prefix, ttl=leader_ttl)
+        self._handlers: List[ExpiryHandler] = []
+        self._wheel: Optional[TimingWheel] = None
+        # 回看窗口内已触发的 (类型, ID) -> 到期时间戳
+        self._fired: Dict[Tuple[str, int], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_handler(self, handler: ExpiryHandler) -> ExpiryHandler:
+        """
+        注册到期处理函数, 可用作装饰器
+
+        处理函数接收同一批到期的记录; 抛出的异常只记录日志, 不影响其他处理函数.
+
+        Args:
+            handler: 异步处理函数
+
+        Returns:
+            原处理函数
+        """
+        self._handlers.append(handler)
+        return handler
+
+    def start(self) -> None:
+        """启动 leader 竞争(已启动时忽略)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.leader.run(self._run))
+
+    async def stop(self) -> None:
+        """停止调度并释放 leader 锁"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """leader 上的主循环"""
+        watermark = await self._load_watermark()
+        if watermark is None:
+            watermark = time.time()
+            await self._save_watermark(watermark)
+        self._wheel = TimingWheel(self.tick, slots=int(self.horizon / self.tick) + 2, start=watermark)
+        loaded = {kind: (watermark, 0) for kind in (MEMBERSHIP, ASSET)}
+        # 首次扫描从水位向前加载, 无需回看
+        changed_since: Optional[float] = None
+        next_sweep = 0.0
+        try:
+            while True:
+                now = time.time()
+                if now >= next_sweep:
+                    try:
+                        for kind in loaded:
+                            loaded[kind] = await self.sweep(kind, loaded[kind], now + self.horizon, changed_since)
+                        changed_since = now - self.sweep_interval
+                        self._fired = {k: t for k, t in self._fired.items() if t > changed_since}
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.warning(f"扫描到期记录失败: {e}")
+                    next_sweep = now + self.sweep_interval
+
+                due = self._wheel.advance(now)
+                if due:
+                    await self.fire([key for key, _, _ in due], now)
+                    await self._save_watermark(now)
+                await asyncio.sleep(self.tick)
+        finally:
+            self._wheel = None
+            self._fired = {}
+
+    async def sweep(
+        self,
+        kind: str,
+        after: Tuple[float, int],
+        until: float,
+        changed_since: Optional[float] = None,
+    ) -> Tuple[float, int]:
+        """
+        把 (after, until] 内到期的记录加入时间轮
+
+        Args:
+            kind: membership 或 asset
+            after: 上次加载到的 (到期时间戳, ID)
+            until: 本次加载到的时间戳
+            changed_since: 回看在该时间之后修改、到期时间落在 (changed_since, after] 内的记录
+
+        Returns:
+            下次扫描的起点
+        """
+        column, model = self._column(kind)
+        position = (datetime.fromtimestamp(after[0]), after[1])
+        async with self.session_factory()() as session:
+            if changed_since is not None:
+                await self._sweep_changed(session, kind, changed_since, after[0])
+            while True:
+                rows = (
+                    await session.exec(
+                        select(column, model.id)
+                        .where(
+                            column.is_not(None),
+                            tuple_(column, model.id) > tuple_(*position),
+                            column <= datetime.fromtimestamp(until),
+                        )
+                        .order_by(column, model.id)
+                        .limit(self.batch_size)
+                    )
+                ).all()
+                for expire_at, record_id in rows:
+                    self._wheel.add((kind, record_id), expire_at.timestamp())
+                if rows:
+                    position = tuple(rows[-1])
+                if len(rows) < self.batch_size:
+                    break
+        # 最后一行之后直到 until 都没有记录, 下次从 until 继续
+        return until, 0
+
+    async def _sweep_changed(self, session, kind: str, since: float, loaded: float) -> None:
+        """加入最近修改过、到期时间落在已加载窗口内的记录, 按ID键集分页"""
+        column, model = self._column(kind)
+        last_id = 0
+        while True:
+            rows = (
+                await session.exec(
+                    select(column, model.id)
+                    .where(
+                        column.is_not(None),
+                        model.updated_at > datetime.fromtimestamp(since),
+                        column > datetime.fromtimestamp(since),
+                        column <= datetime.fromtimestamp(loaded),
+                        model.id > last_id,
+                    )
+                    .order_by(model.id)
+                    .limit(self.batch_size)
+                )
+            ).all()
+            for expire_at, record_id in rows:
+                deadline = expire_at.timestamp()
+                if self._fired.get((kind, record_id)) != deadline:
+                    self._wheel.add((kind, record_id), deadline)
+            if len(rows) < self.batch_size:
+                break
+            last_id = rows[-1][1]
+
+    async def fire(self, keys: Sequence[Tuple[str, int]], now: float) -> List[ExpiredRecord]:
+        """
+        回查数据库确认记录仍然到期, 然后触发处理
+
+        Args:
+            keys: (类型, ID) 列表
+            now: 当前时间戳
+
+        Returns:
+            实际到期的记录
+        """
+        ids: Dict[str, List[int]] = {}
+        for kind, record_id in keys:
+            ids.setdefault(kind, []).append(record_id)
+
+        cutoff = datetime.fromtimestamp(now)
+        records: List[ExpiredRecord] = []
+        async with self.session_factory()() as session:
+            for kind, chunk_ids in ids.items():
+                column, model = self._column(kind)
+                for i in range(0, len(chunk_ids), self.batch_size):
+                    chunk = chunk_ids[i:i + self.batch_size]
+                    if kind == MEMBERSHIP:
+                        statement = select(User.id, User.id.label("user_id"), User.membership_expires)
+                    else:
+                        statement = select(
+                            UserAsset.id,
+                            UserAsset.user_id,
+                            UserAsset.expire_at,
+                            UserAsset.asset_type,
+                            UserAsset.asset_id,
+                        )
+                    rows = await session.exec(statement.where(model.id.in_(chunk), column <= cutoff))
+                    for record_id, user_id, expire_at, *asset in rows:
+                        record = ExpiredRecord(kind=kind, id=record_id, user_id=user_id, expire_at=expire_at)
+                        if asset:
+                            record.asset_type = getattr(asset[0], "value", asset[0])
+                            record.asset_id = asset[1]
+                        records.append(record)
+                        self._fired[(kind, record_id)] = expire_at.timestamp()
+        if not records:
+            return records
+
+        await entitlement_service.invalidate(*(r.user_id for r in records if r.kind == ASSET))
+        logger.info(
+            f"到期: 会员 {sum(r.kind == MEMBERSHIP for r in records)} 个, "
+            f"资产 {sum(r.kind == ASSET for r in records)} 个"
+        )
+        for handler in self._handlers:
+            try:
+                await handler(records)
+            except Exception as e:
+                logger.exception(f"到期处理函数 {getattr(handler, '__name__', handler)} 失败: {e}")
+        return records
+
+    async def _load_watermark(self) -> Optional[float]:
+        try:
+            value = await self.client.get(f"{self.prefix}:watermark")
+        except redis.RedisError as e:
+            logger.warning(f"读取到期处理进度失败: {e}")
+            return time.time()
+        return float(value) if value else None
+
+    async def _save_watermark(self, now: float) -> None:
+        try:
+            await self.client.set(f"{self.prefix}:watermark", repr(now))
+        except redis.RedisError as e:
+            logger.warning(f"保存到期处理进度失败: {e}")
+
+    @staticmethod
+    def _column(kind: str):
+        if kind == MEMBERSHIP:
+            return User.membership_expires, User
+        return UserAsset.expire_at, UserAsset
+
+
+expiry_sweeper = ExpirySweeper(
+    async_redis_client,
+    sweep_interval=settings.expiry_sweep_interval,
+    batch_size=settings.expiry_batch_size,
+    tick=settings.expiry_tick,
+    leader_ttl=settings.expiry_leader_ttl,
+)